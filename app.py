@@ -1,15 +1,71 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_from_directory, send_file, Response, stream_with_context, g
+from flask import before_render_template, template_rendered, has_app_context
 from werkzeug.utils import secure_filename
 import json
 import os
-from datetime import datetime
+import io
+import csv
+import zipfile
+import hashlib
+import hmac
+import zlib
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from docx import Document
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import logging
+import chart_utils
+import metrics
+import profiler
+from search_index import SearchIndex
+from work_table import WorkTable, CATEGORICAL_COLUMNS
+from compact_records import load_compact_requests, json_default
+from snapshot import SnapshotStore, Snapshot
+from archive import ColdArchive
+from ids import new_id
+from timestamps import DateIndex, stamp, thai_date, REQUEST_DATE_FIELDS, NOTIFICATION_DATE_FIELDS, BATCH_DATE_FIELDS
+from idempotency import IdempotencyStore, DONE, PENDING
+from changes import ChangeFeed, batch_state, request_state
+from backup import lock_shared, unlock
+from fragment_cache import FragmentCache
+from markupsafe import Markup
+import uuid
+from datetime import datetime, timedelta
 import tempfile
+import heapq
+import itertools
+import time
+import fcntl
+from contextlib import contextmanager
 
 app = Flask(__name__)
 app.secret_key = "academic_secret_key"
+app.json.default = json_default  # tojson/jsonify on compact request records
+app.add_template_filter(thai_date, 'thai_date')  # ISO timestamps are shown in Thai only when rendered
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'pdf', 'doc', 'docx', 'zip', 'rar'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['CACHE_FOLDER'] = 'cache'
+ROUND_SUMMARY_FOLDER = 'round_summaries'
+ROUND_DECISIONS_FOLDER = 'round_decisions'
+SNAPSHOT_FOLDER = 'snapshots'
+ARCHIVE_FOLDER = 'archive'
+PROFILE_FOLDER = 'profiles'
+IDEMPOTENCY_FOLDER = 'idempotency'
+CHANGES_FILE = 'changes.log'
+# A new token per requests.json save; lists read at the current one need no merge on save
+REQUESTS_GENERATION_FILE = 'requests.generation'
+# Serve read-only request loads from a shared mmap snapshot (enabled by gunicorn.conf.py)
+app.config['SHARED_SNAPSHOT'] = os.environ.get('SHARED_SNAPSHOT') == '1'
+
+# Worker pool for document/chart rendering kept off the request path
+_background_executor = ThreadPoolExecutor(max_workers=2)
+_background_jobs = {}
+_background_lock = threading.Lock()
+_scheduler_lock_file = None
+_scheduler_checked = False
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB limit
 
 if not os.path.exists(UPLOAD_FOLDER):
@@ -24,16 +80,53 @@ def load_data(filename):
         with open(filename, 'w', encoding='utf-8') as f:
             json.dump([], f, ensure_ascii=False, indent=4)
         return []
-    if os.path.getsize(filename) == 0: return []
+    if filename == 'requests.json':
+        # Read before the file: a save after this point changes the token (see save_requests)
+        generation = read_requests_generation()
+        return LoadedRequests(load_data_file(filename), generation)
+    return load_data_file(filename)
+
+def load_data_file(filename):
+    size = os.path.getsize(filename)
+    metrics.record('load_data', read=size)
+    if size == 0: return []
     try:
-        with open(filename, 'r', encoding='utf-8') as f:
+        with open(filename, 'r', encoding='utf-8') as f, metrics.timed('parse'):
             return json.load(f)
     except: return []
 
+class LoadedRequests(list):
+    # requests.json as read by load_data, with the save generation it was read at
+    def __init__(self, records=(), generation=None):
+        super().__init__(records)
+        self.generation = generation
+
+def read_requests_generation():
+    try:
+        with open(REQUESTS_GENERATION_FILE, 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def load_requests_readonly():
+    # Compact slot-based records for paths that only read requests; writers keep plain dicts
+    if not os.path.exists('requests.json') or os.path.getsize('requests.json') == 0:
+        return load_data('requests.json')
+    if app.config['SHARED_SNAPSHOT']:
+        # A lazily decoded sequence: records are parsed one at a time as they are read
+        return current_requests_snapshot()
+    metrics.record('load_data', read=os.path.getsize('requests.json'))
+    try:
+        with metrics.timed('parse'):
+            return load_compact_requests('requests.json')
+    except ValueError: return []
+
 def load_config(filename, default=None):
     try:
         with open(filename, 'r', encoding='utf-8') as f:
-            return json.load(f)
+            metrics.record('load_config', read=os.fstat(f.fileno()).st_size)
+            with metrics.timed('parse'):
+                return json.load(f)
     except: return default
 
 def to_thai_year(date_obj):
@@ -175,7 +268,11 @@ def is_within_timeline():
 
 
 
-def get_remaining_days(start_date_str, limit_days=7):
+EDIT_WINDOW_DAYS = 7
+APPEAL_WINDOW_DAYS = 7
+DEADLINE_REMINDER_DAYS = 2
+
+def get_remaining_days(start_date_str, limit_days=EDIT_WINDOW_DAYS):
     if not start_date_str: return limit_days
     start_dt = parse_thai_date(start_date_str)
     if not start_dt: return limit_days
@@ -190,9 +287,8 @@ def get_current_fiscal_year():
     return today.year + 543
 
 def create_notification(message, recipient_role=None, recipient_username=None, req_id=None):
-    notifs = load_data('notifications.json')
     new_notif = {
-        "id": f"NOTIF-{datetime.now().strftime('%Y%m%d%H%M%S')}-{os.urandom(4).hex()}",
+        "id": new_id('NOTIF'),
         "message": message,
         "recipient_role": recipient_role,
         "recipient_username": recipient_username,
@@ -200,23 +296,722 @@ def create_notification(message, recipient_role=None, recipient_username=None, r
         "is_read": False,
         "timestamp": format_thai_date(datetime.now(), True)
     }
-    notifs.insert(0, new_notif)
-    save_data('notifications.json', notifs)
+    stamp(new_notif, NOTIFICATION_DATE_FIELDS)
+    if has_app_context():
+        # Written together by flush_notifications once the request (or scheduler tick) succeeded
+        g.setdefault('new_notifications', []).append(new_notif)
+    else:
+        save_notifications([new_notif])
+
+def save_notifications(new_notifs):
+    with store_write_lock():  # The deadline scheduler adds notifications while handlers do
+        notifs = load_data('notifications.json')
+        notifs[:0] = reversed(new_notifs)  # Newest first
+        save_data('notifications.json', notifs)
+
+def flush_notifications():
+    pending = g.pop('new_notifications', None)
+    if pending:
+        save_notifications(pending)
 
-def save_data(filename, data):
+def save_data(filename, data, compact=False):
     # Create a temporary file in the same directory as the target
     dir_name = os.path.dirname(os.path.abspath(filename))
     fd, temp_path = tempfile.mkstemp(dir=dir_name, text=True)
     try:
-        with os.fdopen(fd, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-        # Rename the temp file to the target filename (atomic on most OS)
-        os.replace(temp_path, filename)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f, metrics.timed('dump'):
+            if compact:
+                # Derived stores nobody edits by hand: the C encoder, in one write
+                f.write(json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=json_default))
+            else:
+                json.dump(data, f, ensure_ascii=False, indent=4, default=json_default)
+        metrics.record('save_data', written=os.path.getsize(temp_path))
+        # Rename the temp file to the target filename (atomic on most OS). Only the rename
+        # is a write a backup could see, so only it holds the data lock.
+        with data_write_lock():
+            os.replace(temp_path, filename)
     except Exception as e:
         if os.path.exists(temp_path):
             os.remove(temp_path)
         raise e
 
+_data_lock_state = threading.local()
+
+@contextmanager
+def data_write_lock():
+    # Shared side of the backup lock (see backup.py), held only while data files are written
+    # so a backup never lands between the files of one save. Re-entrant within a thread:
+    # asking for it again while a backup waits at the gate would never be granted. Inside a
+    # store-lock section it is kept from the first write until the section ends, so the
+    # section's files (batches.json, requests.json, its derived stores) are backed up together.
+    if getattr(_data_lock_state, 'lock_file', None) is None:
+        _data_lock_state.lock_file = lock_shared()
+    _data_lock_state.depth = getattr(_data_lock_state, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _data_lock_state.depth -= 1
+        if _data_lock_state.depth == 0 and not getattr(_data_lock_state, 'in_store', False):
+            release_data_lock()
+
+def release_data_lock():
+    lock_file = getattr(_data_lock_state, 'lock_file', None)
+    if lock_file is not None:
+        _data_lock_state.lock_file = None
+        unlock(lock_file)
+
+# Derived stores (aggregates, queues, deadlines, ...) are read-modify-written by every save.
+# STORE_LOCK_FILE serializes those writes across worker processes; the thread lock and depth
+# count let a caller that already holds it (the deadline scheduler) call save_requests.
+STORE_LOCK_FILE = '.store.lock'
+_store_lock = threading.RLock()
+_store_lock_depth = 0
+
+@contextmanager
+def store_write_lock():
+    global _store_lock_depth
+    # The data lock is taken after this one, by the section's first write: nothing waits for
+    # the store lock while holding the data lock, so a pending backup cannot deadlock us
+    with _store_lock:
+        lock_file = None
+        if _store_lock_depth == 0:
+            lock_file = open(STORE_LOCK_FILE, 'a')
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            _data_lock_state.in_store = True
+        _store_lock_depth += 1
+        try:
+            yield
+        finally:
+            _store_lock_depth -= 1
+            if lock_file is not None:
+                _data_lock_state.in_store = False
+                if getattr(_data_lock_state, 'depth', 0) == 0:
+                    release_data_lock()
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+
+class ConcurrentEditError(Exception):
+    """A request being saved was changed by another save since the caller read it."""
+
+def merge_concurrent_saves(all_reqs, changed_reqs, removed_ids):
+    # all_reqs was read before the store lock was taken. When requests.json was saved since,
+    # this save's changes are applied to the current file instead of writing the stale list
+    # back over the other save (an auto-cancel, another worker's decision, ...). A changed
+    # request whose version on disk is not the one the caller read was edited by that other
+    # save too: nothing is written and the caller gets ConcurrentEditError.
+    generation = getattr(all_reqs, 'generation', None)
+    if generation is not None and generation == read_requests_generation():
+        return
+    changed = {r['id']: r for r in changed_reqs}
+    current = load_data('requests.json')
+    for r in current:
+        mine = changed.get(r['id'])
+        if mine is not None and mine.get('version', 0) != r.get('version', 0):
+            raise ConcurrentEditError(r['id'])
+    merged = [changed.pop(r['id'], r) for r in current if r['id'] not in removed_ids]
+    merged += [r for r in changed_reqs if r['id'] in changed]  # New requests, still in the caller's order
+    all_reqs[:] = merged
+
+def write_requests_generation(all_reqs):
+    generation = uuid.uuid4().hex
+    with open(REQUESTS_GENERATION_FILE, 'w', encoding='utf-8') as f:
+        f.write(generation)
+    if isinstance(all_reqs, LoadedRequests):
+        all_reqs.generation = generation  # The caller's list is now the saved one
+
+def save_requests(all_reqs, changed_reqs, removed_ids=()):
+    # Single write path for requests.json so derived stores stay in sync.
+    # removed_ids: requests all_reqs left out on purpose (moved to the cold archive)
+    with store_write_lock():
+        merge_concurrent_saves(all_reqs, changed_reqs, set(removed_ids))
+        indexes_in_sync = memory_indexes_in_sync()
+        for r in changed_reqs:
+            stamp(r, REQUEST_DATE_FIELDS)
+            r['version'] = r.get('version', 0) + 1  # Keys cached fragments (see cached_fragment)
+        with _change_feed.writing() as feed:
+            changes = feed.diff(changed_reqs)
+            # No token while the file is being replaced: a crash in between forces the merge
+            if os.path.exists(REQUESTS_GENERATION_FILE):
+                os.remove(REQUESTS_GENERATION_FILE)
+            save_data('requests.json', all_reqs)
+            write_requests_generation(all_reqs)
+            feed.append(changes)
+        update_aggregates(changed_reqs, all_reqs)
+        refresh_round_summaries(changed_reqs, all_reqs)
+        update_work_queues(changed_reqs, all_reqs)
+        schedule_deadlines(changed_reqs, all_reqs)
+        update_memory_indexes(changed_reqs, all_reqs, indexes_in_sync)
+
+# --- In-memory request indexes (full-text search, columnar work table) ---
+# Each process keeps its own copy. They are updated in place on our own saves. Saves by
+# other processes are caught up from the shared snapshot's append log: only the records
+# appended since the snapshot the index was synced to are re-indexed. Without the shared
+# snapshot, or once it has started a new base generation, the index is rebuilt.
+_memory_indexes = {'search': SearchIndex(), 'works': WorkTable(), 'dates': DateIndex()}
+_memory_index_synced = {}  # name -> (requests_state() it reflects, Snapshot it was synced from)
+_snapshot_store = SnapshotStore(SNAPSHOT_FOLDER)
+_change_feed = ChangeFeed(CHANGES_FILE, load_requests_readonly)
+
+def record_batch_change(kind, batch):
+    _change_feed.record([{"type": kind, "id": batch['id'], "record": batch_state(batch)}])
+
+def record_request_changes(kind, reqs):
+    # Moves in and out of the cold archive: the records themselves did not change
+    _change_feed.record([{"type": kind, "id": r['id'], "record": request_state(r)} for r in reqs])
+
+def requests_file_mtime():
+    try:
+        return os.stat('requests.json').st_mtime_ns
+    except OSError:
+        return None
+
+def requests_state():
+    # Every save writes a new generation token; the mtime also catches files replaced by a restore
+    return read_requests_generation(), requests_file_mtime()
+
+def memory_indexes_in_sync():
+    state = requests_state()
+    in_sync = {name: name in _memory_index_synced and _memory_index_synced[name][0] == state
+               for name in _memory_indexes}
+    snap = _snapshot_store.current() if app.config['SHARED_SNAPSHOT'] else None
+    in_sync['snapshot'] = snap is not None and snap.source_mtime == state[1]
+    return in_sync
+
+def catch_up_memory_index(index, synced, snap):
+    # Re-index the records the snapshot's log gained since `synced`, the snapshot the index
+    # already reflects; a different base means records were removed or reordered
+    if synced is None or synced.base is not snap.base or snap.log_offset < synced.log_offset:
+        index.rebuild(snap)
+        return
+    for position, (start, _) in snap.patches.items():
+        if start >= synced.log_offset:
+            index.update_request(snap[position])
+
+def get_memory_index(name):
+    index = _memory_indexes[name]
+    with index.lock:
+        state = requests_state()  # Read first: what is loaded below is at least this new
+        synced = _memory_index_synced.get(name)
+        if synced is None or synced[0] != state:
+            if app.config['SHARED_SNAPSHOT']:
+                snap = current_requests_snapshot()
+                catch_up_memory_index(index, synced and synced[1], snap)
+            else:
+                snap = None
+                index.rebuild(load_requests_readonly())
+            _memory_index_synced[name] = (state, snap)
+    return index
+
+def update_memory_indexes(changed_reqs, all_reqs, in_sync):
+    snap = None
+    if app.config['SHARED_SNAPSHOT']:
+        # Only the changed records are appended when the snapshot matches the file we just replaced
+        snap = _snapshot_store.publish(all_reqs, requests_file_mtime(), changed_reqs if in_sync['snapshot'] else None)
+    for name, index in _memory_indexes.items():
+        with index.lock:
+            synced = _memory_index_synced.get(name)
+            if synced is None:
+                continue  # Never built in this process; the first query builds it
+            if in_sync[name]:
+                for r in changed_reqs:
+                    index.update_request(r)
+                if len(index) != len(all_reqs):
+                    index.rebuild(all_reqs)  # Requests were removed
+            elif snap is not None:
+                catch_up_memory_index(index, synced[1], snap)  # Other processes' saves, then this one
+            else:
+                index.rebuild(all_reqs)
+            _memory_index_synced[name] = (requests_state(), snap)
+
+def current_requests_snapshot():
+    # Latest published snapshot, republished from requests.json when missing or stale
+    snap = _snapshot_store.current()
+    if snap is None or snap.source_mtime != requests_file_mtime():
+        with store_write_lock():
+            snap = _snapshot_store.current()
+            mtime = requests_file_mtime()
+            if snap is None or snap.source_mtime != mtime:
+                snap = _snapshot_store.publish(load_compact_requests('requests.json'), mtime)
+    return snap
+
+def warm_shared_state():
+    # Run in the master before it forks workers (see gunicorn.conf.py): they inherit the
+    # mapped snapshot, the built indexes and the loaded stores instead of each building them
+    if app.config['SHARED_SNAPSHOT']:
+        current_requests_snapshot()
+    for name in _memory_indexes:
+        get_memory_index(name)
+    _change_feed.catch_up()
+    load_aggregates()
+    load_work_queues()
+    load_deadlines()
+
+# --- Cold archive of closed fiscal years ---
+# Closed years are moved out of requests.json; reads that need history go through
+# requests_for_ids / find_archived_request, everything else only sees the live cycle.
+_cold_archive = ColdArchive(ARCHIVE_FOLDER)
+CLOSED_STATUSES = {'อนุมัติ', 'อนุมัติบางส่วน', 'ยกเลิก', 'แบบร่าง'}
+
+def is_request_closed(r):
+    if r.get('status') in CLOSED_STATUSES:
+        return True
+    # A rejection is final once the appeal window has passed or the appeal was decided
+    return r.get('status') == 'ไม่อนุมัติ' and bool(r.get('appeal_closed') or r.get('appeal'))
+
+def fiscal_year_archive_status(all_reqs):
+    current_fy = get_current_fiscal_year()
+    years = {}
+    for r in all_reqs:
+        fy = str(r.get('fiscal_year', ''))
+        info = years.setdefault(fy, {"fiscal_year": fy, "count": 0, "open": 0})
+        info['count'] += 1
+        if not is_request_closed(r): info['open'] += 1
+    for info in years.values():
+        info['archivable'] = info['fiscal_year'].isdigit() and int(info['fiscal_year']) < current_fy and info['open'] == 0
+    return sorted(years.values(), key=lambda x: x['fiscal_year'], reverse=True)
+
+def requests_for_ids(all_reqs, req_ids):
+    # Requests of a round, reading through to the archive for rounds of closed years
+    wanted = set(req_ids)
+    if isinstance(all_reqs, Snapshot):
+        # Decodes only these records, still in file order
+        found = [all_reqs[i] for i in sorted(i for i in map(all_reqs.position_of, wanted) if i is not None)]
+    else:
+        found = [r for r in all_reqs if r['id'] in wanted]
+    if len(found) < len(wanted):
+        have = {r['id'] for r in found}
+        found += [r for r in (_cold_archive.get(i) for i in req_ids if i not in have) if r is not None]
+    return found
+
+def find_archived_request(req_id):
+    return _cold_archive.get(req_id)
+
+# --- Fiscal-year aggregate cube ---
+# Cells are keyed by (fiscal_year, faculty, department, position, work_type, status).
+# Request-level measures sit in work_type '*', work-level measures under the work's type.
+# Each fiscal year's cells and rollups are stored in their own file, so a save rewrites
+# only the years its requests count towards; aggregates.json lists the years.
+AGGREGATES_FILE = 'aggregates.json'
+AGGREGATES_FOLDER = 'aggregates'
+# Last contribution of each request, only read on writes to compute deltas. Spread over
+# shard files by request id so a save rewrites the shards of the requests it changed,
+# not the contributions of every request.
+AGGREGATE_CONTRIBUTIONS_FOLDER = 'aggregate_contributions'
+AGGREGATE_CONTRIBUTION_SHARDS = 256
+AGGREGATE_DIMENSIONS = ['fiscal_year', 'faculty', 'department', 'position', 'work_type', 'status']
+AGGREGATE_MEASURES = ['requests', 'works', 'approved_amount', 'suggested_compensation', 'score', 'work_score', 'score_bins']
+SCORE_BIN_WIDTH = 0.25
+
+def empty_measures():
+    return {"requests": 0, "works": 0, "approved_amount": 0.0, "suggested_compensation": 0.0, "score": 0.0, "work_score": 0.0, "score_bins": {}}
+
+def score_bin(score):
+    return f"{int(float(score or 0) // SCORE_BIN_WIDTH) * SCORE_BIN_WIDTH:.2f}"
+
+def request_contributions(r):
+    info = r.get('applicant_info', {})
+    base = [str(r.get('fiscal_year') or '-'), info.get('faculty') or '-', info.get('department') or '-',
+            info.get('academic_position') or '-']
+    status = r.get('status') or '-'
+
+    req_measures = empty_measures()
+    req_measures['requests'] = 1
+    req_measures['approved_amount'] = float(r.get('approved_amount', 0) or 0)
+    req_measures['suggested_compensation'] = float(r.get('suggested_compensation', 0) or 0)
+    req_measures['score'] = float(r.get('score', 0) or 0)
+    req_measures['score_bins'] = {score_bin(r.get('score')): 1}
+    rows = {'|'.join(base + ['*', status]): req_measures}
+
+    for w in r.get('works', []):
+        key = '|'.join(base + [w.get('type') or '-', status])
+        m = rows.setdefault(key, empty_measures())
+        m['works'] += 1
+        m['work_score'] += float(w.get('score_calc', 0) or 0)
+    return rows
+
+def apply_measures(target, measures, sign):
+    for k in AGGREGATE_MEASURES:
+        if k == 'score_bins':
+            bins = target.setdefault('score_bins', {})
+            for b, n in measures.get('score_bins', {}).items():
+                bins[b] = bins.get(b, 0) + sign * n
+                if bins[b] == 0: del bins[b]
+        else:
+            target[k] = target.get(k, 0) + sign * measures.get(k, 0)
+
+def apply_contribution(agg, cell_key, measures, sign):
+    cell = agg['cells'].setdefault(cell_key, empty_measures())
+    apply_measures(cell, measures, sign)
+    if cell['requests'] == 0 and cell['works'] == 0:
+        del agg['cells'][cell_key]
+
+    # Keep one-dimension rollups (per status) so the API doesn't have to scan cells
+    values = cell_key.split('|')
+    fy_rollups = agg['rollups'].setdefault(values[0], {})
+    total = fy_rollups.setdefault('_total', {})
+    m = total.setdefault(values[5], empty_measures())
+    apply_measures(m, measures, sign)
+    if m['requests'] == 0 and m['works'] == 0:
+        del total[values[5]]
+    for dim, value in zip(AGGREGATE_DIMENSIONS[1:5], values[1:5]):
+        if dim == 'work_type' and value == '*': continue
+        by_status = fy_rollups.setdefault(dim, {}).setdefault(value, {})
+        m = by_status.setdefault(values[5], empty_measures())
+        apply_measures(m, measures, sign)
+        if m['requests'] == 0 and m['works'] == 0:
+            del by_status[values[5]]
+            if not by_status: del fy_rollups[dim][value]
+
+def contribution_shard(req_id):
+    return zlib.crc32(req_id.encode('utf-8')) % AGGREGATE_CONTRIBUTION_SHARDS
+
+def contribution_shard_path(shard):
+    return os.path.join(AGGREGATE_CONTRIBUTIONS_FOLDER, f"{shard:02x}.json")
+
+def load_contribution_shard(shard):
+    contributions = load_config(contribution_shard_path(shard))
+    return contributions if isinstance(contributions, dict) else {}
+
+def aggregate_year_path(fiscal_year):
+    return os.path.join(AGGREGATES_FOLDER, f"{secure_filename(fiscal_year) or '_'}.json")
+
+def load_aggregate_year(fiscal_year):
+    # One year's part of the cube, shaped like the whole so apply_contribution works on it
+    year = load_config(aggregate_year_path(fiscal_year))
+    if not isinstance(year, dict):
+        year = {"cells": {}, "rollups": {}}
+    return {"cells": year['cells'], "rollups": {fiscal_year: year['rollups']}}
+
+def save_aggregate_year(fiscal_year, year):
+    save_data(aggregate_year_path(fiscal_year), {"cells": year['cells'], "rollups": year['rollups'][fiscal_year]}, compact=True)
+
+def rebuild_aggregates(all_reqs):
+    agg = {"cells": {}, "rollups": {}}
+    shards = [{} for _ in range(AGGREGATE_CONTRIBUTION_SHARDS)]
+    # Archived fiscal years stay in the statistics
+    hot_ids = {r['id'] for r in all_reqs}
+    archived = [r for r in _cold_archive.all_records() if r['id'] not in hot_ids]
+    for r in itertools.chain(all_reqs, archived):
+        rows = request_contributions(r)
+        for key, m in rows.items():
+            apply_contribution(agg, key, m, 1)
+        shards[contribution_shard(r['id'])][r['id']] = rows
+    os.makedirs(AGGREGATE_CONTRIBUTIONS_FOLDER, exist_ok=True)
+    for shard, contributions in enumerate(shards):
+        save_data(contribution_shard_path(shard), contributions, compact=True)
+    os.makedirs(AGGREGATES_FOLDER, exist_ok=True)
+    for fiscal_year, rollups in agg['rollups'].items():
+        cells = {key: m for key, m in agg['cells'].items() if key.split('|', 1)[0] == fiscal_year}
+        save_aggregate_year(fiscal_year, {"cells": cells, "rollups": {fiscal_year: rollups}})
+    # Written last: the list existing means the shards and years are complete
+    save_data(AGGREGATES_FILE, {"fiscal_years": sorted(agg['rollups'])}, compact=True)
+    return agg
+
+def load_aggregates():
+    index = load_config(AGGREGATES_FILE)
+    if not isinstance(index, dict) or 'fiscal_years' not in index:
+        with store_write_lock():
+            return rebuild_aggregates(load_requests_readonly())
+    agg = {"cells": {}, "rollups": {}}
+    for fiscal_year in index['fiscal_years']:
+        year = load_aggregate_year(fiscal_year)
+        agg['cells'].update(year['cells'])
+        agg['rollups'].update(year['rollups'])
+    return agg
+
+def update_aggregates(changed_reqs, all_reqs=None):
+    # Called under store_write_lock (see save_requests)
+    index = load_config(AGGREGATES_FILE)
+    if (not isinstance(index, dict) or 'fiscal_years' not in index
+            or not os.path.isdir(AGGREGATE_CONTRIBUTIONS_FOLDER)):
+        rebuild_aggregates(all_reqs if all_reqs is not None else load_data('requests.json'))
+        return
+    # Delta update: back out the request's previous contribution, add the new one. Only the
+    # shards and fiscal years of requests whose contribution changed are read and rewritten.
+    shards = {}
+    dirty_shards = set()
+    years = {}
+    for r in changed_reqs:
+        shard = contribution_shard(r['id'])
+        if shard not in shards:
+            shards[shard] = load_contribution_shard(shard)
+        contributions = shards[shard]
+        old_rows = contributions.get(r['id'], {})
+        rows = request_contributions(r)
+        if rows == old_rows:
+            continue  # e.g. a comment or a document changed: the cube is not affected
+        for sign, changed_rows in ((-1, old_rows), (1, rows)):
+            for key, m in changed_rows.items():
+                fiscal_year = key.split('|', 1)[0]
+                if fiscal_year not in years:
+                    years[fiscal_year] = load_aggregate_year(fiscal_year)
+                apply_contribution(years[fiscal_year], key, m, sign)
+        contributions[r['id']] = rows
+        dirty_shards.add(shard)
+    for shard in dirty_shards:
+        save_data(contribution_shard_path(shard), shards[shard], compact=True)
+    if years:
+        os.makedirs(AGGREGATES_FOLDER, exist_ok=True)
+    for fiscal_year, year in years.items():
+        save_aggregate_year(fiscal_year, year)
+    if not set(years) <= set(index['fiscal_years']):
+        save_data(AGGREGATES_FILE, {"fiscal_years": sorted(set(index['fiscal_years']) | set(years))}, compact=True)
+
+# --- Per-role work queues ---
+# Each queue is a FIFO list of light entries; membership maps req_id -> queue name
+QUEUES_FILE = 'queues.json'
+WORK_QUEUES = {
+    'administration_intake': ['ส่งแล้ว', 'ผลงานผ่าน', 'ผลงานซ้ำซ้อน', 'ซ้ำซ้อนบางส่วน'],
+    'research_verification': ['รอตรวจประวัติการยื่นขอ'],
+    'committee_appeals': ['รอการอุทธรณ์', 'ยื่นอุทธรณ์', 'กำลังพิจารณาอุทธรณ์', 'รอพิจารณาอุทธรณ์'],
+    'pending_batching': ['รอเสนอพิจารณา']
+}
+QUEUE_OF_STATUS = {status: name for name, statuses in WORK_QUEUES.items() for status in statuses}
+ROLE_QUEUES = {
+    'administration': ['administration_intake', 'pending_batching'],
+    'research': ['research_verification'],
+    'committee': ['committee_appeals']
+}
+
+def queue_entry(r):
+    return {
+        "id": r['id'],
+        "applicant": r.get('applicant'),
+        "applicant_name": r.get('applicant_name'),
+        "status": r.get('status'),
+        "fiscal_year": r.get('fiscal_year'),
+        "date": r.get('date')
+    }
+
+def rebuild_work_queues(all_reqs):
+    store = {"queues": {name: [] for name in WORK_QUEUES}, "membership": {}}
+    for r in all_reqs:
+        name = QUEUE_OF_STATUS.get(r.get('status'))
+        if name:
+            store['queues'][name].append(queue_entry(r))
+            store['membership'][r['id']] = name
+    save_data(QUEUES_FILE, store, compact=True)
+    return store
+
+def load_work_queues():
+    store = load_config(QUEUES_FILE)
+    if not isinstance(store, dict) or 'queues' not in store:
+        with store_write_lock():
+            store = rebuild_work_queues(load_requests_readonly())
+    return store
+
+_queue_counts = {"mtime": None, "counts": {}}
+
+def work_queue_counts():
+    # Queue lengths for the sidebar badges; queues.json is only re-read after it changed
+    try:
+        mtime = os.stat(QUEUES_FILE).st_mtime_ns
+    except OSError:
+        mtime = None
+    if mtime is None or mtime != _queue_counts['mtime']:
+        queues = load_work_queues()['queues']
+        _queue_counts.update(mtime=mtime, counts={name: len(entries) for name, entries in queues.items()})
+    return _queue_counts['counts']
+
+def update_work_queues(changed_reqs, all_reqs=None):
+    # Called under store_write_lock (see save_requests)
+    store = load_config(QUEUES_FILE)
+    if not isinstance(store, dict) or 'queues' not in store:
+        rebuild_work_queues(all_reqs if all_reqs is not None else load_data('requests.json'))
+        return
+    # Only the changed requests move: O(length of the queues they leave)
+    moved = False
+    for r in changed_reqs:
+        old_name = store['membership'].get(r['id'])
+        new_name = QUEUE_OF_STATUS.get(r.get('status'))
+        if old_name:
+            queue = store['queues'][old_name]
+            idx = next((i for i, e in enumerate(queue) if e['id'] == r['id']), -1)
+            if old_name == new_name and idx > -1:
+                entry = queue_entry(r)
+                if queue[idx] != entry:
+                    queue[idx] = entry  # Same queue: keep its place in line
+                    moved = True
+                continue
+            if idx > -1: queue.pop(idx)
+            del store['membership'][r['id']]
+            moved = True
+        if new_name:
+            store['queues'][new_name].append(queue_entry(r))
+            store['membership'][r['id']] = new_name
+            moved = True
+    if moved:
+        save_data(QUEUES_FILE, store, compact=True)
+
+# --- Deadline scheduler ---
+# deadlines.json holds a min-heap of [due_timestamp, kind, req_id, anchor_date], and
+# 'scheduled' maps req_id -> the anchor of its current window. When a request moves on, its
+# old entries are dropped from the heap; entries are still re-checked when popped.
+DEADLINES_FILE = 'deadlines.json'
+DEADLINE_RULES = {
+    # status: (date field, window, kind prefix)
+    'แก้ไข': ('return_date', EDIT_WINDOW_DAYS, 'edit'),
+    'ไม่อนุมัติ': ('rejection_date', APPEAL_WINDOW_DAYS, 'appeal')
+}
+SCHEDULER_INTERVAL_SECONDS = 60
+
+def request_deadline_entries(r):
+    rule = DEADLINE_RULES.get(r.get('status'))
+    if not rule or r.get('appeal_closed') or r.get('appeal'):
+        return []
+    field, window, prefix = rule
+    iso = r.get(field + '_iso')
+    start_dt = datetime.fromisoformat(iso).replace(hour=0, minute=0) if iso else parse_thai_date(r.get(field))
+    if not start_dt:
+        return []
+    # get_remaining_days goes negative on the day after the last allowed day
+    expire_dt = start_dt + timedelta(days=window + 1)
+    remind_dt = expire_dt - timedelta(days=DEADLINE_REMINDER_DAYS)
+    return [[remind_dt.timestamp(), f"{prefix}_reminder", r['id'], r[field]],
+            [expire_dt.timestamp(), f"{prefix}_expire", r['id'], r[field]]]
+
+def rebuild_deadlines(all_reqs):
+    store = {"heap": [], "scheduled": {}}
+    for r in all_reqs:
+        entries = request_deadline_entries(r)
+        if entries:
+            store['heap'].extend(entries)
+            store['scheduled'][r['id']] = entries[0][3]
+    heapq.heapify(store['heap'])
+    save_data(DEADLINES_FILE, store, compact=True)
+    return store
+
+def load_deadlines():
+    store = load_config(DEADLINES_FILE)
+    if not isinstance(store, dict) or 'heap' not in store:
+        with store_write_lock():
+            store = rebuild_deadlines(load_requests_readonly())
+    return store
+
+def schedule_deadlines(changed_reqs, all_reqs=None):
+    # Called under store_write_lock (see save_requests)
+    store = load_config(DEADLINES_FILE)
+    if not isinstance(store, dict) or 'heap' not in store:
+        rebuild_deadlines(all_reqs if all_reqs is not None else load_data('requests.json'))
+        return
+    pushed, stale = [], set()
+    for r in changed_reqs:
+        entries = request_deadline_entries(r)
+        anchor = entries[0][3] if entries else None
+        if store['scheduled'].get(r['id']) == anchor:
+            continue  # Already scheduled for this window (or nothing to schedule)
+        if r['id'] in store['scheduled']:
+            stale.add(r['id'])  # Left its window or got a new one
+        pushed.extend(entries)
+        if anchor: store['scheduled'][r['id']] = anchor
+        else: store['scheduled'].pop(r['id'], None)
+    if stale:
+        store['heap'] = [e for e in store['heap'] if e[2] not in stale] + pushed
+        heapq.heapify(store['heap'])
+    else:
+        for e in pushed:
+            heapq.heappush(store['heap'], e)
+    if pushed or stale:
+        save_data(DEADLINES_FILE, store, compact=True)
+
+def is_deadline_current(r, kind, anchor):
+    # An entry is stale if the request left the status or got a new window since it was pushed
+    entries = request_deadline_entries(r)
+    return any(e[1] == kind and e[3] == anchor for e in entries)
+
+def process_due_deadlines(now=None):
+    now_ts = (now or datetime.now()).timestamp()
+    store = load_deadlines()
+    if not store['heap'] or store['heap'][0][0] > now_ts:
+        return 0  # Nothing due: the tick never touches requests.json
+
+    # Request handlers push entries and write requests.json at the same time: pop, apply and
+    # save under the store lock, from a fresh read, so no cancel, push or sent reminder is lost
+    with store_write_lock():
+        store = load_deadlines()
+        due = []
+        while store['heap'] and store['heap'][0][0] <= now_ts:
+            due.append(heapq.heappop(store['heap']))
+
+        all_reqs = load_data('requests.json')
+        by_id = {r['id']: r for r in all_reqs}
+        changed = []
+        for due_ts, kind, req_id, anchor in due:
+            r = by_id.get(req_id)
+            if not r or not is_deadline_current(r, kind, anchor):
+                continue
+            if kind == 'edit_reminder':
+                create_notification(f"คำขอ {req_id} เหลือเวลาแก้ไขอีก {DEADLINE_REMINDER_DAYS} วัน", recipient_username=r['applicant'], req_id=req_id)
+            elif kind == 'appeal_reminder':
+                create_notification(f"คำขอ {req_id} เหลือเวลายื่นอุทธรณ์อีก {DEADLINE_REMINDER_DAYS} วัน", recipient_username=r['applicant'], req_id=req_id)
+            elif kind == 'edit_expire':
+                r['status'] = 'ยกเลิก'
+                r['cancel_date'] = format_thai_date(datetime.now(), True)
+                r['comment'] = f"ยกเลิกอัตโนมัติ: เกินกำหนดเวลาการแก้ไขคำขอ ({EDIT_WINDOW_DAYS} วัน)"
+                changed.append(r)
+                create_notification(f"คำขอ {req_id} ถูกยกเลิกอัตโนมัติเนื่องจากเกินกำหนดเวลาแก้ไข", recipient_username=r['applicant'], req_id=req_id)
+                create_notification(f"คำขอ {req_id} ถูกยกเลิกอัตโนมัติเนื่องจากเกินกำหนดเวลาแก้ไข", recipient_role='administration', req_id=req_id)
+            elif kind == 'appeal_expire':
+                r['appeal_closed'] = True
+                changed.append(r)
+                create_notification(f"คำขอ {req_id} สิ้นสุดระยะเวลายื่นอุทธรณ์แล้ว", recipient_username=r['applicant'], req_id=req_id)
+
+        for r in changed:
+            store['scheduled'].pop(r['id'], None)
+        save_data(DEADLINES_FILE, store, compact=True)
+        if changed:
+            save_requests(all_reqs, changed)
+        flush_notifications()  # One notifications.json write for the whole tick
+        return len(due)
+
+def upcoming_deadlines(limit=50, req_ids=None):
+    store = load_deadlines()
+    # Only entries of the request's current window (heaps written before pruning hold stale ones)
+    scheduled = store['scheduled']
+    entries = [e for e in store['heap'] if scheduled.get(e[2]) == e[3] and (req_ids is None or e[2] in req_ids)]
+    # nsmallest on the heap costs O(heap * log limit), independent of the number of requests
+    return [{"due": format_thai_date(datetime.fromtimestamp(e[0]), True), "due_ts": e[0], "kind": e[1], "req_id": e[2]}
+            for e in heapq.nsmallest(limit, entries)]
+
+def _deadline_scheduler_loop():
+    while True:
+        try:
+            with app.app_context():
+                process_due_deadlines()
+        except Exception as e:
+            app.logger.error(f"Deadline scheduler error: {e}")
+        time.sleep(SCHEDULER_INTERVAL_SECONDS)
+
+def start_deadline_scheduler():
+    # Only one process may run the scheduler; the others fail to take the lock and skip
+    global _scheduler_lock_file
+    if _scheduler_lock_file is not None:
+        return False
+    lock_file = open('.deadline_scheduler.lock', 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _scheduler_lock_file = lock_file
+    threading.Thread(target=_deadline_scheduler_loop, name='deadline-scheduler', daemon=True).start()
+    return True
+
+def queue_requests(all_reqs, *names):
+    # Full records for the given queues, in queue order. save_requests keeps the queues exact
+    # under the store lock, so members are looked up by id: O(queue length) on a snapshot
+    store = load_work_queues()
+    ids = [e['id'] for name in names for e in store['queues'].get(name, [])]
+    by_id = {r['id']: r for r in requests_for_ids(all_reqs, ids)}
+    return [by_id[i] for i in ids if i in by_id and QUEUE_OF_STATUS.get(by_id[i].get('status')) in names]
+
+def sum_by_status(by_status, statuses=None):
+    total = empty_measures()
+    for status, m in by_status.items():
+        if statuses is None or status in statuses:
+            apply_measures(total, m, 1)
+    return total
+
 @app.route('/')
 def index():
     if 'username' in session: return redirect(url_for('dashboard'))
@@ -287,13 +1082,16 @@ def inject_timeline():
         
     has_submitted = False
     if 'username' in session and session['role'] == 'applicant':
-        all_reqs = load_data('requests.json')
-        # Check if user has any non-draft request in the current fiscal year
-        user_reqs = [r for r in all_reqs if r['applicant'] == session['username'] and str(r.get('fiscal_year')) == current_fy]
-        if any(r.get('status') != 'แบบร่าง' for r in user_reqs):
-            has_submitted = True
+        # Check if user has any non-draft request in the current fiscal year. Answered by the
+        # date index's per-applicant set, so rendering a page decodes no request
+        has_submitted = get_memory_index('dates').has_submitted(session['username'], current_fy)
+            
+    queue_counts = {}
+    if 'username' in session and session.get('role') in ROLE_QUEUES:
+        counts = work_queue_counts()
+        queue_counts = {name: counts.get(name, 0) for name in ROLE_QUEUES[session['role']]}
             
-    return dict(can_submit=can_submit, timeline=tl, timeline_message=timeline_message, has_submitted_this_year=has_submitted)
+    return dict(can_submit=can_submit, timeline=tl, timeline_message=timeline_message, has_submitted_this_year=has_submitted, queue_counts=queue_counts)
 
 @app.template_filter('role_status_label')
 def role_status_label(status, role):
@@ -343,9 +1141,17 @@ def view_work(req_id, work_index):
     
     requests_list = load_data('requests.json')
     req = next((r for r in requests_list if r['id'] == req_id), None)
+    archived = False
+    if not req:
+        req = find_archived_request(req_id)
+        archived = req is not None
     if not req:
         return "Request not found", 404
     
+    if archived and request.method == 'POST':
+        flash("คำขอนี้อยู่ในคลังข้อมูลของปีงบประมาณที่ปิดแล้ว ไม่สามารถแก้ไขได้")
+        return redirect(url_for('view_work', req_id=req_id, work_index=work_index))
+
     if request.method == 'POST':
         if session['role'] != 'administration':
             flash("คุณไม่มีสิทธิ์แก้ไขข้อมูลนี้")
@@ -368,7 +1174,7 @@ def view_work(req_id, work_index):
         req['total_score'] = new_total_score
         req['total_compensation'] = new_total_comp
         
-        save_data('requests.json', requests_list)
+        save_requests(requests_list, [req])
         flash("แก้ไขข้อมูลผลงานและคำนวณคะแนนใหม่เรียบร้อยแล้ว")
         return redirect(url_for('view_work', req_id=req_id, work_index=work_index))
 
@@ -420,6 +1226,36 @@ def translate_work_type(initial_type):
         }
     return mapping.get(initial_type, initial_type)
 
+# --- Fragment cache for per-request blocks in large listings ---
+app.config['FRAGMENT_CACHE'] = os.environ.get('FRAGMENT_CACHE', '1') == '1'
+_fragment_cache = FragmentCache(max_entries=int(os.environ.get('FRAGMENT_CACHE_ENTRIES', 20000)),
+                                max_bytes=int(os.environ.get('FRAGMENT_CACHE_MB', 64)) * 2**20)
+metrics.registry.add_collector(_fragment_cache.publish)  # Totals are copied in before the registry is read
+
+def fragment_config_version():
+    # Work type labels come from work_types.json; editing it must not serve old labels
+    if 'fragment_config_version' not in g:
+        try:
+            g.fragment_config_version = os.stat('work_types.json').st_mtime_ns
+        except OSError:
+            g.fragment_config_version = None
+    return g.fragment_config_version
+
+@app.template_global()
+def cached_fragment(template_name, req_id, version, role, *key_parts, **context):
+    """Renders template_name with context, reusing the HTML while (req_id, version, role) is unchanged."""
+    template = app.jinja_env.get_template(template_name)
+    render = lambda: template.render(role=role, **context)
+    # Unversioned data (old round summaries) and POST re-renders of unsaved edits are never cached
+    if not app.config['FRAGMENT_CACHE'] or version is None or request.method != 'GET':
+        return Markup(render())
+    key = (req_id, version, role, fragment_config_version()) + key_parts
+    html, hit = _fragment_cache.render(template_name, key, render)
+    stats = metrics.current()
+    if stats is not None:
+        stats.add('fragment_hit' if hit else 'fragment_miss', count=1)
+    return html
+
 @app.route('/api/add_work_type', methods=['POST'])
 def add_work_type_api():
     if 'username' not in session: return jsonify({"success": False, "message": "Unauthorized"}), 401
@@ -433,7 +1269,7 @@ def add_work_type_api():
         return jsonify({"success": False, "message": "This type already exists"}), 400
         
     new_type = {
-        "id": f"custom_{datetime.now().strftime('%Y%m%d%H%M%S')}",
+        "id": new_id('custom', sep='_'),
         "label": label,
         "is_custom": True
     }
@@ -466,10 +1302,12 @@ def translate_contribution(role):
     }
     return mapping.get(role, role)
 
-def calculate_compensation(works_list, position_str, fiscal_year_req):
-    # Load config
-    all_criteria = load_config('criteria.json', [])
-    if isinstance(all_criteria, dict): all_criteria = []
+@metrics.timed('compensation')
+def calculate_compensation(works_list, position_str, fiscal_year_req, all_criteria=None):
+    # Load config (callers processing many requests pass it in once)
+    if all_criteria is None:
+        all_criteria = load_config('criteria.json', [])
+    if isinstance(all_criteria, dict) or all_criteria is None: all_criteria = []
     
     # Find matching criteria or use default/latest
     criteria = next((c for c in all_criteria if str(c.get('fiscal_year')) == str(fiscal_year_req)), None)
@@ -592,6 +1430,81 @@ def calculate_compensation(works_list, position_str, fiscal_year_req):
 # I will use multi_replace for that separately if needed, but here I'm instructed to add routes.
 # I will add routes at the end of file.
 
+def add_round_batch(batches, all_reqs, req_ids, fiscal_year, round_name, meeting_date):
+    # Create Batch
+    new_batch = {
+        "id": new_id('ROUND'),
+        "name": round_name,
+        "meeting_date": meeting_date,
+        "fiscal_year": fiscal_year,
+        "created_date": format_thai_date(datetime.now(), True),
+        "status": "รอการพิจารณา",
+        "req_ids": req_ids
+    }
+    stamp(new_batch, BATCH_DATE_FIELDS)
+    batches.insert(0, new_batch) # Newest first
+    
+    # Update Requests Status
+    id_set = set(req_ids)
+    batch_reqs = [r for r in all_reqs if r['id'] in id_set]
+    for r in batch_reqs:
+        r['status'] = 'อยู่ในรอบพิจารณา'
+        r['batch_id'] = new_batch['id']
+    return new_batch, batch_reqs
+
+def batchable_request_ids(all_reqs, batches, req_ids):
+    # Ids still waiting to be batched: pending status and not a member of a round still open
+    open_rounds = {b['id'] for b in batches if b.get('status') == 'รอการพิจารณา'}
+    wanted = set(req_ids)
+    return {r['id'] for r in all_reqs if r['id'] in wanted and QUEUE_OF_STATUS.get(r.get('status')) == 'pending_batching'
+            and r.get('batch_id') not in open_rounds}
+
+def plan_round_batches(pending_reqs, max_requests=0, max_works=0, max_amount=0):
+    # Multi-dimensional first-fit decreasing, one set of rounds per fiscal year.
+    # A limit of 0 means "no limit" for that dimension.
+    def size(r):
+        return (1, len(r.get('works', [])), float(r.get('suggested_compensation', 0) or 0))
+
+    limits = (max_requests or float('inf'), max_works or float('inf'), max_amount or float('inf'))
+
+    by_year = {}
+    for r in pending_reqs:
+        by_year.setdefault(str(r.get('fiscal_year', '')), []).append(r)
+
+    plan = []
+    for fy in sorted(by_year):
+        # Largest dominant share first: the hardest items get placed while rounds are still empty
+        items = sorted(by_year[fy], key=lambda r: max(v / l for v, l in zip(size(r), limits)), reverse=True)
+        bins = []
+        for r in items:
+            s = size(r)
+            target = None
+            for b in bins:
+                if all(used + v <= l for used, v, l in zip(b['used'], s, limits)):
+                    target = b
+                    break
+            if target is None:
+                target = {"fiscal_year": fy, "used": [0, 0, 0.0], "requests": [], "over_limit": False}
+                bins.append(target)
+            target['requests'].append(r)
+            target['used'] = [used + v for used, v in zip(target['used'], s)]
+            # A single request larger than the limit still needs a round of its own
+            if any(used > l for used, l in zip(target['used'], limits)):
+                target['over_limit'] = True
+
+        for b in bins:
+            b['requests'].sort(key=lambda r: r['id'])
+            plan.append({
+                "fiscal_year": fy,
+                "req_ids": [r['id'] for r in b['requests']],
+                "requests": b['requests'],
+                "request_count": b['used'][0],
+                "work_count": b['used'][1],
+                "total_amount": b['used'][2],
+                "over_limit": b['over_limit']
+            })
+    return plan
+
 @app.route('/manage/rounds', methods=['GET', 'POST'])
 def manage_rounds():
     if 'username' not in session or session['role'] not in ['administration', 'committee', 'admin']: # Committee might want to see history
@@ -600,45 +1513,82 @@ def manage_rounds():
     all_reqs = load_data('requests.json')
     batches = load_data('batches.json')
     
-    # Filter pending requests (Ready for Batching)
-    pending_reqs = [r for r in all_reqs if r.get('status') == 'รอเสนอพิจารณา']
+    # Pending requests (Ready for Batching)
+    pending_reqs = queue_requests(all_reqs, 'pending_batching')
     
     if request.method == 'POST' and session['role'] == 'administration':
         action = request.form.get('action')
         if action == 'create_round':
-            req_ids = request.form.getlist('req_ids')
-            # Get Fiscal Year from the first request in the batch
-            batch_fy = ""
-            if req_ids:
-                first_req = next((r for r in all_reqs if r['id'] == req_ids[0]), None)
-                if first_req:
-                    batch_fy = first_req.get('fiscal_year', '')
-
-            round_name = f"รายงานคำขอ รอบปีงบประมาณ {batch_fy}"
-
-            # Create Batch
-            new_batch = {
-                "id": f"ROUND-{datetime.now().strftime('%Y%m%d%H%M%S')}",
-                "name": round_name,
-                "meeting_date": request.form.get('meeting_date'),
-                "fiscal_year": batch_fy,
-                "created_date": format_thai_date(datetime.now(), True),
-                "status": "รอการพิจารณา",
-                "req_ids": req_ids
-            }
-            batches.insert(0, new_batch) # Newest first
-            save_data('batches.json', batches)
-            
-            # Update Requests Status
-            for r in all_reqs:
-                if r['id'] in req_ids:
-                    r['status'] = 'อยู่ในรอบพิจารณา'
-                    r['batch_id'] = new_batch['id']
-            save_data('requests.json', all_reqs)
+            # Re-read under the store lock: a concurrent post may have put some of these in a round
+            with store_write_lock():
+                all_reqs = load_data('requests.json')
+                batches = load_data('batches.json')
+                eligible = batchable_request_ids(all_reqs, batches, request.form.getlist('req_ids'))
+                req_ids = [rid for rid in request.form.getlist('req_ids') if rid in eligible]
+                if not req_ids:
+                    flash("คำขอที่เลือกไม่อยู่ในสถานะรอเสนอพิจารณาแล้ว")
+                    return redirect(url_for('manage_rounds'))
+                # Get Fiscal Year from the first request in the batch
+                first_req = next(r for r in all_reqs if r['id'] == req_ids[0])
+                batch_fy = first_req.get('fiscal_year', '')
+
+                round_name = f"รายงานคำขอ รอบปีงบประมาณ {batch_fy}"
+                new_batch, batch_reqs = add_round_batch(batches, all_reqs, req_ids, batch_fy, round_name, request.form.get('meeting_date'))
+                save_data('batches.json', batches)
+                record_batch_change('batch.created', new_batch)
+                save_requests(all_reqs, batch_reqs)
+            schedule_round_documents(new_batch, batch_reqs)
             
             flash(f"สร้างรอบการพิจารณาเรียบร้อยแล้ว")
             return redirect(url_for('round_history'))
 
+        limits = {
+            "max_requests": request.form.get('max_requests', type=int) or 0,
+            "max_works": request.form.get('max_works', type=int) or 0,
+            "max_amount": request.form.get('max_amount', type=float) or 0
+        }
+        if action == 'preview_auto':
+            plan = plan_round_batches(pending_reqs, **limits)
+            return render_template('create_round.html', name=session['name'], role=session['role'], position=session.get('position',''),
+                                   pending_reqs=pending_reqs, plan=plan, limits=limits, meeting_date=request.form.get('meeting_date', ''))
+
+        if action == 'create_auto':
+            try:
+                planned_ids = json.loads(request.form.get('plan_data', '[]'))
+            except ValueError:
+                planned_ids = []
+
+            created = []
+            changed = []
+            with store_write_lock():
+                # Requests may have moved on since the preview, also into a round another post
+                # just created; only batch the ones still pending, checked against a fresh read
+                all_reqs = load_data('requests.json')
+                batches = load_data('batches.json')
+                eligible = batchable_request_ids(all_reqs, batches, [rid for ids in planned_ids for rid in ids])
+                pending_by_id = {r['id']: r for r in all_reqs if r['id'] in eligible}
+                planned_ids = [[rid for rid in ids if rid in pending_by_id] for ids in planned_ids]
+                planned_ids = [ids for ids in planned_ids if ids]
+                if not planned_ids:
+                    flash("ไม่มีคำขอที่รอเสนอสำหรับจัดชุดอัตโนมัติ")
+                    return redirect(url_for('manage_rounds'))
+
+                for i, ids in enumerate(planned_ids, 1):
+                    fy = pending_by_id[ids[0]].get('fiscal_year', '')
+                    new_batch, batch_reqs = add_round_batch(batches, all_reqs, ids, fy, f"รายงานคำขอ รอบปีงบประมาณ {fy} ชุดที่ {i}",
+                                                            request.form.get('meeting_date'))
+                    created.append((new_batch, batch_reqs))
+                    changed.extend(batch_reqs)
+                save_data('batches.json', batches)
+                for new_batch, _ in created:
+                    record_batch_change('batch.created', new_batch)
+                save_requests(all_reqs, changed)
+            for new_batch, batch_reqs in created:
+                schedule_round_documents(new_batch, batch_reqs)
+
+            flash(f"สร้างรอบการพิจารณาอัตโนมัติ {len(created)} รอบเรียบร้อยแล้ว")
+            return redirect(url_for('round_history'))
+
     return render_template('create_round.html', name=session['name'], role=session['role'], position=session.get('position',''), pending_reqs=pending_reqs)
 
 @app.route('/round_history')
@@ -649,117 +1599,985 @@ def round_history():
     batches = load_data('batches.json')
     return render_template('round_history.html', name=session['name'], role=session['role'], position=session.get('position',''), batches=batches)
 
-@app.route('/view_round/<round_id>', methods=['GET', 'POST'])
-def view_round(round_id):
-    if 'username' not in session: return redirect(url_for('login'))
-    
-    batches = load_data('batches.json')
-    batch = next((b for b in batches if b['id'] == round_id), None)
-    if not batch:
-        flash("ไม่พบข้อมูลรอบการพิจารณา")
-        return redirect(url_for('dashboard'))
-        
-    all_reqs = load_data('requests.json')
-    target_reqs = [r for r in all_reqs if r['id'] in batch['req_ids']]
-    
-    # Calculate Summary
-    users = load_data('users.json')
-    eligible_count = len([u for u in users if u['role'] == 'applicant'])
-    
-    # Applicant Count (Unique in this batch)
-    applicants_in_batch = set(r['applicant'] for r in target_reqs)
-    
-    total_amount = sum(float(r.get('approved_amount', 0) or 0) for r in target_reqs)
-    
-    works_breakdown = []
+def build_works_breakdown(target_reqs):
+    return list(iter_works_breakdown(target_reqs))
+
+def iter_works_breakdown(target_reqs):
     for r in target_reqs:
         for idx, w in enumerate(r.get('works', [])):
             # Skip duplicate works for committee
             if w.get('status') == 'ผลงานซ้ำซ้อน':
                 continue
-                
-            works_breakdown.append({
+
+            details = w.get('details', {})
+            yield {
                 "req_id": r['id'],
+                "req_version": r.get('version', 0),
                 "work_index": idx,
+                "work_id": details.get('id', ''),
                 "applicant": r['applicant'],
                 "name": r['applicant_name'],
                 "position": r['applicant_info'].get('academic_position', '-'),
                 "department": r['applicant_info'].get('department', '-'),
-                "work_title": w['details'].get('title', '-'),
+                "work_title": details.get('title', '-'),
                 "work_type": w.get('type', '-'),
                 "score": w.get('score_calc', 0),
                 "amount": w.get('payment_calc', 0),
                 "status": w.get('status', r['status']),
-                "comment": w.get('comment', '')
-            })
-    
-    # Calculate Summary stats
-    users = load_data('users.json')
-    eligible_count = len([u for u in users if u['role'] == 'applicant'])
-    applicants_in_batch = set(r['applicant'] for r in target_reqs)
-    total_amount = sum(float(r.get('approved_amount', 0) or 0) for r in target_reqs)
-    
-    summary = {
-        "applicant_count": len(applicants_in_batch),
-        "total_eligible": eligible_count,
+                "comment": w.get('comment', ''),
+                "evidence_type": details.get('evidence_type', ''),
+                "evidence": details.get('evidence_file') if details.get('evidence_type') == 'file' else details.get('evidence_url', '')
+            }
+
+def apply_round_decisions(target_reqs, decisions, all_criteria):
+    # decisions: {"<req_id>_<work_index>": {"decision": "approve"|"reject", "comment": ...}}
+    for r in target_reqs:
+        # Update individual work statuses
+        for idx, w in enumerate(r.get('works', [])):
+            d = decisions.get(f"{r['id']}_{idx}") or {}
+            if d.get('decision') == 'approve':
+                w['status'] = 'อนุมัติ'
+            elif d.get('decision') == 'reject':
+                w['status'] = 'ไม่อนุมัติ'
+                w['comment'] = d.get('comment') or "ไม่อนุมัติ"
+
+        # RE-CALCULATE COMPENSATION for the request based on approved works only
+        approved_works = [w for w in r.get('works', []) if w.get('status') == 'อนุมัติ']
+        
+        # Calculate total score from approved works
+        effective_score, final_comp = calculate_compensation(
+            approved_works, 
+            r['applicant_info'].get('academic_position', ''), 
+            r.get('fiscal_year'),
+            all_criteria
+        )
+        
+        # Update Request level status
+        if len(approved_works) == len(r.get('works', [])):
+            r['status'] = 'อนุมัติ'
+        elif len(approved_works) > 0:
+            r['status'] = 'อนุมัติบางส่วน'
+        else:
+            r['status'] = 'ไม่อนุมัติ'
+        
+        r['approved_amount'] = final_comp
+        r['score'] = effective_score # Update current score based on approved items
+
+def announce_round_results(batch, batches, all_reqs, target_reqs, decisions):
+    batch['status'] = 'ประกาศผลแล้ว'
+    for r in target_reqs:
+        r.setdefault('batch_id', batch['id'])  # Legacy rounds; lets save_requests refresh the summary
+    # Criteria loaded once for the whole round
+    apply_round_decisions(target_reqs, decisions, load_config('criteria.json', []))
+
+    save_data('batches.json', batches)
+    save_requests(all_reqs, target_reqs)
+    record_batch_change('batch.announced', batch)
+    clear_round_decisions(batch['id'])
+    schedule_round_documents(batch, target_reqs)
+
+def round_decisions_path(batch_id):
+    return os.path.join(ROUND_DECISIONS_FOLDER, f"{secure_filename(batch_id)}.json")
+
+def load_round_decisions(batch_id):
+    decisions = load_config(round_decisions_path(batch_id), {})
+    return decisions if isinstance(decisions, dict) else {}
+
+def save_round_decisions(batch_id, decisions):
+    os.makedirs(ROUND_DECISIONS_FOLDER, exist_ok=True)
+    save_data(round_decisions_path(batch_id), decisions)
+
+def clear_round_decisions(batch_id):
+    path = round_decisions_path(batch_id)
+    if os.path.exists(path):
+        os.remove(path)
+
+@app.route('/api/rounds/<round_id>/decisions', methods=['GET', 'POST'])
+def round_decisions_api(round_id):
+    if 'username' not in session or session['role'] not in ['committee', 'administration', 'admin']:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+
+    batches = load_data('batches.json')
+    batch = next((b for b in batches if b['id'] == round_id), None)
+    if not batch:
+        return jsonify({"success": False, "message": "ไม่พบข้อมูลรอบการพิจารณา"}), 404
+
+    # Works the committee decides on are exactly the rows of the round summary
+    summary = load_round_summary(batch)
+    valid_keys = {f"{w['req_id']}_{w['work_index']}" for w in summary['works_breakdown']}
+
+    if request.method == 'GET':
+        decisions = load_round_decisions(round_id)
+        return jsonify({"success": True, "status": batch['status'], "decisions": decisions,
+                        "total_works": len(valid_keys), "decided": len(decisions)})
+
+    if session['role'] != 'committee':
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+
+    data = request.get_json(silent=True) or {}
+    # Several committee members save chunks of the same round: the draft is read, merged and
+    # written back under the store lock, and the round re-read so it is announced only once
+    with store_write_lock():
+        batches = load_data('batches.json')
+        batch = next((b for b in batches if b['id'] == round_id), None)
+        if batch['status'] != 'รอการพิจารณา':
+            return jsonify({"success": False, "message": "รอบนี้ประกาศผลแล้ว"}), 409
+
+        decisions = load_round_decisions(round_id)
+        errors = []
+        accepted = 0
+        for i, d in enumerate(data.get('decisions', [])):
+            key = f"{d.get('req_id')}_{d.get('work_index')}"
+            decision = d.get('decision')
+            if key not in valid_keys:
+                errors.append({"index": i, "message": f"ไม่พบผลงาน {key} ในรอบนี้"})
+            elif decision == 'pending':
+                decisions.pop(key, None)
+                accepted += 1
+            elif decision not in ['approve', 'reject']:
+                errors.append({"index": i, "message": "decision ต้องเป็น approve, reject หรือ pending"})
+            else:
+                decisions[key] = {"decision": decision, "comment": (d.get('comment') or '').strip()}
+                accepted += 1
+
+        if errors:
+            # Reject the whole chunk so a client retry can't half-apply it
+            return jsonify({"success": False, "errors": errors}), 400
+
+        if data.get('commit'):
+            all_reqs = load_data('requests.json')
+            req_ids = set(batch['req_ids'])
+            target_reqs = [r for r in all_reqs if r['id'] in req_ids]
+            announce_round_results(batch, batches, all_reqs, target_reqs, decisions)
+            # Shown on the page the submit script navigates to, as after the form post
+            flash("ประกาศผลการพิจารณาเรียบร้อยแล้ว")
+            return jsonify({"success": True, "committed": True, "decided": len(decisions), "total_works": len(valid_keys),
+                            "redirect": url_for('dashboard')})
+
+        save_round_decisions(round_id, decisions)
+    return jsonify({"success": True, "committed": False, "accepted": accepted, "decided": len(decisions), "total_works": len(valid_keys)})
+
+def round_summary_path(batch_id):
+    return os.path.join(ROUND_SUMMARY_FOLDER, f"{secure_filename(batch_id)}.json")
+
+def count_eligible_applicants():
+    return len([u for u in load_data('users.json') if u['role'] == 'applicant'])
+
+def compute_round_summary(batch, all_reqs, eligible_count=None):
+    req_ids = set(batch['req_ids'])
+    target_reqs = [r for r in all_reqs if r['id'] in req_ids]
+    works_breakdown = build_works_breakdown(target_reqs)
+
+    return {
+        "batch_id": batch['id'],
+        "applicant_count": len(set(r['applicant'] for r in target_reqs)),
+        "total_eligible": count_eligible_applicants() if eligible_count is None else eligible_count,
         "request_count": len(works_breakdown), # Now count works
-        "total_amount": total_amount,
-        "works_breakdown": works_breakdown
+        "total_amount": sum(float(r.get('approved_amount', 0) or 0) for r in target_reqs),
+        "works_breakdown": works_breakdown,
+        "updated": format_thai_date(datetime.now(), True)
     }
 
+def save_round_summary(batch, all_reqs, eligible_count=None):
+    summary = compute_round_summary(batch, all_reqs, eligible_count)
+    previous = load_config(round_summary_path(batch['id']))
+    if isinstance(previous, dict) and json.loads(json.dumps({**summary, "updated": previous.get('updated')}, default=json_default)) == previous:
+        return previous  # Nothing a summary shows changed (e.g. only a comment was edited)
+    os.makedirs(ROUND_SUMMARY_FOLDER, exist_ok=True)
+    save_data(round_summary_path(batch['id']), summary, compact=True)
+    return summary
+
+def load_round_summary(batch):
+    # Materialized by save_requests; only rounds that predate it are computed here
+    summary = load_config(round_summary_path(batch['id']))
+    if not summary:
+        summary = save_round_summary(batch, requests_for_ids(load_requests_readonly(), batch['req_ids']))
+    return summary
+
+def refresh_round_summaries(changed_reqs, all_reqs):
+    batch_ids = {r['batch_id'] for r in changed_reqs if r.get('batch_id')}
+    if not batch_ids: return
+    # One pass to group members, so refreshing many rounds stays linear
+    members = {}
+    for r in all_reqs:
+        if r.get('batch_id') in batch_ids:
+            members.setdefault(r['batch_id'], []).append(r)
+    eligible_count = count_eligible_applicants()
+    for batch in load_data('batches.json'):
+        if batch['id'] in batch_ids:
+            save_round_summary(batch, members.get(batch['id'], []), eligible_count)
+
+@app.route('/view_round/<round_id>', methods=['GET', 'POST'])
+def view_round(round_id):
+    if 'username' not in session: return redirect(url_for('login'))
+    
+    batches = load_data('batches.json')
+    batch = next((b for b in batches if b['id'] == round_id), None)
+    if not batch:
+        flash("ไม่พบข้อมูลรอบการพิจารณา")
+        return redirect(url_for('dashboard'))
+        
     if request.method == 'POST' and session['role'] == 'committee':
         action = request.form.get('action')
         if action == 'announce_results':
-            batch['status'] = 'ประกาศผลแล้ว'
-            
-            # Update individual requests and works
-            for r in target_reqs:
-                all_works_approved = True
-                any_work_rejected = False
-                
-                # Update individual work statuses based on form
-                for idx, w in enumerate(r.get('works', [])):
-                    decision = request.form.get(f"status_{r['id']}_{idx}")
-                    comment = request.form.get(f"comment_{r['id']}_{idx}")
-                    
-                    if decision == 'approve':
-                        w['status'] = 'อนุมัติ'
-                    elif decision == 'reject':
-                        w['status'] = 'ไม่อนุมัติ'
-                        w['comment'] = comment or "ไม่อนุมัติ"
-                        all_works_approved = False
-                        any_work_rejected = True
-
-                # RE-CALCULATE COMPENSATION for the request based on approved works only
-                approved_works = [w for w in r.get('works', []) if w.get('status') == 'อนุมัติ']
-                
-                # Calculate total score from approved works
-                effective_score, final_comp = calculate_compensation(
-                    approved_works, 
-                    r['applicant_info'].get('academic_position', ''), 
-                    r.get('fiscal_year')
-                )
-                
-                # Update Request level status
-                if len(approved_works) == len(r.get('works', [])):
-                    r['status'] = 'อนุมัติ'
-                elif len(approved_works) > 0:
-                    r['status'] = 'อนุมัติบางส่วน'
-                else:
-                    r['status'] = 'ไม่อนุมัติ'
-                
-                r['approved_amount'] = final_comp
-                r['score'] = effective_score # Update current score based on approved items
-
-            save_data('batches.json', batches)
-            save_data('requests.json', all_reqs)
+            # batches.json is re-read under the store lock so announcing two rounds at once
+            # keeps both, and a round is announced only once
+            with store_write_lock():
+                batches = load_data('batches.json')
+                batch = next(b for b in batches if b['id'] == round_id)
+                if batch['status'] != 'รอการพิจารณา':
+                    flash("รอบนี้ประกาศผลแล้ว")
+                    return redirect(url_for('dashboard'))
+                all_reqs = load_data('requests.json')
+                req_ids = set(batch['req_ids'])
+                target_reqs = [r for r in all_reqs if r['id'] in req_ids]
+                batch['status'] = 'ประกาศผลแล้ว'
+
+                # Decisions saved through the bulk API first, form fields override them
+                decisions = load_round_decisions(batch['id'])
+                for r in target_reqs:
+                    for idx in range(len(r.get('works', []))):
+                        decision = request.form.get(f"status_{r['id']}_{idx}")
+                        if decision in ['approve', 'reject']:
+                            decisions[f"{r['id']}_{idx}"] = {"decision": decision, "comment": request.form.get(f"comment_{r['id']}_{idx}")}
+
+                announce_round_results(batch, batches, all_reqs, target_reqs, decisions)
             
             flash("ประกาศผลการพิจารณาเรียบร้อยแล้ว")
             return redirect(url_for('dashboard'))
 
-    return render_template('view_round.html', batch=batch, summary=summary, role=session['role'])
+    summary = load_round_summary(batch)
+    drafts = load_round_decisions(batch['id']) if batch['status'] == 'รอการพิจารณา' else {}
+    return render_template('view_round.html', batch=batch, summary=summary, role=session['role'], drafts=drafts)
+
+
+
+class _ZipStreamBuffer:
+    # Write-only sink for zipfile: collects bytes until the generator drains them
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def zip_path_part(text, fallback='-'):
+    # Keep Thai characters (secure_filename would strip them), drop path separators
+    cleaned = ''.join('_' if c in '/\\:*?"<>|' or ord(c) < 32 else c for c in str(text or '')).strip(' .')
+    return cleaned[:80] or fallback
+
+def iter_round_evidence_zip(works_breakdown, chunk_size=64 * 1024):
+    buffer = _ZipStreamBuffer()
+    used_paths = set()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        # 1. Manifest of all works in the round
+        manifest = io.StringIO()
+        writer = csv.writer(manifest)
+        writer.writerow(['req_id', 'work_index', 'applicant', 'name', 'position', 'department',
+                         'work_title', 'work_type', 'score', 'amount', 'status', 'comment', 'evidence_type', 'evidence', 'zip_path'])
+
+        entries = []
+        for w in works_breakdown:
+            zip_path = ''
+            if w['evidence_type'] == 'file' and w['evidence']:
+                src = os.path.join(app.config['UPLOAD_FOLDER'], w['req_id'], str(w['work_id']), w['evidence'])
+                if os.path.isfile(src):
+                    folder = f"{zip_path_part(w['name'])}/{w['work_index'] + 1}_{zip_path_part(w['work_title'])}"
+                    zip_path = f"{folder}/{zip_path_part(w['evidence'], 'evidence')}"
+                    n = 2
+                    while zip_path in used_paths:
+                        zip_path = f"{folder}/{n}_{zip_path_part(w['evidence'], 'evidence')}"
+                        n += 1
+                    used_paths.add(zip_path)
+                    entries.append((src, zip_path))
+            writer.writerow([w['req_id'], w['work_index'], w['applicant'], w['name'], w['position'], w['department'],
+                             w['work_title'], translate_work_type(w['work_type']), w['score'], w['amount'], w['status'],
+                             w['comment'], w['evidence_type'], w['evidence'], zip_path])
+
+        # utf-8-sig so Excel shows Thai text correctly
+        zf.writestr('manifest.csv', manifest.getvalue().encode('utf-8-sig'))
+        yield buffer.drain()
+
+        # 2. Evidence files, copied chunk by chunk so memory stays flat
+        for src, zip_path in entries:
+            with open(src, 'rb') as f_in, zf.open(zip_path, 'w') as f_out:
+                while True:
+                    chunk = f_in.read(chunk_size)
+                    if not chunk: break
+                    f_out.write(chunk)
+                    data = buffer.drain()
+                    if data: yield data
+            data = buffer.drain()
+            if data: yield data
+    yield buffer.drain()
+
+@app.route('/view_round/<round_id>/evidence.zip')
+def download_round_evidence(round_id):
+    if 'username' not in session or session['role'] not in ['administration', 'committee', 'admin']:
+        return redirect(url_for('login'))
+
+    batches = load_data('batches.json')
+    batch = next((b for b in batches if b['id'] == round_id), None)
+    if not batch:
+        flash("ไม่พบข้อมูลรอบการพิจารณา")
+        return redirect(url_for('dashboard'))
+
+    works_breakdown = load_round_summary(batch)['works_breakdown']
+
+    return Response(
+        stream_with_context(iter_round_evidence_zip(works_breakdown)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{secure_filename(round_id)}_evidence.zip"'}
+    )
+
+def data_version(*parts):
+    # Content hash of small inputs (a round, chart statistics); changes whenever any of them changes
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(json.dumps(part, ensure_ascii=False, sort_keys=True,
+                                default=lambda o: json_default(o) if hasattr(o, 'to_dict') else str(o)).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+def records_version(target_reqs, *parts):
+    # Version of an export built from requests: save_requests bumps a record's 'version' on
+    # every save, so the ids and versions identify the content without serializing it
+    digest = hashlib.sha1(data_version(*parts).encode('utf-8'))
+    for r in target_reqs:
+        digest.update(f"{r['id']}:{r.get('version', 0)}\n".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+def cached_file_path(kind, key, version, ext):
+    folder = os.path.join(app.config['CACHE_FOLDER'], kind)
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, f"{secure_filename(key)}-{version}.{ext}")
+
+def store_cached_file(path, write_fn):
+    # Write to a temp file then rename, and drop older versions of the same key
+    folder = os.path.dirname(path)
+    fd, temp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    os.close(fd)
+    try:
+        write_fn(temp_path)
+        os.replace(temp_path, path)
+    except Exception as e:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise e
+    prefix = os.path.basename(path).rsplit('-', 1)[0] + '-'
+    for old_name in os.listdir(folder):
+        old_path = os.path.join(folder, old_name)
+        if old_name.startswith(prefix) and '-' not in old_name[len(prefix):] and old_path != path and not old_name.endswith('.tmp'):
+            try: os.remove(old_path)
+            except OSError: pass
+
+def write_results_workbook(path, title, target_reqs):
+    # write_only mode streams rows to disk instead of keeping every cell object in memory
+    wb = openpyxl.Workbook(write_only=True)
+    bold = Font(bold=True)
+
+    def header_row(ws, values):
+        cells = []
+        for v in values:
+            cell = WriteOnlyCell(ws, value=v)
+            cell.font = bold
+            cells.append(cell)
+        return cells
+
+    ws_works = wb.create_sheet('รายผลงาน')
+    ws_works.append([title])
+    ws_works.append(header_row(ws_works, ['รหัสคำขอ', 'ลำดับผลงาน', 'ผู้ยื่น', 'ตำแหน่ง', 'สาขาวิชา', 'ชื่อผลงาน',
+                                          'ประเภท', 'คะแนน', 'เงินค่าตอบแทน (บาท)', 'สถานะ', 'หมายเหตุ']))
+    per_applicant = {}
+    total_score = 0
+    total_works = 0
+    for w in iter_works_breakdown(target_reqs):
+        ws_works.append([w['req_id'], w['work_index'] + 1, w['name'], w['position'], w['department'], w['work_title'],
+                         translate_work_type(w['work_type']), w['score'], w['amount'], w['status'], w['comment']])
+        total_score += float(w['score'] or 0)
+        total_works += 1
+        p = per_applicant.setdefault(w['applicant'], {"name": w['name'], "position": w['position'], "department": w['department'], "works": 0, "score": 0})
+        p['works'] += 1
+        p['score'] += float(w['score'] or 0)
+    ws_works.append(header_row(ws_works, ['รวมทั้งสิ้น', total_works, '', '', '', '', '', total_score, '', '', '']))
+
+    # Approved amounts live on the request, not on individual works
+    total_amount = 0
+    for r in target_reqs:
+        amount = float(r.get('approved_amount', 0) or 0)
+        total_amount += amount
+        if r['applicant'] in per_applicant:
+            per_applicant[r['applicant']]['amount'] = per_applicant[r['applicant']].get('amount', 0) + amount
+
+    ws_people = wb.create_sheet('รายบุคคล')
+    ws_people.append([title])
+    ws_people.append(header_row(ws_people, ['ผู้ยื่น', 'ตำแหน่ง', 'สาขาวิชา', 'จำนวนผลงาน', 'คะแนนรวม', 'ยอดเงินที่อนุมัติ (บาท)']))
+    for p in per_applicant.values():
+        ws_people.append([p['name'], p['position'], p['department'], p['works'], p['score'], p.get('amount', 0)])
+    ws_people.append(header_row(ws_people, ['รวมทั้งสิ้น', '', '', total_works, total_score, total_amount]))
+
+    wb.save(path)
+
+def send_results_workbook(cache_key, title, target_reqs, download_name, *version_parts):
+    path = cached_file_path('exports', cache_key, records_version(target_reqs, *version_parts), 'xlsx')
+    if not os.path.exists(path):
+        store_cached_file(path, lambda temp_path: write_results_workbook(temp_path, title, target_reqs))
+    # send_file streams the cached file in chunks
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=download_name,
+                     mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
+ROUND_DOCUMENT_KINDS = {
+    'agenda': 'ระเบียบวาระการประชุม',
+    'announcement': 'ประกาศผลการพิจารณา'
+}
+
+def submit_background_job(key, fn, *args):
+    # One pending job per key, so repeated clicks don't queue duplicate renders
+    with _background_lock:
+        if key in _background_jobs:
+            return _background_jobs[key]
+        future = _background_executor.submit(fn, *args)
+        _background_jobs[key] = future
+
+    def _done(_):
+        with _background_lock:
+            _background_jobs.pop(key, None)
+        if future.exception():
+            app.logger.error(f"Background job {key} failed: {future.exception()}")
+    future.add_done_callback(_done)
+    return future
+
+def write_round_docx(path, kind, batch, target_reqs):
+    doc = Document()
+    doc.add_heading(f"{ROUND_DOCUMENT_KINDS[kind]}", level=1)
+    doc.add_paragraph(batch.get('name', ''))
+    meeting_dt = parse_thai_date(batch.get('meeting_date') or '')
+    doc.add_paragraph(f"วันที่ประชุม: {format_thai_date(meeting_dt) if meeting_dt else '-'}")
+
+    works = build_works_breakdown(target_reqs)
+    if kind == 'agenda':
+        doc.add_paragraph(f"เรื่องเพื่อพิจารณา: คำขอรับค่าตอบแทนผลงานวิชาการ จำนวน {len(target_reqs)} คำขอ {len(works)} ผลงาน")
+        columns = ['ลำดับ', 'ผู้ยื่น', 'ตำแหน่ง / สาขาวิชา', 'ชื่อผลงาน', 'ประเภท', 'คะแนน']
+        rows = [[str(i), w['name'], f"{w['position']} / {w['department']}", w['work_title'],
+                 translate_work_type(w['work_type']), f"{float(w['score'] or 0):g}"] for i, w in enumerate(works, 1)]
+    else:
+        approved = sum(1 for r in target_reqs if r.get('status') in ['อนุมัติ', 'อนุมัติบางส่วน'])
+        doc.add_paragraph(f"ที่ประชุมมีมติอนุมัติ {approved} คำขอ จากทั้งหมด {len(target_reqs)} คำขอ")
+        columns = ['ลำดับ', 'ผู้ยื่น', 'สาขาวิชา', 'จำนวนผลงาน', 'ผลการพิจารณา', 'ยอดเงิน (บาท)']
+        rows = []
+        for i, r in enumerate(target_reqs, 1):
+            amount = float(r.get('approved_amount', 0) or 0)
+            rows.append([str(i), r['applicant_name'], r['applicant_info'].get('department', '-'),
+                         str(len(r.get('works', []))), rich_status_label(r, 'committee'), f"{amount:,.2f}"])
+
+    table = doc.add_table(rows=1, cols=len(columns))
+    table.style = 'Table Grid'
+    for cell, text in zip(table.rows[0].cells, columns):
+        cell.text = text
+        for run in cell.paragraphs[0].runs:
+            run.bold = True
+    for row in rows:
+        for cell, text in zip(table.add_row().cells, row):
+            cell.text = text
+
+    if kind == 'announcement':
+        total_amount = sum(float(r.get('approved_amount', 0) or 0) for r in target_reqs)
+        doc.add_paragraph(f"รวมเป็นเงินทั้งสิ้น {total_amount:,.2f} บาท")
+    doc.save(path)
+
+def round_document_path(kind, batch, target_reqs):
+    return cached_file_path('documents', f"{kind}-{batch['id']}", records_version(target_reqs, batch), 'docx')
+
+def schedule_round_documents(batch, target_reqs):
+    # Pre-render so the first committee member to click doesn't wait
+    for kind in ROUND_DOCUMENT_KINDS:
+        path = round_document_path(kind, batch, target_reqs)
+        if not os.path.exists(path):
+            submit_background_job(path, store_cached_file, path,
+                                  lambda temp_path, kind=kind: write_round_docx(temp_path, kind, batch, target_reqs))
+
+@app.route('/view_round/<round_id>/document/<kind>.docx')
+def download_round_document(round_id, kind):
+    if 'username' not in session or session['role'] not in ['administration', 'committee', 'admin']:
+        return redirect(url_for('login'))
+    if kind not in ROUND_DOCUMENT_KINDS:
+        return "Document not found", 404
+
+    batches = load_data('batches.json')
+    batch = next((b for b in batches if b['id'] == round_id), None)
+    if not batch:
+        flash("ไม่พบข้อมูลรอบการพิจารณา")
+        return redirect(url_for('dashboard'))
+
+    target_reqs = requests_for_ids(load_requests_readonly(), batch['req_ids'])
+    path = round_document_path(kind, batch, target_reqs)
+    if not os.path.exists(path):
+        schedule_round_documents(batch, target_reqs)
+        flash(f"กำลังจัดทำเอกสาร{ROUND_DOCUMENT_KINDS[kind]} กรุณากดดาวน์โหลดอีกครั้งในอีกสักครู่")
+        return redirect(url_for('view_round', round_id=round_id))
+
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=f"{secure_filename(round_id)}_{kind}.docx",
+                     mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
+
+@app.route('/view_round/<round_id>/export.xlsx')
+def export_round_xlsx(round_id):
+    if 'username' not in session or session['role'] not in ['administration', 'committee', 'admin']:
+        return redirect(url_for('login'))
+
+    batches = load_data('batches.json')
+    batch = next((b for b in batches if b['id'] == round_id), None)
+    if not batch:
+        flash("ไม่พบข้อมูลรอบการพิจารณา")
+        return redirect(url_for('dashboard'))
+
+    target_reqs = requests_for_ids(load_requests_readonly(), batch['req_ids'])
+    return send_results_workbook(f"round-{round_id}", batch['name'], target_reqs,
+                                 f"{secure_filename(round_id)}_results.xlsx", batch)
+
+@app.route('/export/fiscal_year/<fiscal_year>.xlsx')
+def export_fiscal_year_xlsx(fiscal_year):
+    if 'username' not in session or session['role'] not in ['administration', 'committee', 'admin']:
+        return redirect(url_for('login'))
+
+    all_reqs = itertools.chain(load_requests_readonly(), _cold_archive.load_year(fiscal_year))
+    target_reqs = [r for r in all_reqs if str(r.get('fiscal_year')) == str(fiscal_year) and r.get('status') != 'แบบร่าง']
+    return send_results_workbook(f"fy-{fiscal_year}", f"ผลการพิจารณา ปีงบประมาณ {fiscal_year}", target_reqs,
+                                 f"results_{secure_filename(fiscal_year)}.xlsx")
+
+# Furthest step a status has reached; used for the status funnel
+STATUS_FUNNEL_STAGES = ['ยื่นคำขอ', 'ตรวจสอบเอกสาร', 'ตรวจประวัติผลงาน', 'เสนอคณะกรรมการ', 'อนุมัติ']
+STATUS_STAGE = {
+    'ส่งแล้ว': 0, 'แก้ไข': 0, 'ยกเลิก': 0,
+    'รอตรวจประวัติการยื่นขอ': 1,
+    'ผลงานผ่าน': 2, 'ผลงานซ้ำซ้อน': 2, 'ซ้ำซ้อนบางส่วน': 2, 'รอเสนอพิจารณา': 2,
+    'อยู่ในรอบพิจารณา': 3, 'รอการพิจารณา': 3, 'ไม่อนุมัติ': 3, 'รอการอุทธรณ์': 3,
+    'อนุมัติ': 4, 'อนุมัติบางส่วน': 4
+}
+
+def compute_fiscal_year_stats(agg, fiscal_year):
+    fy_rollups = agg['rollups'].get(str(fiscal_year), {})
+    approved = ['อนุมัติ', 'อนุมัติบางส่วน']
+    payout_by_department = {}
+    for dept, by_status in fy_rollups.get('department', {}).items():
+        amount = sum_by_status(by_status, approved)['approved_amount']
+        if amount: payout_by_department[dept] = amount
+
+    score_by_position = {}
+    for position, by_status in fy_rollups.get('position', {}).items():
+        bins = sum_by_status({k: v for k, v in by_status.items() if k != 'แบบร่าง'})['score_bins']
+        if bins: score_by_position[position] = dict(sorted(bins.items(), key=lambda x: float(x[0])))
+
+    works_by_type = {}
+    for w_type, by_status in fy_rollups.get('work_type', {}).items():
+        count = sum_by_status({k: v for k, v in by_status.items() if k != 'แบบร่าง'})['works']
+        if count:
+            label = translate_work_type(w_type)
+            works_by_type[label] = works_by_type.get(label, 0) + count
+
+    # Funnel: every request counts towards each stage up to the one it reached
+    stage_counts = [0] * len(STATUS_FUNNEL_STAGES)
+    for status, m in fy_rollups.get('_total', {}).items():
+        if status == 'แบบร่าง': continue
+        stage_counts[STATUS_STAGE.get(status, 0)] += m['requests']
+    funnel = [{"label": label, "count": sum(stage_counts[i:])} for i, label in enumerate(STATUS_FUNNEL_STAGES)]
+    return {
+        "fiscal_year": str(fiscal_year),
+        "payout_by_department": payout_by_department,
+        "score_by_position": score_by_position,
+        "works_by_type": works_by_type,
+        "status_funnel": funnel
+    }
+
+def chart_path(fiscal_year, name, version, fmt):
+    return cached_file_path('charts', f"{fiscal_year}_{name}_{fmt}", version, fmt)
+
+def schedule_statistics_charts(stats, version):
+    for name in chart_utils.CHART_NAMES:
+        for fmt in chart_utils.CHART_FORMATS:
+            path = chart_path(stats['fiscal_year'], name, version, fmt)
+            if not os.path.exists(path):
+                submit_background_job(path, store_cached_file, path,
+                                      lambda temp_path, name=name, fmt=fmt: chart_utils.render_chart(temp_path, name, stats, fmt))
+
+@app.route('/statistics')
+def statistics_page():
+    if 'username' not in session or session['role'] not in ['administration', 'committee', 'admin']:
+        return redirect(url_for('login'))
+
+    fiscal_year = request.args.get('fy') or str(get_current_fiscal_year())
+    agg = load_aggregates()
+    fiscal_years = sorted((set(agg['rollups'].keys()) - {'-'}) | {fiscal_year}, reverse=True)
+    stats = compute_fiscal_year_stats(agg, fiscal_year)
+    version = data_version(stats)
+    # Charts render in the worker pool; the page only links to them
+    schedule_statistics_charts(stats, version)
+
+    return render_template('statistics.html', name=session['name'], role=session['role'], position=session.get('position',''),
+                           stats=stats, version=version, fiscal_year=fiscal_year, fiscal_years=fiscal_years,
+                           chart_names=chart_utils.CHART_NAMES)
+
+@app.route('/statistics/chart/<fiscal_year>/<name>.<fmt>')
+def statistics_chart(fiscal_year, name, fmt):
+    if 'username' not in session or session['role'] not in ['administration', 'committee', 'admin']:
+        return "Unauthorized", 401
+    if name not in chart_utils.CHART_NAMES or fmt not in chart_utils.CHART_FORMATS:
+        return "Chart not found", 404
+
+    path = chart_path(fiscal_year, name, request.args.get('v', ''), fmt)
+    if not os.path.exists(path):
+        # Still rendering (or an old version): tell the page to retry
+        return jsonify({"ready": False}), 202, {'Cache-Control': 'no-store', 'Retry-After': '1'}
+    mimetype = 'image/svg+xml' if fmt == 'svg' else 'image/png'
+    response = send_file(os.path.abspath(path), mimetype=mimetype)
+    response.cache_control.max_age = 86400  # URL carries the data version
+    return response
+
+@app.route('/api/aggregates')
+def aggregates_api():
+    if 'username' not in session or session['role'] not in ['administration', 'committee', 'admin']:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+
+    agg = load_aggregates()
+    fiscal_year = request.args.get('fiscal_year')
+    by = request.args.get('by')
+    statuses = request.args.getlist('status') or None
+
+    if not fiscal_year:
+        return jsonify({"success": True, "fiscal_years": sorted(agg['rollups'].keys(), reverse=True)})
+    fy_rollups = agg['rollups'].get(str(fiscal_year), {})
+    if by == 'status':
+        return jsonify({"success": True, "fiscal_year": fiscal_year, "by": by, "rollup": fy_rollups.get('_total', {})})
+    if by:
+        if by not in AGGREGATE_DIMENSIONS[1:5]:
+            return jsonify({"success": False, "message": f"by must be one of {AGGREGATE_DIMENSIONS[1:]}"}), 400
+        rollup = {value: sum_by_status(by_status, statuses) for value, by_status in fy_rollups.get(by, {}).items()}
+        return jsonify({"success": True, "fiscal_year": fiscal_year, "by": by, "rollup": rollup})
+    return jsonify({"success": True, "fiscal_year": fiscal_year, "total": sum_by_status(fy_rollups.get('_total', {}), statuses)})
+
+# --- Per-request instrumentation ---
+# Counts and timings collected by metrics.record() go out as a Server-Timing header, one JSON
+# log line per request and the counters served at /metrics. With METRICS_DIR (set by
+# gunicorn.conf.py) /metrics serves the sum over all worker processes.
+if os.environ.get('METRICS_DIR'):
+    metrics.share_across_processes(os.environ['METRICS_DIR'])
+request_log = logging.getLogger('request_metrics')
+if not request_log.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter('%(message)s'))
+    request_log.addHandler(_log_handler)
+    request_log.setLevel(logging.INFO)
+    request_log.propagate = False
+
+@app.before_request
+def start_request_metrics():
+    g.request_stats, g.request_stats_token = metrics.begin_request()
+
+@before_render_template.connect_via(app)
+def _render_started(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def _render_finished(sender, template, context, **extra):
+    started = g.pop('render_started', None)
+    if started is not None:
+        metrics.record('render', time.perf_counter() - started, count=0)
+
+@app.after_request
+def add_server_timing(response):
+    stats = g.get('request_stats')
+    if stats is not None:
+        response.headers['Server-Timing'] = stats.server_timing()
+        g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc=None):
+    stats = g.pop('request_stats', None)
+    if stats is None: return
+    metrics.end_request(g.pop('request_stats_token'))
+    endpoint = request.url_rule.endpoint if request.url_rule else 'unmatched'
+    status = g.get('response_status', 500)
+    metrics.registry.inc('app_requests_total', endpoint=endpoint, method=request.method, status=status)
+    metrics.registry.observe('app_request_duration_seconds', stats.elapsed(), endpoint=endpoint)
+    metrics.flush()
+    if endpoint != 'static' and app.config.get('REQUEST_LOG', not app.testing):
+        request_log.info(json.dumps({
+            "ts": datetime.now().isoformat(timespec='milliseconds'),
+            "method": request.method, "path": request.path, "endpoint": endpoint, "status": status,
+            "user": session.get('username'), "role": session.get('role'), **stats.as_dict()
+        }, ensure_ascii=False))
+
+# --- Slow-request profiles ---
+# Every request is stack-sampled while it runs; requests slower than PROFILE_SLOW_MS keep
+# their samples in the profiles folder (0 turns capture off). Admins can add ?profile=1 to
+# any page to get a full cProfile of that one request.
+app.config['PROFILE_SLOW_MS'] = int(os.environ.get('PROFILE_SLOW_MS', 1000))
+_request_sampler = profiler.Sampler()
+_profile_store = profiler.ProfileStore(PROFILE_FOLDER, keep=50)
+
+@app.before_request
+def start_request_profile():
+    if request.endpoint == 'static': return
+    if request.args.get('profile') == '1' and session.get('role') == 'admin':
+        try:
+            g.cprofile = profiler.start_cprofile()
+        except ValueError:
+            pass  # Another profiler is already attached to this thread
+    if app.config['PROFILE_SLOW_MS'] > 0 or 'cprofile' in g:
+        g.profile_trace = _request_sampler.begin()
+        g.profile_started = time.perf_counter()
+
+@app.teardown_request
+def finish_request_profile(exc=None):
+    # Registered after the metrics teardown, so it runs first and still sees this request's stats
+    trace = g.pop('profile_trace', None)
+    if trace is None: return
+    _request_sampler.end(trace)
+    cprofile = g.pop('cprofile', None)
+    functions = profiler.stop_cprofile(cprofile) if cprofile else None
+    elapsed_ms = (time.perf_counter() - g.pop('profile_started')) * 1000
+    if functions is None and elapsed_ms < app.config['PROFILE_SLOW_MS']: return
+    stats = metrics.current()
+    data_sizes = {name: os.path.getsize(name) for name in ('requests.json', 'batches.json', 'notifications.json', 'users.json')
+                  if os.path.exists(name)}
+    try:
+        _profile_store.save({
+            "kind": "cprofile" if functions else "sampling",
+            "timestamp": format_thai_date(datetime.now(), True),
+            "method": request.method, "path": request.full_path.rstrip('?'),
+            "endpoint": request.url_rule.endpoint if request.url_rule else 'unmatched',
+            "role": session.get('role'), "user": session.get('username'),
+            "status": g.get('response_status', 500), "duration_ms": round(elapsed_ms, 1),
+            "data_sizes": data_sizes, "io": stats.as_dict() if stats else {},
+            "interval_ms": _request_sampler.interval * 1000, "samples": trace.samples,
+            "stacks": trace.stacks,
+            "summary": functions or profiler.summarize_stacks(trace.stacks)
+        })
+    except OSError as e:
+        app.logger.error(f"Could not save request profile: {e}")
+
+@app.route('/manage/profiles')
+@app.route('/manage/profiles/<profile_id>')
+def manage_profiles(profile_id=None):
+    if 'username' not in session or session['role'] != 'admin':
+        return redirect(url_for('login'))
+    profile = _profile_store.get(profile_id) if profile_id else None
+    if profile_id and not profile:
+        flash("ไม่พบข้อมูลโปรไฟล์")
+        return redirect(url_for('manage_profiles'))
+    top_stacks = sorted(profile['stacks'].items(), key=lambda kv: -kv[1])[:15] if profile else []
+    return render_template('manage_profiles.html', name=session['name'], role=session['role'], position=session.get('position',''),
+                           profiles=[] if profile else _profile_store.list(), profile=profile, top_stacks=top_stacks,
+                           threshold_ms=app.config['PROFILE_SLOW_MS'])
+
+# --- Idempotent POSTs ---
+# Forms carry a one-time _idempotency_key (API clients can send an Idempotency-Key header).
+# A retried or double-clicked POST with a key we have already seen gets the first outcome
+# replayed, flash messages included, instead of running the handler again.
+_idempotency = IdempotencyStore(IDEMPOTENCY_FOLDER)
+IDEMPOTENT_BODY_LIMIT = 64 * 1024
+
+@app.context_processor
+def inject_idempotency_field():
+    def idempotency_field():
+        return Markup(f'<input type="hidden" name="_idempotency_key" value="{uuid.uuid4().hex}">')
+    return dict(idempotency_field=idempotency_field)
+
+def replay_response(result):
+    for category, message in result.get('flashes', []):
+        flash(message, category)
+    response = Response(result.get('body') or '', status=result['status'], mimetype=result.get('mimetype'))
+    if result.get('location'):
+        response.headers['Location'] = result['location']
+    response.headers['Idempotent-Replay'] = 'true'
+    return response
+
+@app.before_request
+def replay_idempotent_post():
+    if request.method != 'POST': return
+    key = request.headers.get('Idempotency-Key') or request.form.get('_idempotency_key')
+    if not key or len(key) > 128: return
+    # Scoped to the user and URL, so a key can never replay someone else's result
+    scoped = f"{session.get('username', '')}|{request.path}|{key}"
+    state, result = _idempotency.claim(scoped)
+    if state == PENDING:
+        state, result = _idempotency.wait(scoped)
+        if state is None:  # The first attempt failed and was released; run it now
+            state, result = _idempotency.claim(scoped)
+    if state == DONE:
+        return replay_response(result)
+    if state == PENDING:
+        return jsonify({"success": False, "message": "คำขอเดิมยังดำเนินการอยู่ กรุณาลองใหม่อีกครั้ง"}), 409
+    g.idempotency_key = scoped
+    g.flash_count = len(session.get('_flashes', []))
+
+@app.after_request
+def store_idempotent_result(response):
+    key = g.pop('idempotency_key', None)
+    if key is None: return response
+    if (response.status_code >= 500 or response.is_streamed or response.direct_passthrough
+            or (response.content_length or 0) > IDEMPOTENT_BODY_LIMIT):
+        _idempotency.release(key)
+        return response
+    _idempotency.complete(key, {
+        "status": response.status_code,
+        "location": response.headers.get('Location'),
+        "mimetype": response.mimetype,
+        "body": response.get_data(as_text=True),
+        "flashes": [list(f) for f in session.get('_flashes', [])[g.get('flash_count', 0):]]
+    })
+    return response
+
+@app.errorhandler(ConcurrentEditError)
+def concurrent_edit(error):
+    g.pop('new_notifications', None)  # Nothing of this request was saved
+    message = f"คำขอ {error} ถูกแก้ไขโดยผู้ใช้อื่นระหว่างดำเนินการ กรุณาตรวจสอบข้อมูลล่าสุดแล้วลองใหม่อีกครั้ง"
+    if request.is_json or request.path.startswith('/api/'):
+        return jsonify({"success": False, "message": message}), 409
+    flash(message)
+    return redirect(request.referrer or url_for('dashboard'))
+
+@app.after_request
+def write_notifications(response):
+    if response.status_code < 500:
+        flush_notifications()
+    else:
+        g.pop('new_notifications', None)
+    return response
+
+@app.teardown_request
+def release_idempotency_key(exc=None):
+    # after_request is skipped when the handler raised; let the retry run
+    key = g.pop('idempotency_key', None)
+    if key is not None:
+        _idempotency.release(key)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Scraped by Prometheus from localhost or with METRICS_TOKEN; admins can also view it
+    token = os.environ.get('METRICS_TOKEN')
+    local = request.remote_addr in ('127.0.0.1', '::1') and 'X-Forwarded-For' not in request.headers
+    allowed = session.get('role') == 'admin' or local or has_bearer_token(token)
+    if not allowed: return Response("Forbidden\n", status=403, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.before_request
+def ensure_deadline_scheduler():
+    # Tried once per process; a worker started to replace a dead owner tries again
+    global _scheduler_checked
+    if not _scheduler_checked and not app.testing and app.config.get('DEADLINE_SCHEDULER', True):
+        _scheduler_checked = True
+        start_deadline_scheduler()
+
+@app.route('/api/deadlines/upcoming')
+def upcoming_deadlines_api():
+    if 'username' not in session: return jsonify({"success": False, "message": "Unauthorized"}), 401
+    limit = request.args.get('limit', 50, type=int)
+    if session['role'] == 'applicant':
+        own_ids = {r['id'] for r in load_requests_readonly() if r['applicant'] == session['username']}
+        return jsonify({"success": True, "deadlines": upcoming_deadlines(limit, own_ids)})
+    return jsonify({"success": True, "deadlines": upcoming_deadlines(limit)})
 
+@app.route('/api/search')
+def search_api():
+    if 'username' not in session: return jsonify({"success": False, "message": "Unauthorized"}), 401
+    query = request.args.get('q', '').strip()
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    started = time.perf_counter()
+    # Applicants only ever see their own requests; nobody else sees drafts
+    applicant = session['username'] if session['role'] == 'applicant' else None
+    results = get_memory_index('search').search(query, limit, applicant) if query else []
+    for item in results:
+        item.pop('applicant', None)
+        item.pop('draft', None)
+        item['url'] = url_for('view_request', req_id=item['req_id'])
+    return jsonify({"success": True, "query": query, "results": results,
+                    "took_ms": round((time.perf_counter() - started) * 1000, 2)})
+
+@app.route('/api/requests/by_date')
+def requests_by_date_api():
+    if 'username' not in session: return jsonify({"success": False, "message": "Unauthorized"}), 401
+    # ?field=date&from=2026-10-01&to=2026-10-31 (ISO dates; either bound may be left out)
+    field = request.args.get('field', 'date')
+    if field not in REQUEST_DATE_FIELDS:
+        return jsonify({"success": False, "message": f"field must be one of {list(REQUEST_DATE_FIELDS)}"}), 400
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    applicant = session['username'] if session['role'] == 'applicant' else None
+    started = time.perf_counter()
+    results = get_memory_index('dates').range(field, request.args.get('from'), request.args.get('to'), applicant, limit)
+    for item in results:
+        item.pop('applicant', None)
+        item[field] = thai_date(item[field + '_iso'])
+    return jsonify({"success": True, "field": field, "results": results,
+                    "took_ms": round((time.perf_counter() - started) * 1000, 2)})
+
+def has_bearer_token(token):
+    # Constant-time comparison, so response timing does not reveal how much of a guess matched
+    if not token: return False
+    given = request.headers.get('Authorization', '')
+    return hmac.compare_digest(given.encode('utf-8'), f"Bearer {token}".encode('utf-8'))
+
+@app.route('/api/changes')
+def changes_api():
+    # Incremental sync for reporting systems: admins, or Bearer CHANGES_TOKEN
+    allowed = session.get('role') == 'admin' or has_bearer_token(os.environ.get('CHANGES_TOKEN'))
+    if not allowed: return jsonify({"success": False, "message": "Unauthorized"}), 401
+    # ?since=<next_cursor from the previous page>&limit=500&types=request.status_changed,work.decided
+    try:
+        since = request.args.get('since', '0')
+        limit = max(1, min(request.args.get('limit', 500, type=int), 5000))
+        types = set(request.args['types'].split(',')) if request.args.get('types') else None
+        changes, next_cursor, has_more = _change_feed.read(since, limit, types)
+    except ValueError:
+        return jsonify({"success": False, "message": "since must be a cursor returned by this API"}), 400
+    return jsonify({"success": True, "changes": changes, "next_cursor": next_cursor, "has_more": has_more})
+
+@app.route('/api/works/query')
+def works_query_api():
+    if 'username' not in session or session['role'] not in ['administration', 'research', 'committee', 'admin']:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+    # Each categorical column filters on one or more comma-separated values, e.g.
+    # ?database=scopus_q1_q2&contribution=first&fiscal_year=2569&group_by=department
+    filters = {c: [v for arg in request.args.getlist(c) for v in arg.split(',') if v]
+               for c in CATEGORICAL_COLUMNS if c in request.args}
+    group_by = request.args.get('group_by')
+    if group_by and group_by not in CATEGORICAL_COLUMNS:
+        return jsonify({"success": False, "message": f"ไม่สามารถจัดกลุ่มตาม {group_by} ได้"}), 400
+    score_range = (request.args.get('min_score', type=float), request.args.get('max_score', type=float))
+    limit = min(request.args.get('limit', 0, type=int), 1000)
+    started = time.perf_counter()
+    result = get_memory_index('works').query(filters, group_by, score_range, limit)
+    result['took_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return jsonify({"success": True, **result})
+
+@app.route('/api/queues')
+def work_queues_api():
+    if 'username' not in session or session['role'] not in ROLE_QUEUES:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+    store = load_work_queues()
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({
+        "success": True,
+        "queues": {name: {"count": len(store['queues'][name]), "items": store['queues'][name][:limit]}
+                   for name in ROLE_QUEUES[session['role']]}
+    })
 
+@app.route('/queue/<name>/next')
+def next_in_queue(name):
+    if 'username' not in session or name not in ROLE_QUEUES.get(session['role'], []):
+        return redirect(url_for('login'))
+    queue = load_work_queues()['queues'].get(name, [])
+    if not queue:
+        flash("ไม่มีรายการค้างในคิวงาน")
+        return redirect(url_for('dashboard'))
+    return redirect(url_for('view_request', req_id=queue[0]['id']))
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -801,12 +2619,13 @@ def get_notifications():
 @app.route('/api/notifications/read/<notif_id>', methods=['POST'])
 def read_notification(notif_id):
     if 'username' not in session: return jsonify({"success": False})
-    notifs = load_data('notifications.json')
-    for n in notifs:
-        if n['id'] == notif_id:
-            n['is_read'] = True
-            break
-    save_data('notifications.json', notifs)
+    with store_write_lock():  # Same file create_notification inserts into
+        notifs = load_data('notifications.json')
+        for n in notifs:
+            if n['id'] == notif_id:
+                n['is_read'] = True
+                break
+        save_data('notifications.json', notifs)
     return jsonify({"success": True})
 
 @app.route('/notifications')
@@ -828,10 +2647,10 @@ def appeals_page():
     if 'username' not in session or session['role'] not in ['committee', 'applicant']:
         return redirect(url_for('login'))
     
-    all_reqs = load_data('requests.json')
+    all_reqs = load_requests_readonly()
     # Filter for appeal statuses
     if session['role'] == 'committee':
-        appeal_reqs = [r for r in all_reqs if r.get('status') in ['รอการอุทธรณ์', 'ยื่นอุทธรณ์', 'กำลังพิจารณาอุทธรณ์', 'รอพิจารณาอุทธรณ์']]
+        appeal_reqs = queue_requests(all_reqs, 'committee_appeals')
     else:
         # Applicant sees their own appeals
         appeal_reqs = [r for r in all_reqs if r['applicant'] == session['username'] and r.get('status') == 'รอการอุทธรณ์']
@@ -842,7 +2661,7 @@ def appeals_page():
 def dashboard():
     if 'username' not in session: return redirect(url_for('login'))
     
-    all_reqs = load_data('requests.json')
+    all_reqs = load_requests_readonly()
     batches = load_data('batches.json')
     pending_reqs = []
     
@@ -852,7 +2671,7 @@ def dashboard():
         # Show all non-draft requests
         display_reqs = [r for r in all_reqs if r.get('status') != 'แบบร่าง']
         if session['role'] == 'administration':
-            pending_reqs = [r for r in all_reqs if r.get('status') == 'รอเสนอพิจารณา']
+            pending_reqs = queue_requests(all_reqs, 'pending_batching')
     else:
         display_reqs = []
     
@@ -915,14 +2734,8 @@ def new_request():
         # Let's assume we handle standard form submission but parse dynamic fields
         
         # Basic Info
-        req_id = request.form.get('req_id') or f"REQ-{datetime.now().strftime(f'%Y{to_thai_year(datetime.now())}%m%d%H%M%S')}"
-        # Actually standard REQ ID usually uses AD or specific format. 
-        # User asked "Change AD to BE system". REQ ID often keeps sortable AD YYYY. 
-        # But let's use BE Year in ID as requested? "REQ-2569..." might be confusing if sorted by strict string 
-        # but locally fine. Let's stick to simple YYYYMMDD... but using BE?
-        # Let's adjust REQ ID to use BE year: f"REQ-{year+543}..."
-        now_dt = datetime.now()
-        req_id = request.form.get('req_id') or f"REQ-{now_dt.year + 543}{now_dt.strftime('%m%d%H%M%S')}"
+        # REQ ids carry the BE year; unique across worker processes even within the same second
+        req_id = request.form.get('req_id') or new_id('REQ', thai_year=True)
         
         # Works Processing
         works_json = request.form.get('works_data')
@@ -998,10 +2811,11 @@ def new_request():
         if existing_idx > -1:
             # Preserve some fields if needed, or just overwrite for Draft logic
             all_reqs[existing_idx].update(req_data)
+            req_data = all_reqs[existing_idx]
         else:
             all_reqs.append(req_data)
             
-        save_data('requests.json', all_reqs)
+        save_requests(all_reqs, [req_data])
         flash("บันทึกข้อมูลเรียบร้อยแล้ว")
         return redirect(url_for('dashboard'))
     
@@ -1014,13 +2828,21 @@ def view_request(req_id):
     if 'username' not in session: return redirect(url_for('login'))
     all_reqs = load_data('requests.json')
     req_data = next((r for r in all_reqs if r['id'] == req_id), None)
+    archived = False
+    if not req_data:
+        req_data = find_archived_request(req_id)
+        archived = req_data is not None
     
     if not req_data:
         flash("ไม่พบข้อมูลคำขอ")
         return redirect(url_for('dashboard'))
 
+    if archived and request.method == 'POST':
+        flash("คำขอนี้อยู่ในคลังข้อมูลของปีงบประมาณที่ปิดแล้ว ไม่สามารถแก้ไขได้")
+        return redirect(url_for('view_request', req_id=req_id))
+
     # Redirect drafts to edit page instead of view summary
-    if req_data.get('status') == 'แบบร่าง' and session['role'] == 'applicant':
+    if req_data.get('status') == 'แบบร่าง' and session['role'] == 'applicant' and not archived:
         return redirect(url_for('new_request', edit_id=req_id))
     
     # Calculate Remaining Days for Edit/Appeal
@@ -1028,10 +2850,10 @@ def view_request(req_id):
     appeal_remaining = None
     
     if req_data.get('status') == 'แก้ไข' and req_data.get('return_date'):
-        edit_remaining = get_remaining_days(req_data['return_date'])
+        edit_remaining = get_remaining_days(req_data['return_date'], EDIT_WINDOW_DAYS)
         
     if req_data.get('status') == 'ไม่อนุมัติ' and req_data.get('rejection_date'):
-        appeal_remaining = get_remaining_days(req_data['rejection_date'])
+        appeal_remaining = get_remaining_days(req_data['rejection_date'], APPEAL_WINDOW_DAYS)
 
     if request.method == 'POST':
         action = request.form.get('action')
@@ -1040,9 +2862,9 @@ def view_request(req_id):
         if req_data['status'] in ['แบบร่าง', 'แก้ไข'] and session['role'] == 'applicant':
             # Check for Edit Expiry if status is 'แก้ไข'
             if req_data['status'] == 'แก้ไข' and req_data.get('return_date'):
-                rem = get_remaining_days(req_data['return_date'])
+                rem = get_remaining_days(req_data['return_date'], EDIT_WINDOW_DAYS)
                 if rem < 0:
-                     flash("เกินกำหนดเวลาการแก้ไขคำขอ (7 วัน) ไม่สามารถบันทึกหรือส่งคำขอได้")
+                     flash(f"เกินกำหนดเวลาการแก้ไขคำขอ ({EDIT_WINDOW_DAYS} วัน) ไม่สามารถบันทึกหรือส่งคำขอได้")
                      return redirect(url_for('view_request', req_id=req_id))
 
             req_data['title'] = request.form.get('title')
@@ -1052,12 +2874,15 @@ def view_request(req_id):
             req_data['date'] = format_thai_date(datetime.now(), True)
             if action == "submit":
                 create_notification(f"มีการแก้ไข/ส่งคำขอ {req_id} โดย {session['name']}", recipient_role='administration', req_id=req_id)
-            save_data('requests.json', all_reqs)
+            save_requests(all_reqs, [req_data])
             flash("อัปเดตข้อมูลเรียบร้อยแล้ว")
             return redirect(url_for('dashboard'))
             
         # Appeal Action (Applicant) - Single Form
         if action == 'submit_appeal' and session['role'] == 'applicant':
+            if req_data.get('appeal_closed'):
+                flash(f"เกินกำหนดเวลาการยื่นอุทธรณ์ ({APPEAL_WINDOW_DAYS} วัน)")
+                return redirect(url_for('view_request', req_id=req_id))
             appeal_reason = request.form.get('appeal_reason', '').strip()
             appeal_evidence = request.form.get('appeal_evidence', '').strip()
             
@@ -1077,7 +2902,7 @@ def view_request(req_id):
             if appealed_count > 0:
                 req_data['status'] = 'รอการอุทธรณ์'
                 req_data['appeal_date'] = format_thai_date(datetime.now(), True)
-                save_data('requests.json', all_reqs)
+                save_requests(all_reqs, [req_data])
                 create_notification(f"มีการยื่นอุทธรณ์คำขอ {req_id} ({appealed_count} รายการ)", recipient_role='committee', req_id=req_id)
                 flash("ส่งคำอุทธรณ์เรียบร้อยแล้ว")
             else:
@@ -1091,7 +2916,7 @@ def view_request(req_id):
             if req_data.get('status') in allowed_to_cancel:
                 req_data['status'] = 'ยกเลิก'
                 req_data['cancel_date'] = format_thai_date(datetime.now(), True)
-                save_data('requests.json', all_reqs)
+                save_requests(all_reqs, [req_data])
                 create_notification(f"คำขอ {req_id} ถูกยกเลิกโดยผู้ยื่น", recipient_role='administration', req_id=req_id)
                 flash("ยกเลิกคำขอเรียบร้อยแล้ว")
                 return redirect(url_for('dashboard'))
@@ -1124,7 +2949,7 @@ def view_request(req_id):
                     # Also set the global status to trigger visibility in the Appeals panel
                     req_data['status'] = 'รอการอุทธรณ์'
                     req_data['appeal_date'] = format_thai_date(datetime.now(), True)
-                    save_data('requests.json', all_reqs)
+                    save_requests(all_reqs, [req_data])
                     create_notification(f"มีการยื่นอุทธรณ์ผลงานในคำขอ {req_id}", recipient_role='committee', req_id=req_id)
                     flash(f"ยื่นอุทธรณ์ผลงานที่ {work_idx+1} เรียบร้อยแล้ว")
                     return redirect(url_for('view_request', req_id=req_id))
@@ -1184,20 +3009,20 @@ def view_request(req_id):
                 req_data['comment'] = comment
                 req_data['return_date'] = format_thai_date(datetime.now())
                 create_notification(f"คำขอ {req_id} ถูกส่งคืนแก้ไข: {comment}", recipient_username=req_data['applicant'], req_id=req_id)
-                save_data('requests.json', all_reqs)
+                save_requests(all_reqs, [req_data])
                 flash("ส่งคืนคำขอให้ผู้ยื่นแก้ไขแล้ว")
                 return redirect(url_for('dashboard'))
 
             elif action == 'pass':
                 req_data['status'] = 'รอตรวจประวัติการยื่นขอ'
-                save_data('requests.json', all_reqs)
+                save_requests(all_reqs, [req_data])
                 flash("ส่งต่อให้งานวิจัยเรียบร้อยแล้ว")
                 create_notification(f"คำขอ {req_id} รอตรวจประวัติการยื่นขอ", recipient_role='research', req_id=req_id)
                 return redirect(url_for('dashboard'))
 
             elif action == 'mark_ready':
                 req_data['status'] = 'รอเสนอพิจารณา'
-                save_data('requests.json', all_reqs)
+                save_requests(all_reqs, [req_data])
                 flash("บันทึกข้อมูลและเตรียมเสนอเข้าที่ประชุมเรียบร้อยแล้ว")
                 return redirect(url_for('dashboard'))
 
@@ -1207,12 +3032,12 @@ def view_request(req_id):
                 req_data['comment'] = comment
                 req_data['rejection_date'] = format_thai_date(datetime.now())
                 create_notification(f"คำขอ {req_id} ไม่อนุมัติการอนุมัติ", recipient_username=req_data['applicant'], req_id=req_id)
-                save_data('requests.json', all_reqs)
+                save_requests(all_reqs, [req_data])
                 flash("ปฏิเสธคำขอเรียบร้อยแล้ว")
                 return redirect(url_for('dashboard'))
 
             # If it was just a manual save or fallthrough
-            save_data('requests.json', all_reqs)
+            save_requests(all_reqs, [req_data])
             flash("บันทึกข้อมูลเรียบร้อยแล้ว")
             return redirect(url_for('view_request', req_id=req_id))
 
@@ -1280,11 +3105,11 @@ def view_request(req_id):
                 req_data['total_compensation'] = new_comp
                 req_data['approved_amount'] = new_comp
                 
-                save_data('requests.json', all_reqs)
+                save_requests(all_reqs, [req_data])
                 flash("ส่งผลการตรวจสอบไปยังงานบุคคลเรียบร้อยแล้ว")
                 return redirect(url_for('dashboard'))
                 
-            save_data('requests.json', all_reqs)
+            save_requests(all_reqs, [req_data])
             return redirect(url_for('view_request', req_id=req_id))
 
         # Committee Actions
@@ -1343,11 +3168,13 @@ def view_request(req_id):
                 flash("ไม่อนุมัติคำขอรวม")
                 create_notification(f"คำขอ {req_id} ถูกปฏิเสธ (ไม่อนุมัติ)", recipient_username=req_data['applicant'], req_id=req_id)
             
-            save_data('requests.json', all_reqs)
+            save_requests(all_reqs, [req_data])
             return redirect(url_for('dashboard'))
 
     # Fetch applicant history for duplicate checking
-    applicant_history = [r for r in all_reqs if r['applicant'] == req_data['applicant'] and r['id'] != req_id]
+    applicant_history = [r for r in _cold_archive.for_applicant(req_data['applicant']) if r['id'] != req_id]
+    applicant_history += [r for r in all_reqs if r['applicant'] == req_data['applicant'] and r['id'] != req_id]
+    applicant_history.sort(key=lambda r: r.get('date_iso') or '')
     
     # Load criteria for calc
     all_criteria = load_config('criteria.json', [])
@@ -1368,13 +3195,17 @@ def appeal_request(req_id):
     if req_data.get('appeal'):
         flash("คุณได้ยื่นอุทธรณ์สำหรับคำขอนี้ไปแล้ว")
         return redirect(url_for('view_request', req_id=req_id))
+
+    if req_data.get('appeal_closed'):
+        flash(f"เกินกำหนดเวลาการยื่นอุทธรณ์ ({APPEAL_WINDOW_DAYS} วัน)")
+        return redirect(url_for('view_request', req_id=req_id))
         
     # Check 7 Days Limit
     appeal_remaining = None
     if 'rejection_date' in req_data:
-        appeal_remaining = get_remaining_days(req_data['rejection_date'])
+        appeal_remaining = get_remaining_days(req_data['rejection_date'], APPEAL_WINDOW_DAYS)
         if appeal_remaining < 0:
-             flash("เกินกำหนดเวลาการยื่นอุทธรณ์ (7 วัน)")
+             flash(f"เกินกำหนดเวลาการยื่นอุทธรณ์ ({APPEAL_WINDOW_DAYS} วัน)")
              return redirect(url_for('view_request', req_id=req_id))
 
     if request.method == 'POST':
@@ -1386,7 +3217,7 @@ def appeal_request(req_id):
             "status": "รอพิจารณา"
         }
         create_notification(f"มีการยื่นอุทธรณ์สำหรับคำขอ {req_id}", recipient_role='committee', req_id=req_id)
-        save_data('requests.json', all_reqs)
+        save_requests(all_reqs, [req_data])
         flash("ยื่นอุทธรณ์เรียบร้อยแล้ว")
         return redirect(url_for('view_request', req_id=req_id))
 
@@ -1425,6 +3256,47 @@ def manage_timeline():
         
     return render_template('manage_timeline.html', name=session['name'], role=session['role'], timelines=timelines, position=session.get('position',''))
 
+@app.route('/manage/archive', methods=['GET', 'POST'])
+def manage_archive():
+    if 'username' not in session or session['role'] != 'admin':
+        return redirect(url_for('login'))
+
+    if request.method == 'POST':
+        action = request.form.get('action')
+        fiscal_year = request.form.get('fiscal_year', '')
+        all_reqs = load_data('requests.json')
+
+        if action == 'archive':
+            status = next((y for y in fiscal_year_archive_status(all_reqs) if y['fiscal_year'] == fiscal_year), None)
+            if not status or not status['archivable']:
+                flash(f"ปีงบประมาณ {fiscal_year} ยังมีคำขอที่ดำเนินการไม่เสร็จสิ้น ไม่สามารถจัดเก็บเข้าคลังข้อมูลได้")
+            else:
+                moving = [r for r in all_reqs if str(r.get('fiscal_year', '')) == fiscal_year]
+                # Archive first, then shrink the hot store; a backup sees both or neither
+                with store_write_lock(), data_write_lock():
+                    _cold_archive.archive_year(fiscal_year, moving)
+                    record_request_changes('request.archived', moving)
+                    save_requests([r for r in all_reqs if str(r.get('fiscal_year', '')) != fiscal_year], [],
+                                  removed_ids=[r['id'] for r in moving])
+                flash(f"จัดเก็บคำขอปีงบประมาณ {fiscal_year} จำนวน {len(moving)} รายการเข้าคลังข้อมูลเรียบร้อยแล้ว")
+
+        elif action == 'restore' and fiscal_year in _cold_archive.years():
+            hot_ids = {r['id'] for r in all_reqs}
+            restored = [r for r in _cold_archive.read_year(fiscal_year) if r['id'] not in hot_ids]
+            # Back into the hot store first, then drop the archive copy
+            with store_write_lock(), data_write_lock():
+                record_request_changes('request.restored', restored)
+                save_requests(all_reqs + restored, restored)
+                _cold_archive.drop_year(fiscal_year)
+            flash(f"นำคำขอปีงบประมาณ {fiscal_year} จำนวน {len(restored)} รายการกลับสู่ระบบเรียบร้อยแล้ว")
+
+        return redirect(url_for('manage_archive'))
+
+    hot_size = os.path.getsize('requests.json') if os.path.exists('requests.json') else 0
+    return render_template('manage_archive.html', name=session['name'], role=session['role'], position=session.get('position',''),
+                           live_years=fiscal_year_archive_status(load_requests_readonly()),
+                           archived_years=_cold_archive.years(), hot_size=hot_size)
+
 @app.route('/edit_timeline', methods=['GET', 'POST'])
 def edit_timeline():
     if 'username' not in session or session['role'] != 'admin':
@@ -1658,7 +3530,7 @@ def check_work_duplicate():
     
     # 2. Check Duplicates
     if title:
-        all_reqs = load_data('requests.json')
+        all_reqs = load_requests_readonly()
         # Normalize title for comparison
         target_title = title.lower().replace(" ", "")
         
@@ -1668,6 +3540,8 @@ def check_work_duplicate():
             if r['id'] == req_id:
                 current_applicant = r['applicant']
                 break
+        if current_applicant is None and find_archived_request(req_id):
+            current_applicant = find_archived_request(req_id)['applicant']
         
         # New split response
         response['self_duplicate_details'] = []
@@ -1699,6 +3573,22 @@ def check_work_duplicate():
                         # Found usage by OTHER person (Shared Work)
                         response['shared_details'].append(detail)
                         
+        # Closed fiscal years are matched through the archive's title index
+        for entry in _cold_archive.title_matches(target_title):
+            if entry['req_id'] == req_id: continue
+            detail = {
+                "req_id": entry['req_id'],
+                "applicant": entry['applicant_name'],
+                "fiscal_year": entry['fiscal_year'],
+                "status": entry['status'],
+                "date": entry['date']
+            }
+            if entry['applicant'] == current_applicant:
+                response['is_duplicate'] = True
+                response['self_duplicate_details'].append(detail)
+            else:
+                response['shared_details'].append(detail)
+
         # Legacy field mapping for backward compat if frontend not fully updated yet
         response['duplicate_details'] = response['self_duplicate_details'] + response['shared_details']
 
@@ -0,0 +1,151 @@
+import gzip
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime
+from compact_records import decode_hook, json_default
+
+# Cold storage for fiscal years that are closed. Each year is one gzip-compressed JSON file;
+# index.json says which year holds each request and carries what the duplicate check needs
+# per work title, so the common lookups never decompress anything.
+INDEX_FILE = 'index.json'
+
+
+def title_key(title):
+    # Same normalization as the duplicate check in app.py
+    return (title or '').strip().lower().replace(" ", "")
+
+
+def _write_atomic(path, write_fn):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write_fn(f)
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class ColdArchive:
+    def __init__(self, folder):
+        self.folder = folder
+        self.lock = threading.Lock()
+        self._index = None
+        self._index_mtime = None
+        self._years = {}  # fiscal year -> (file mtime, records), decoded archives kept per process
+
+    def year_path(self, fiscal_year):
+        return os.path.join(self.folder, f"requests-{fiscal_year}.json.gz")
+
+    def index(self):
+        path = os.path.join(self.folder, INDEX_FILE)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return {"years": {}, "requests": {}, "titles": {}}
+        with self.lock:
+            if mtime != self._index_mtime:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._index = json.load(f)
+                self._index_mtime = mtime
+            return self._index
+
+    def _save_index(self, index):
+        os.makedirs(self.folder, exist_ok=True)
+        _write_atomic(os.path.join(self.folder, INDEX_FILE),
+                      lambda f: f.write(json.dumps(index, ensure_ascii=False).encode('utf-8')))
+
+    def years(self):
+        return self.index()['years']
+
+    def load_year(self, fiscal_year):
+        fiscal_year = str(fiscal_year)
+        if fiscal_year not in self.years():
+            return []
+        path = self.year_path(fiscal_year)
+        mtime = os.stat(path).st_mtime_ns
+        with self.lock:
+            cached = self._years.get(fiscal_year)
+            if cached and cached[0] == mtime:
+                return cached[1]
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            records = json.load(f, object_hook=decode_hook)
+        with self.lock:
+            self._years[fiscal_year] = (mtime, records)
+        return records
+
+    def all_records(self):
+        return [r for fy in sorted(self.years()) for r in self.load_year(fy)]
+
+    def get(self, req_id):
+        entry = self.index()['requests'].get(req_id)
+        if not entry:
+            return None
+        return next((r for r in self.load_year(entry[0]) if r['id'] == req_id), None)
+
+    def for_applicant(self, username):
+        years = {fy for fy, applicant in self.index()['requests'].values() if applicant == username}
+        return [r for fy in sorted(years) for r in self.load_year(fy) if r['applicant'] == username]
+
+    def title_matches(self, normalized_title):
+        return self.index()['titles'].get(normalized_title, [])
+
+    def archive_year(self, fiscal_year, records):
+        # Write the year file first: if we stop half way the index still points at the hot store
+        fiscal_year = str(fiscal_year)
+        os.makedirs(self.folder, exist_ok=True)
+        # Archiving a year again appends; a rerun after an interrupted archive replaces the copies
+        records = list(records)
+        ids = {r['id'] for r in records}
+        records += [r for r in self.load_year(fiscal_year) if r['id'] not in ids]
+        payload = json.dumps(records, ensure_ascii=False, default=json_default).encode('utf-8')
+        _write_atomic(self.year_path(fiscal_year), lambda f: f.write(gzip.compress(payload)))
+
+        index = json.loads(json.dumps(self.index()))
+        index['years'][fiscal_year] = {
+            "count": len(records),
+            "size": os.path.getsize(self.year_path(fiscal_year)),
+            "archived_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        for r in records:
+            index['requests'][r['id']] = [fiscal_year, r['applicant']]
+            for w in r.get('works', []):
+                key = title_key(w.get('details', {}).get('title'))
+                if not key: continue
+                entries = index['titles'].setdefault(key, [])
+                if not any(e['req_id'] == r['id'] for e in entries):
+                    entries.append({
+                        "req_id": r['id'],
+                        "applicant": r['applicant'],
+                        "applicant_name": r.get('applicant_name', ''),
+                        "fiscal_year": r.get('fiscal_year', '-'),
+                        "status": w.get('status', 'Unknown'),
+                        "date": w.get('details', {}).get('date_publish', '-')
+                    })
+        self._save_index(index)
+        return len(records)
+
+    def read_year(self, fiscal_year):
+        # Plain dicts, for moving a year back into the hot store
+        with gzip.open(self.year_path(fiscal_year), 'rt', encoding='utf-8') as f:
+            return json.load(f)
+
+    def drop_year(self, fiscal_year):
+        # Only called once the year's requests are safely back in the hot store
+        fiscal_year = str(fiscal_year)
+        if fiscal_year not in self.years():
+            return
+        index = json.loads(json.dumps(self.index()))
+        del index['years'][fiscal_year]
+        dropped = {k for k, v in index['requests'].items() if v[0] == fiscal_year}
+        index['requests'] = {k: v for k, v in index['requests'].items() if k not in dropped}
+        for key in list(index['titles']):
+            index['titles'][key] = [e for e in index['titles'][key] if e['req_id'] not in dropped]
+            if not index['titles'][key]: del index['titles'][key]
+        self._save_index(index)
+        os.remove(self.year_path(fiscal_year))
+        with self.lock:
+            self._years.pop(fiscal_year, None)
@@ -0,0 +1,285 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from changes import ChangeFeed
+from ids import new_id
+
+# Online backups of the data directory.
+#
+# The app holds DATA_LOCK_FILE shared while it writes data files: for one save_data's
+# rename, or from the first write of a store-lock section to its end (batches.json then
+# requests.json and its derived stores). A
+# backup takes it exclusively just long enough to pin the current version of every data
+# file, so the snapshot never falls between the files of one save.
+# flock lets new shared holders in while an exclusive one waits, so under steady writes a
+# backup could wait forever; writers therefore pass through GATE_FILE first, which a
+# pending backup holds exclusively: new writes queue at the gate while the ones in flight
+# drain, and resume as soon as the files are pinned.
+# Pinning is cheap because the JSON stores are replaced with os.replace, never rewritten:
+# a hard link keeps the old inode alive however the file changes afterwards. Files written
+# in place (uploads) and append-only files (changes.log) just have their length noted;
+# uploads are written once under their own name, so they are read after the lock is
+# released, and only when they changed since the previous backup.
+#
+# Hashing and storing happen after the lock is released. Files are split into CHUNK_SIZE
+# chunks stored once under objects/<sha256>, compressed, so a backup only stores what is
+# new; a file whose inode, size and mtime match the previous backup is not even read.
+# manifests/<id>.json lists each file's chunks; restoring means picking the newest
+# manifest at or before the requested time and writing its files back.
+DATA_LOCK_FILE = '.data.lock'
+GATE_FILE = '.data.gate'
+CHUNK_SIZE = 4 * 1024 * 1024
+
+REPLACED_FILES = ['requests.json', 'batches.json', 'notifications.json', 'users.json',
+                  'criteria.json', 'timeline.json', 'work_types.json']
+REPLACED_DIRS = ['archive', 'round_decisions']
+IN_PLACE_DIRS = ['uploads']
+APPEND_ONLY_FILES = ['changes.log']
+# Rebuilt from the stores above when missing; cleared on restore so nothing stale survives
+DERIVED_FILES = ['aggregates.json', 'queues.json', 'deadlines.json', 'requests.generation']
+DERIVED_DIRS = ['aggregates', 'aggregate_contributions', 'round_summaries', 'cache']
+
+
+def lock_shared(data_dir='.'):
+    # The gate is held only while taking the data lock; it blocks while a backup is pending
+    with open(os.path.join(data_dir, GATE_FILE), 'a') as gate:
+        fcntl.flock(gate, fcntl.LOCK_SH)
+        lock_file = open(os.path.join(data_dir, DATA_LOCK_FILE), 'a')
+        fcntl.flock(lock_file, fcntl.LOCK_SH)
+    return lock_file
+
+
+def unlock(lock_file):
+    fcntl.flock(lock_file, fcntl.LOCK_UN)
+    lock_file.close()
+
+
+@contextmanager
+def shared_data_lock(data_dir='.'):
+    lock_file = lock_shared(data_dir)
+    try:
+        yield
+    finally:
+        unlock(lock_file)
+
+
+def lock_exclusive(lock_file, deadline, timeout):
+    while True:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return
+        except BlockingIOError:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"data lock still busy after {timeout}s")
+            time.sleep(0.001)
+
+
+@contextmanager
+def exclusive_data_lock(data_dir='.', timeout=30):
+    # Closes the gate to new writes, waits for in-flight ones to finish; gives up rather
+    # than queue behind a stuck one (closing the file releases its lock)
+    deadline = time.monotonic() + timeout
+    with open(os.path.join(data_dir, GATE_FILE), 'a') as gate, \
+            open(os.path.join(data_dir, DATA_LOCK_FILE), 'a') as lock_file:
+        lock_exclusive(gate, deadline, timeout)
+        lock_exclusive(lock_file, deadline, timeout)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            fcntl.flock(gate, fcntl.LOCK_UN)
+
+
+def data_files(data_dir):
+    """(relative path, kind) for every file a backup covers."""
+    files = [(name, 'replaced') for name in REPLACED_FILES]
+    files += [(name, 'append') for name in APPEND_ONLY_FILES]
+    for kind, folders in (('replaced', REPLACED_DIRS), ('in_place', IN_PLACE_DIRS)):
+        for folder in folders:
+            for root, _, names in os.walk(os.path.join(data_dir, folder)):
+                for name in names:
+                    files.append((os.path.relpath(os.path.join(root, name), data_dir), kind))
+    return [(rel, kind) for rel, kind in files if os.path.isfile(os.path.join(data_dir, rel))]
+
+
+def file_key(st):
+    return [st.st_ino, st.st_size, st.st_mtime_ns]
+
+
+class BackupStore:
+    def __init__(self, folder):
+        self.folder = folder
+        self.objects = os.path.join(folder, 'objects')
+        self.manifest_dir = os.path.join(folder, 'manifests')
+
+    def object_path(self, digest):
+        return os.path.join(self.objects, digest[:2], digest)
+
+    def _store_chunk(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(zlib.compress(data, 1))
+            os.replace(temp_path, path)
+            return digest, len(data)
+        return digest, 0
+
+    def _store_file(self, path, size, known_chunks=()):
+        # known_chunks: leading chunks already stored for this file (append-only files)
+        chunks = list(known_chunks)
+        written = 0
+        with open(path, 'rb') as f:
+            f.seek(len(chunks) * CHUNK_SIZE)
+            remaining = size - len(chunks) * CHUNK_SIZE
+            while remaining > 0:
+                data = f.read(min(CHUNK_SIZE, remaining))
+                if not data:
+                    break
+                digest, stored = self._store_chunk(data)
+                chunks.append(digest)
+                written += stored
+                remaining -= len(data)
+        return chunks, written
+
+    def manifests(self):
+        """Manifests oldest first, without their file lists."""
+        try:
+            names = sorted(os.listdir(self.manifest_dir))
+        except OSError:
+            return []
+        result = []
+        for name in names:
+            if name.endswith('.json'):
+                manifest = self.load(name[:-5])
+                result.append({key: manifest[key] for key in ('id', 'created', 'files_count', 'bytes', 'stored_bytes', 'lock_ms')})
+        return result
+
+    def load(self, backup_id):
+        with open(os.path.join(self.manifest_dir, backup_id + '.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def latest(self, at=None):
+        """Newest manifest created at or before at (an ISO string or datetime); None when there is none."""
+        if isinstance(at, datetime):
+            at = at.isoformat(timespec='seconds')
+        candidates = [m for m in self.manifests() if at is None or m['created'] <= at]
+        return self.load(candidates[-1]['id']) if candidates else None
+
+    def backup(self, data_dir='.', lock_timeout=30):
+        previous = self.latest()
+        prev_files = previous['files'] if previous else {}
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix='staging-', dir=self.folder)
+        try:
+            pinned = {}
+            started = time.perf_counter()
+            with exclusive_data_lock(data_dir, lock_timeout):
+                locked_at = time.perf_counter()
+                created = datetime.now().isoformat(timespec='seconds')
+                for rel, kind in data_files(data_dir):
+                    src = os.path.join(data_dir, rel)
+                    st = os.stat(src)
+                    prev = prev_files.get(rel)
+                    if prev and prev['key'] == file_key(st):
+                        pinned[rel] = (None, st, prev)  # Unchanged since the previous backup
+                        continue
+                    if kind != 'replaced':
+                        pinned[rel] = (src, st, prev)  # Only the first st_size bytes belong to this backup
+                        continue
+                    staged = os.path.join(staging, rel)
+                    os.makedirs(os.path.dirname(staged), exist_ok=True)
+                    try:
+                        os.link(src, staged)
+                    except OSError:
+                        shutil.copy2(src, staged)  # Backup folder on another file system
+                    pinned[rel] = (staged, st, prev)
+                lock_ms = (time.perf_counter() - locked_at) * 1000
+
+            files = {}
+            stored_bytes = 0
+            for rel, (path, st, prev) in pinned.items():
+                if path is None:
+                    files[rel] = prev
+                    continue
+                known = ()
+                if prev and rel in APPEND_ONLY_FILES and prev['key'][0] == st.st_ino and prev['size'] <= st.st_size:
+                    known = prev['chunks'][:prev['size'] // CHUNK_SIZE]  # Full chunks cannot have changed
+                chunks, written = self._store_file(path, st.st_size, known)
+                stored_bytes += written
+                files[rel] = {"size": st.st_size, "key": file_key(st), "chunks": chunks}
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        manifest = {"id": new_id('BACKUP'), "created": created, "files_count": len(files),
+                    "bytes": sum(f['size'] for f in files.values()), "stored_bytes": stored_bytes,
+                    "lock_ms": round(lock_ms, 2), "wait_ms": round((locked_at - started) * 1000, 2), "files": files}
+        path = os.path.join(self.manifest_dir, manifest['id'] + '.json')
+        fd, temp_path = tempfile.mkstemp(dir=self.manifest_dir)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+        return manifest
+
+    def _read_chunk(self, digest):
+        with open(self.object_path(digest), 'rb') as f:
+            return zlib.decompress(f.read())
+
+    def restore(self, manifest, target_dir, workers=4):
+        """Writes the manifest's files into target_dir; files the backup did not have are removed.
+
+        An existing change log is kept and gets a data.restored entry instead of being rolled
+        back, so feed consumers never see sequence numbers reused and know to resync."""
+        os.makedirs(target_dir, exist_ok=True)
+        started = time.perf_counter()
+        kept = {rel for rel in APPEND_ONLY_FILES if os.path.exists(os.path.join(target_dir, rel))}
+        with exclusive_data_lock(target_dir), ThreadPoolExecutor(max_workers=workers) as pool:
+            for rel, entry in manifest['files'].items():
+                if rel in kept:
+                    continue
+                dest = os.path.join(target_dir, rel)
+                os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+                fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(dest)))
+                with os.fdopen(fd, 'wb') as f:
+                    # zlib releases the GIL, so chunks decompress in parallel and are written in order
+                    for data in pool.map(self._read_chunk, entry['chunks']):
+                        f.write(data)
+                os.replace(temp_path, dest)
+            for rel, _ in data_files(target_dir):
+                if rel not in manifest['files'] and rel not in kept:
+                    os.remove(os.path.join(target_dir, rel))
+            for name in DERIVED_FILES:
+                if os.path.exists(os.path.join(target_dir, name)):
+                    os.remove(os.path.join(target_dir, name))
+            for name in DERIVED_DIRS:
+                shutil.rmtree(os.path.join(target_dir, name), ignore_errors=True)
+            if 'changes.log' in kept:
+                # Nothing to diff against: the entry only marks where the restore happened
+                feed = ChangeFeed(os.path.join(target_dir, 'changes.log'), lambda: [])
+                feed.record([{"type": "data.restored", "id": manifest['id'], "record": {"backup_created": manifest['created']}}])
+        return {"files": len(manifest['files']), "bytes": manifest['bytes'],
+                "seconds": round(time.perf_counter() - started, 3)}
+
+    def prune(self, keep):
+        """Drops all but the newest keep manifests and the chunks only they used."""
+        manifests = self.manifests()
+        for m in manifests[:-keep] if keep else manifests:
+            os.remove(os.path.join(self.manifest_dir, m['id'] + '.json'))
+        live = {digest for m in self.manifests() for f in self.load(m['id'])['files'].values() for digest in f['chunks']}
+        removed = 0
+        for root, _, names in os.walk(self.objects):
+            for name in names:
+                if name not in live:
+                    os.remove(os.path.join(root, name))
+                    removed += 1
+        return removed
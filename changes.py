@@ -0,0 +1,207 @@
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+# Change feed for downstream reporting: an append-only JSON-lines log of record-level
+# changes (requests created, status changes, works decided, rounds created/announced).
+# Every entry gets a sequence number; a cursor is "<seq>-<byte offset>" of the last entry a
+# consumer has seen, so reading the next page seeks straight to it instead of scanning.
+#
+# To tell what changed, each process keeps the last logged state of every request. It is
+# built once from requests.json and then kept current by replaying the log tail, so
+# catching up on other workers' writes costs what they changed, not a reload of the file.
+DECIDED_WORK_STATUSES = {'อนุมัติ', 'ไม่อนุมัติ'}
+# Fields whose change alone (without a status change) is worth a request.updated entry
+TRACKED_FIELDS = ('approved_amount', 'score', 'suggested_compensation', 'batch_id', 'fiscal_year',
+                  'applicant_name', 'faculty', 'department')
+
+
+def request_state(r):
+    info = r.get('applicant_info') or {}
+    return {
+        "status": r.get('status'),
+        "fiscal_year": r.get('fiscal_year'),
+        "applicant": r.get('applicant'),
+        "applicant_name": r.get('applicant_name'),
+        "faculty": info.get('faculty'),
+        "department": info.get('department'),
+        "batch_id": r.get('batch_id'),
+        "score": r.get('score'),
+        "suggested_compensation": r.get('suggested_compensation'),
+        "approved_amount": r.get('approved_amount'),
+        "date_iso": r.get('date_iso'),
+        "works": [{"id": (w.get('details') or {}).get('id'), "type": w.get('type'), "status": w.get('status')}
+                  for w in r.get('works', [])],
+    }
+
+
+def batch_state(batch):
+    return {key: batch.get(key) for key in ('name', 'fiscal_year', 'meeting_date', 'status', 'created_date_iso', 'req_ids')}
+
+
+def diff_request(r, prev):
+    """Change entries (without seq) for one request compared with its last logged state."""
+    state = request_state(r)
+    if prev is None:
+        return [{"type": "request.created", "id": r['id'], "record": state}]
+    entries = []
+    if state['status'] != prev['status']:
+        entries.append({"type": "request.status_changed", "id": r['id'], "from": prev['status'], "to": state['status']})
+    prev_works = prev.get('works', [])
+    for idx, w in enumerate(state['works']):
+        before = prev_works[idx]['status'] if idx < len(prev_works) else None
+        if w['status'] != before and w['status'] in DECIDED_WORK_STATUSES:
+            comment = r['works'][idx].get('comment') if w['status'] == 'ไม่อนุมัติ' else None
+            entries.append({"type": "work.decided", "id": r['id'], "work_index": idx, "work_id": w['id'],
+                            "from": before, "to": w['status'], "comment": comment})
+    if not entries:
+        changed = [f for f in TRACKED_FIELDS if state[f] != prev.get(f)]
+        if len(state['works']) != len(prev_works):
+            changed.append('works')
+        if changed:
+            entries.append({"type": "request.updated", "id": r['id'], "fields": changed})
+    for entry in entries:
+        entry['record'] = state
+    return entries
+
+
+class ChangeFeed:
+    def __init__(self, path, load_requests):
+        self.path = path
+        self.load_requests = load_requests
+        self.lock = threading.RLock()
+        self.states = None  # req_id -> last logged request_state
+        self.offset = 0     # How far into the log self.states has replayed
+        self.last_seq = 0
+
+    @contextmanager
+    def writing(self):
+        # Held across the requests.json write so entries land in the same order as the writes
+        with self.lock, open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self.catch_up()
+                yield self
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def _iter_from(self, offset):
+        # (entry, offset after it); stops before a line that is still being written
+        try:
+            f = open(self.path, 'rb')
+        except OSError:
+            return
+        with f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    return
+                offset += len(line)
+                yield json.loads(line), offset
+
+    def _apply(self, entry):
+        self.last_seq = entry['seq']
+        if entry['type'] == 'request.archived':
+            self.states.pop(entry['id'], None)
+        elif entry['type'].startswith(('request.', 'work.')):
+            self.states[entry['id']] = entry['record']
+
+    def catch_up(self):
+        with self.lock:
+            if self.states is None:
+                # Measure the log first: entries written while the file loads are replayed on top
+                self.offset = self._size()
+                self.states = {r['id']: request_state(r) for r in self.load_requests()}
+                self.last_seq = self._last_seq_before(self.offset)
+            for entry, offset in self._iter_from(self.offset):
+                self._apply(entry)
+                self.offset = offset
+
+    def _last_seq_before(self, offset):
+        if offset == 0:
+            return 0
+        with open(self.path, 'rb') as f:
+            f.seek(max(0, offset - 64 * 1024))
+            tail = f.read(offset - f.tell()).rstrip(b'\n').rsplit(b'\n', 1)[-1]
+        return json.loads(tail)['seq']
+
+    def diff(self, changed_reqs):
+        return [entry for r in changed_reqs for entry in diff_request(r, self.states.get(r['id']))]
+
+    def append(self, entries):
+        # Call inside writing()
+        if not entries:
+            return []
+        ts = datetime.now().isoformat(timespec='seconds')
+        lines = []
+        for entry in entries:
+            self.last_seq += 1
+            entry = {"seq": self.last_seq, "ts": ts, **entry}
+            lines.append(json.dumps(entry, ensure_ascii=False) + '\n')
+            self._apply(entry)
+        data = ''.join(lines).encode('utf-8')
+        with open(self.path, 'ab') as f:
+            f.write(data)
+        self.offset += len(data)
+        return entries
+
+    def record(self, entries):
+        with self.writing():
+            return self.append(entries)
+
+    @staticmethod
+    def parse_cursor(cursor):
+        """Empty or "0" -> start of the log; "<seq>-<offset>" -> just after that entry. Bad cursors raise ValueError."""
+        if not cursor or cursor == '0':
+            return 0, 0
+        seq, sep, offset = cursor.partition('-')
+        seq = int(seq)
+        offset = int(offset) if sep else None
+        if seq < 0 or (offset is not None and offset < 0):
+            raise ValueError(cursor)
+        return seq, offset
+
+    def _find_offset(self, seq, offset):
+        # Trust the offset when the entry right before it is the one the cursor names
+        if offset is not None and 0 < offset <= self._size():
+            with open(self.path, 'rb') as f:
+                f.seek(max(0, offset - 64 * 1024))
+                before = f.read(offset - f.tell())
+            try:
+                if before.endswith(b'\n') and json.loads(before.rstrip(b'\n').rsplit(b'\n', 1)[-1])['seq'] == seq:
+                    return offset
+            except (ValueError, KeyError):
+                pass  # Not a line boundary
+        # Plain sequence numbers (or a log that was replaced) fall back to a scan
+        start = 0
+        for entry, end in self._iter_from(0):
+            if entry['seq'] > seq:
+                break
+            start = end
+        return start
+
+    def read(self, cursor, limit=500, types=None):
+        """(entries, next_cursor, has_more) after cursor, oldest first."""
+        seq, offset = self.parse_cursor(cursor)
+        start = 0 if seq == 0 else self._find_offset(seq, offset)
+        entries = []
+        next_cursor = cursor or '0'
+        has_more = False
+        for entry, end in self._iter_from(start):
+            if len(entries) >= limit:
+                has_more = True
+                break
+            # Filtered-out entries still move the cursor on
+            next_cursor = f"{entry['seq']}-{end}"
+            if types is None or entry['type'] in types:
+                entries.append(entry)
+        return entries, next_cursor, has_more
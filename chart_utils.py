@@ -0,0 +1,63 @@
+import matplotlib
+matplotlib.use('Agg')  # No display on the server
+from matplotlib.figure import Figure
+
+# Thai-capable fonts first, DejaVu as the last resort
+matplotlib.rcParams['font.family'] = ['Sarabun', 'TH Sarabun New', 'Tahoma', 'Loma', 'Garuda', 'Norasi', 'DejaVu Sans']
+matplotlib.rcParams['axes.unicode_minus'] = False
+
+CHART_NAMES = ['payout_by_department', 'score_by_position', 'works_by_type', 'status_funnel']
+CHART_FORMATS = ['png', 'svg']
+
+
+def _bar(ax, labels, values, color, horizontal=False):
+    if not labels:
+        ax.text(0.5, 0.5, 'ไม่มีข้อมูล', ha='center', va='center', transform=ax.transAxes)
+        return
+    if horizontal:
+        ax.barh(labels, values, color=color)
+        ax.invert_yaxis()
+    else:
+        ax.bar(labels, values, color=color)
+        ax.tick_params(axis='x', labelrotation=30)
+
+
+def render_chart(path, name, stats, fmt='png'):
+    # Figure objects (not pyplot) so the worker threads don't share global state
+    fig = Figure(figsize=(8, 4.5), dpi=100)
+    ax = fig.subplots()
+    if name == 'payout_by_department':
+        items = sorted(stats['payout_by_department'].items(), key=lambda x: x[1], reverse=True)
+        _bar(ax, [k for k, v in items], [v for k, v in items], '#2ecc71', horizontal=True)
+        ax.set_title('ยอดเงินค่าตอบแทนที่อนุมัติ แยกตามสาขาวิชา (บาท)')
+
+    elif name == 'score_by_position':
+        # Scores arrive pre-binned ({bin_start: count}) from the aggregate store
+        positions = list(stats['score_by_position'].keys())
+        bins = sorted({b for p in positions for b in stats['score_by_position'][p]}, key=float)
+        if positions:
+            width = 0.8 / len(positions)
+            for i, p in enumerate(positions):
+                counts = [stats['score_by_position'][p].get(b, 0) for b in bins]
+                ax.bar([x + i * width for x in range(len(bins))], counts, width=width, label=p)
+            ax.set_xticks([x + width * (len(positions) - 1) / 2 for x in range(len(bins))])
+            ax.set_xticklabels(bins)
+            ax.legend()
+        else:
+            ax.text(0.5, 0.5, 'ไม่มีข้อมูล', ha='center', va='center', transform=ax.transAxes)
+        ax.set_title('การกระจายคะแนน แยกตามตำแหน่งทางวิชาการ')
+        ax.set_xlabel('ช่วงคะแนน')
+        ax.set_ylabel('จำนวนคำขอ')
+
+    elif name == 'works_by_type':
+        items = sorted(stats['works_by_type'].items(), key=lambda x: x[1], reverse=True)
+        _bar(ax, [k for k, v in items], [v for k, v in items], '#3498db', horizontal=True)
+        ax.set_title('จำนวนผลงาน แยกตามประเภท')
+
+    elif name == 'status_funnel':
+        stages = stats['status_funnel']
+        _bar(ax, [s['label'] for s in stages], [s['count'] for s in stages], '#f39c12')
+        ax.set_title('จำนวนคำขอในแต่ละขั้นตอน')
+
+    fig.tight_layout()
+    fig.savefig(path, format=fmt)
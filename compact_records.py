@@ -0,0 +1,145 @@
+import json
+import sys
+from collections.abc import MutableMapping
+
+# Read-only views of requests.json that use far less memory than plain dicts:
+# known keys live in __slots__ and repeated strings (statuses, types, usernames...) are
+# interned so every record shares one copy. Nested dicts (applicant_info, a work's
+# details) are kept as json parsed them: re-encoding them to save memory made every
+# load and every page that reads them slower.
+# Records behave like dicts (r['status'], r.get(...), iteration, Jinja attribute access),
+# so code that only reads requests does not need to change.
+
+def intern_value(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class CompactRecord(MutableMapping):
+    __slots__ = ('_extra',)
+    FIELDS = ()
+    INTERNED = frozenset()
+    _field_set = frozenset()
+
+    def __init__(self, data):
+        # Inlined __setitem__: this runs for every record on every load
+        extra = None
+        fields, interned = self._field_set, self.INTERNED
+        for key, value in data.items():
+            if key in interned and type(value) is str:
+                value = sys.intern(value)
+            if key in fields:
+                setattr(self, key, value)
+            else:
+                if extra is None: extra = {}
+                extra[key] = value
+        self._extra = extra
+
+    def __getitem__(self, key):
+        if key in self._field_set:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self.INTERNED:
+            value = intern_value(value)
+        if key in self._field_set:
+            setattr(self, key, value)
+        else:
+            if self._extra is None: self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self._field_set:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self._extra is not None:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        for key in self.FIELDS:
+            try:
+                getattr(self, key)
+            except AttributeError:
+                continue
+            yield key
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    def to_dict(self):
+        return {key: self[key] for key in self}
+
+
+class WorkRecord(CompactRecord):
+    FIELDS = ('type', 'details', 'base_score', 'weight', 'score_calc', 'score_breakdown', 'payment_calc',
+              'status', 'comment', 'research_comment', 'committee_comment')
+    INTERNED = frozenset({'type', 'status', 'score_breakdown'})
+    __slots__ = FIELDS
+    _field_set = frozenset(FIELDS)
+
+
+class RequestRecord(CompactRecord):
+    FIELDS = ('id', 'applicant', 'applicant_name', 'applicant_info', 'fiscal_year', 'date', 'date_iso', 'status', 'score',
+              'suggested_compensation', 'comment', 'timeline_status', 'certify', 'approved_amount',
+              'total_score', 'total_compensation', 'batch_id', 'works', 'version')
+    INTERNED = frozenset({'applicant', 'applicant_name', 'status', 'timeline_status', 'batch_id', 'date'})
+    __slots__ = FIELDS
+    _field_set = frozenset(FIELDS)
+
+    def __init__(self, data):
+        # Interning applicant_info in place leaves it equal; works are already WorkRecords
+        # when data comes from decode_hook
+        info = data.get('applicant_info')
+        if type(info) is dict:
+            for k, v in info.items():
+                if type(v) is str: info[k] = sys.intern(v)
+        works = data.get('works')
+        if type(works) is list and any(type(w) is dict for w in works):
+            data = dict(data, works=self._convert('works', works))
+        super().__init__(data)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, self._convert(key, value))
+
+    @staticmethod
+    def _convert(key, value):
+        if key == 'applicant_info' and isinstance(value, dict):
+            return {k: sys.intern(v) if type(v) is str else v for k, v in value.items()}
+        if key == 'works' and isinstance(value, list):
+            return [WorkRecord(w) if type(w) is dict else w for w in value]
+        return value
+
+
+def decode_hook(obj):
+    # json calls this bottom-up, so a request's works are already WorkRecords
+    if 'type' in obj and 'details' in obj:
+        return WorkRecord(obj)
+    if 'id' in obj and 'applicant' in obj and 'works' in obj:
+        return RequestRecord(obj)
+    return obj
+
+
+def load_compact_requests(filename):
+    with open(filename, 'r', encoding='utf-8') as f:
+        return json.load(f, object_hook=decode_hook)
+
+
+def json_default(obj):
+    # Lets json.dump / Flask's tojson serialize records as the dicts they stand for
+    if isinstance(obj, CompactRecord):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
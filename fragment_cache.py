@@ -0,0 +1,65 @@
+import sys
+import threading
+from collections import OrderedDict
+from markupsafe import Markup
+
+# Pre-rendered HTML for per-request blocks (dashboard rows, a request's work list, round
+# rows). Keys carry the request id, its version and the viewer's role, so a saved request
+# simply stops matching its old entries; nothing is ever invalidated, stale entries age
+# out of the LRU. Bounded by entry count and by the memory the cached strings take.
+
+
+class FragmentCache:
+    def __init__(self, max_entries=20000, max_bytes=64 * 2**20):
+        self.lock = threading.Lock()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> Markup, least recently used first
+        self.bytes = 0
+        self.counts = {}  # fragment name -> [hits, misses]
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def render(self, name, key, render_fn):
+        """Cached HTML for (name, *key); render_fn() builds it on a miss. Returns (html, hit)."""
+        key = (name,) + key
+        with self.lock:
+            html = self.entries.get(key)
+            counts = self.counts.setdefault(name, [0, 0])
+            if html is not None:
+                self.entries.move_to_end(key)
+                counts[0] += 1
+                return html, True
+            counts[1] += 1
+        html = Markup(render_fn())
+        size = sys.getsizeof(html)
+        if size > self.max_bytes:
+            return html, False
+        with self.lock:
+            old = self.entries.pop(key, None)  # Another thread rendered it meanwhile
+            if old is not None:
+                self.bytes -= sys.getsizeof(old)
+            self.entries[key] = html
+            self.bytes += size
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= sys.getsizeof(evicted)
+                self.evictions += 1
+        return html, False
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def publish(self, registry):
+        # Copies the totals into the metrics registry just before it is scraped
+        with self.lock:
+            for name, (hits, misses) in self.counts.items():
+                registry.set('app_fragment_cache_total', hits, fragment=name, result='hit')
+                registry.set('app_fragment_cache_total', misses, fragment=name, result='miss')
+            registry.set('app_fragment_cache_evictions_total', self.evictions)
+            registry.set('app_fragment_cache_entries', len(self.entries))
+            registry.set('app_fragment_cache_bytes', self.bytes)
@@ -0,0 +1,24 @@
+import gc
+import os
+import shutil
+
+# Pre-forked serving mode: the master loads the app, publishes the shared requests
+# snapshot and builds the in-memory indexes once; workers fork from it and share them.
+os.environ.setdefault('SHARED_SNAPSHOT', '1')
+# Each worker writes its metrics here and /metrics serves the sum over all of them. Cleared
+# before the app is loaded: counters of the previous run's workers must not be added in.
+os.environ.setdefault('METRICS_DIR', 'metrics')
+shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
+
+wsgi_app = 'app:app'
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', '4'))
+preload_app = True
+
+
+def when_ready(server):
+    from app import warm_shared_state
+    warm_shared_state()
+    # Move everything loaded so far out of the GC's reach so collections in the workers
+    # do not touch (and copy) the shared pages
+    gc.freeze()
@@ -0,0 +1,112 @@
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+# Results of recent state-changing POSTs, keyed by the client's idempotency key, so a retried
+# or double-clicked submission gets the original outcome back instead of running again.
+# Each key has its own small file in one folder, so claiming or completing a key writes
+# only that key's entry; a short flock makes check-and-claim atomic across worker processes.
+# Entries expire after TTL seconds and the folder never holds more than MAX_ENTRIES; both
+# are enforced by a sweep that runs at most once every SWEEP_INTERVAL seconds.
+PENDING = 'pending'
+DONE = 'done'
+SWEEP_INTERVAL = 60
+
+
+class IdempotencyStore:
+    def __init__(self, folder, ttl=600, max_entries=5000):
+        self.folder = folder
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.swept = 0.0
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.folder, exist_ok=True)
+        with open(os.path.join(self.folder, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _path(self, key):
+        return os.path.join(self.folder, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+
+    def _read(self, key):
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or time.time() - entry.get('created', 0) >= self.ttl:
+            return None
+        return entry
+
+    def _write(self, key, entry):
+        fd, temp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(temp_path, self._path(key))
+
+    def _sweep(self):
+        # Drop expired entries, then the oldest ones beyond max_entries
+        now = time.time()
+        if now - self.swept < SWEEP_INTERVAL:
+            return
+        self.swept = now
+        entries = []
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            if name.endswith('.tmp') or name.endswith('.json'):
+                entries.append((mtime, path))
+        entries.sort()
+        live = [e for e in entries if now - e[0] < self.ttl]
+        for mtime, path in entries[:len(entries) - len(live)] + live[:max(0, len(live) - self.max_entries)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def claim(self, key):
+        """Returns (None, None) when the caller should do the work, otherwise the existing entry's state and result."""
+        with self._locked():
+            entry = self._read(key)
+            if entry is not None:
+                return entry['state'], entry.get('result')
+            self._write(key, {"state": PENDING, "created": time.time()})
+            self._sweep()
+            return None, None
+
+    def complete(self, key, result):
+        with self._locked():
+            created = (self._read(key) or {}).get('created', time.time())
+            self._write(key, {"state": DONE, "created": created, "result": result})
+
+    def release(self, key):
+        # The work failed: forget the key so a retry runs it again
+        with self._locked():
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def wait(self, key, timeout=30, interval=0.2):
+        # A duplicate arrived while the first copy is still running: wait for its result
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            time.sleep(interval)
+            entry = self._read(key)
+            if entry is None:
+                return None, None
+            if entry['state'] == DONE:
+                return DONE, entry.get('result')
+        return PENDING, None
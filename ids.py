@@ -0,0 +1,46 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+# Record ids: PREFIX-<yyyymmddHHMMSS><millis:3><seq:3>-<node>.
+# The time part keeps ids sortable by creation time. seq counts ids made in the same
+# millisecond by this process and never goes backwards, even if the clock does. node tells
+# processes apart: the pid, or ID_NODE (set it per host when several hosts share the data).
+SEQ_PER_MS = 1000
+
+
+class IdGenerator:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last_ms = 0
+        self.seq = 0
+
+    def node(self):
+        # Read on every call so forked workers never reuse their parent's node
+        return os.environ.get('ID_NODE') or format(os.getpid(), 'x')
+
+    def _tick(self):
+        with self.lock:
+            now_ms = time.time_ns() // 1_000_000
+            if now_ms > self.last_ms:
+                self.last_ms, self.seq = now_ms, 0
+            else:
+                # Same millisecond, or the clock stepped back: keep counting from the last id
+                self.seq += 1
+                if self.seq >= SEQ_PER_MS:
+                    self.last_ms, self.seq = self.last_ms + 1, 0
+            return self.last_ms, self.seq
+
+    def new(self, prefix, sep='-', thai_year=False):
+        ms, seq = self._tick()
+        stamp = datetime.fromtimestamp(ms / 1000)
+        year = stamp.year + 543 if thai_year else stamp.year
+        return f"{prefix}{sep}{year}{stamp.strftime('%m%d%H%M%S')}{ms % 1000:03d}{seq:03d}{sep}{self.node()}"
+
+
+_generator = IdGenerator()
+
+
+def new_id(prefix, sep='-', thai_year=False):
+    return _generator.new(prefix, sep, thai_year)
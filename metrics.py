@@ -0,0 +1,311 @@
+import atexit
+import contextvars
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Per-request cost accounting plus process-wide Prometheus counters and histograms.
+# The app records file I/O, JSON and render work through record()/timed(); while a request
+# is being served the same numbers are also added to that request's RequestStats, which the
+# app turns into a Server-Timing header and a structured log line.
+#
+# Under gunicorn every worker has its own registry. With share_across_processes(folder)
+# each worker rewrites its registry to <folder>/<pid>.json from a background thread (at
+# most once a FLUSH_INTERVAL, and only after it changed) and render() serves the sum over
+# all of them, so one scrape of any worker sees the whole server. Counters of workers that
+# have exited keep counting; their gauges are dropped.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FLUSH_INTERVAL = 1.0
+
+_current = contextvars.ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.counts = {}
+        self.durations = {}
+        self.bytes = {'read': 0, 'written': 0}
+
+    def add(self, name, seconds=None, count=1):
+        if count:
+            self.counts[name] = self.counts.get(name, 0) + count
+        if seconds is not None:
+            self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def as_dict(self):
+        return {
+            "counts": dict(self.counts),
+            "ms": {k: round(v * 1000, 2) for k, v in self.durations.items()},
+            "bytes_read": self.bytes['read'],
+            "bytes_written": self.bytes['written'],
+            "total_ms": round(self.elapsed() * 1000, 2)
+        }
+
+    def server_timing(self):
+        parts = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in self.durations.items()]
+        io = ' '.join(f'{k}={v}' for k, v in sorted(self.counts.items()))
+        parts.append(f'io;desc="{io} read={self.bytes["read"]} written={self.bytes["written"]}"')
+        parts.append(f'total;dur={self.elapsed() * 1000:.2f}')
+        return ', '.join(parts)
+
+
+def begin_request():
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}    # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.help = {}
+        self.collectors = []  # Called with the registry before it is read
+
+    def describe(self, name, kind, text):
+        self.help[name] = (kind, text)
+
+    def add_collector(self, collect):
+        self.collectors.append(collect)
+
+    def collect(self):
+        for collect in self.collectors:
+            collect(self)
+
+    def reset_after_fork(self):
+        # In a forked child: what it inherited was counted by the parent (whose lock may
+        # have been held by a thread that does not exist here)
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def state(self):
+        """The values as plain JSON-able lists, for merging into another process's registry."""
+        self.collect()
+        with self.lock:
+            return {
+                "counters": [[name, [list(l) for l in labels], value] for (name, labels), value in self.counters.items()],
+                "histograms": [[name, [list(l) for l in labels], list(hist.buckets), list(hist.counts), hist.sum]
+                               for (name, labels), hist in self.histograms.items()],
+            }
+
+    def merge(self, state, gauges=True):
+        # Adds another registry's state(); gauges=False leaves out the ones of a process that is gone
+        with self.lock:
+            for name, labels, value in state['counters']:
+                if not gauges and self.help.get(name, ('',))[0] == 'gauge':
+                    continue
+                key = (name, tuple(tuple(l) for l in labels))
+                self.counters[key] = self.counters.get(key, 0) + value
+            for name, labels, buckets, counts, total in state['histograms']:
+                key = (name, tuple(tuple(l) for l in labels))
+                hist = self.histograms.get(key)
+                if hist is None:
+                    hist = self.histograms[key] = Histogram(tuple(buckets))
+                hist.counts = [a + b for a, b in zip(hist.counts, counts)]
+                hist.sum += total
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        # Gauges, and totals kept elsewhere that are copied in before a scrape
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram()
+            hist.observe(value)
+
+    def render(self):
+        # Prometheus text exposition format, version 0.0.4
+        lines = []
+        with self.lock:
+            names = sorted({k[0] for k in self.counters} | {k[0] for k in self.histograms})
+            for name in names:
+                kind, text = self.help.get(name, ('untyped', ''))
+                lines.append(f'# HELP {name} {text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for (n, labels), value in sorted(self.counters.items()):
+                    if n == name:
+                        lines.append(f'{name}{_labels(labels)} {value}')
+                for (n, labels), hist in sorted(self.histograms.items(), key=lambda kv: kv[0]):
+                    if n != name: continue
+                    cumulative = 0
+                    for upper, count in zip(hist.buckets, hist.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_labels(labels + (("le", repr(upper)),))} {cumulative}')
+                    cumulative += hist.counts[-1]
+                    lines.append(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {cumulative}')
+                    lines.append(f'{name}_sum{_labels(labels)} {hist.sum:.6f}')
+                    lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+class SharedRegistry:
+    # This process's registry, written to a folder the other workers write theirs to
+    def __init__(self, registry, folder):
+        self.registry = registry
+        self.folder = folder
+        self.changed = threading.Event()
+        self.flusher_pid = None  # Threads do not survive a fork: each worker starts its own
+        os.makedirs(folder, exist_ok=True)
+
+    def mark_changed(self):
+        self.changed.set()
+        if self.flusher_pid != os.getpid():
+            self.flusher_pid = os.getpid()
+            threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+            atexit.register(self.flush)  # The last requests of a worker that is shutting down
+
+    def _flush_loop(self):
+        while True:
+            self.changed.wait()
+            time.sleep(FLUSH_INTERVAL)  # Requests finishing meanwhile go out in the same write
+            self.changed.clear()
+            self.flush()
+
+    def flush(self):
+        fd, temp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self.registry.state(), f)
+        os.replace(temp_path, os.path.join(self.folder, f'{os.getpid()}.json'))
+
+    def merged(self):
+        self.flush()
+        total = Registry()
+        total.help = dict(self.registry.help)
+        for name in os.listdir(self.folder):
+            pid, ext = os.path.splitext(name)
+            if ext != '.json' or not pid.isdigit():
+                continue
+            try:
+                with open(os.path.join(self.folder, name), encoding='utf-8') as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                continue  # Replaced while we read it; it is read again on the next scrape
+            total.merge(state, gauges=_alive(int(pid)))
+        return total
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels) + '}'
+
+
+registry = Registry()
+registry.describe('app_requests_total', 'counter', 'HTTP requests served, by endpoint, method and status.')
+registry.describe('app_request_duration_seconds', 'histogram', 'Wall time per HTTP request, by endpoint.')
+registry.describe('app_file_ops_total', 'counter', 'load_data/load_config/save_data calls, by operation.')
+registry.describe('app_file_bytes_total', 'counter', 'Bytes of JSON data files read and written.')
+registry.describe('app_stage_seconds', 'histogram', 'Time spent per stage: JSON parse/dump, compensation, render.')
+registry.describe('app_fragment_cache_total', 'counter', 'Fragment cache lookups, by fragment and hit/miss.')
+registry.describe('app_fragment_cache_evictions_total', 'counter', 'Fragments evicted to stay within the size bounds.')
+registry.describe('app_fragment_cache_entries', 'gauge', 'Fragments currently cached.')
+registry.describe('app_fragment_cache_bytes', 'gauge', 'Memory taken by the cached fragments.')
+
+
+_shared = None
+
+
+def share_across_processes(folder):
+    """Serve the sum of every process's registry from render(); folder is shared by all workers."""
+    global _shared
+    _shared = SharedRegistry(registry, folder)
+
+
+def flush():
+    # Called after each request; the write happens in the background
+    if _shared is not None:
+        _shared.mark_changed()
+
+
+def render():
+    if _shared is None:
+        registry.collect()
+        return registry.render()
+    return _shared.merged().render()
+
+
+os.register_at_fork(after_in_child=registry.reset_after_fork)
+
+
+FILE_OPS = {'load_data', 'load_config', 'save_data'}
+STAGES = {'parse', 'dump', 'compensation', 'render'}
+
+
+def record(name, seconds=None, read=0, written=0, count=1):
+    """Account one unit of work to the process counters and the current request, if any."""
+    is_file_op = name in FILE_OPS
+    if count and is_file_op:
+        registry.inc('app_file_ops_total', count, op=name)
+    if seconds is not None and name in STAGES:
+        registry.observe('app_stage_seconds', seconds, stage=name)
+    if read:
+        registry.inc('app_file_bytes_total', read, direction='read')
+    if written:
+        registry.inc('app_file_bytes_total', written, direction='written')
+    stats = _current.get()
+    if stats is not None:
+        stats.add(name, seconds, count if is_file_op else 0)
+        stats.bytes['read'] += read
+        stats.bytes['written'] += written
+
+
+@contextmanager
+def timed(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started, count=0)
@@ -0,0 +1,176 @@
+import cProfile
+import json
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+
+# Slow-request capture. A sampling thread records the stacks of threads that are serving a
+# request; when a request turns out slower than the threshold its samples are written to a
+# bounded folder of profiles (oldest dropped first), otherwise they are thrown away.
+# An explicit cProfile run can also be asked for on a single request.
+MAX_DEPTH = 64
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def short_path(filename):
+    # Project files relative to the repo, library files as package/module.py
+    if filename.startswith(PROJECT_ROOT + os.sep):
+        return os.path.relpath(filename, PROJECT_ROOT)
+    parent, name = os.path.split(filename)
+    return f"{os.path.basename(parent)}/{name}" if parent else name
+
+
+def frame_label(code):
+    return f"{short_path(code.co_filename)}:{code.co_name}"
+
+
+class Trace:
+    def __init__(self, thread_id):
+        self.thread_id = thread_id
+        self.stacks = {}  # "outer;...;inner" -> sample count
+        self.samples = 0
+
+
+class Sampler:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.active = {}  # thread id -> Trace
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.pid = None
+
+    def _ensure_thread(self):
+        # Threads do not survive fork, so each worker process starts its own
+        if self.thread is None or self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self._run, name='request-sampler', daemon=True)
+            self.thread.start()
+
+    def begin(self):
+        trace = Trace(threading.get_ident())
+        with self.lock:
+            self._ensure_thread()
+            self.active[trace.thread_id] = trace
+        self.wakeup.set()
+        return trace
+
+    def end(self, trace):
+        with self.lock:
+            self.active.pop(trace.thread_id, None)
+
+    def _run(self):
+        while True:
+            if not self.active:
+                self.wakeup.wait()
+                self.wakeup.clear()
+            time.sleep(self.interval)
+            # Sampled under the lock: once end() has detached a trace nothing writes to it,
+            # so the request can save its stacks while the sampler keeps running
+            with self.lock:
+                if not self.active: continue
+                frames = sys._current_frames()
+                for trace in self.active.values():
+                    frame = frames.get(trace.thread_id)
+                    stack = []
+                    while frame is not None and len(stack) < MAX_DEPTH:
+                        stack.append(frame_label(frame.f_code))
+                        frame = frame.f_back
+                    if not stack: continue
+                    key = ';'.join(reversed(stack))
+                    trace.stacks[key] = trace.stacks.get(key, 0) + 1
+                    trace.samples += 1
+
+
+def summarize_stacks(stacks, limit=30):
+    """Top functions by own samples and by samples anywhere on the stack."""
+    own, total = {}, {}
+    for key, count in stacks.items():
+        frames = key.split(';')
+        own[frames[-1]] = own.get(frames[-1], 0) + count
+        for name in set(frames):
+            total[name] = total.get(name, 0) + count
+    samples = sum(stacks.values()) or 1
+    rows = [{"function": name, "own": own.get(name, 0), "total": count,
+             "own_pct": round(own.get(name, 0) * 100 / samples, 1), "total_pct": round(count * 100 / samples, 1)}
+            for name, count in total.items()]
+    return {
+        "by_own": sorted(rows, key=lambda r: -r['own'])[:limit],
+        "by_total": sorted(rows, key=lambda r: -r['total'])[:limit]
+    }
+
+
+def summarize_cprofile(profile, limit=30):
+    stats = pstats.Stats(profile)
+    rows = []
+    for (filename, lineno, name), (cc, nc, tt, ct, callers) in stats.stats.items():
+        rows.append({"function": f"{short_path(filename)}:{name}", "line": lineno, "calls": nc,
+                     "own_s": round(tt, 4), "total_s": round(ct, 4)})
+    return {
+        "by_own": sorted(rows, key=lambda r: -r['own_s'])[:limit],
+        "by_total": sorted(rows, key=lambda r: -r['total_s'])[:limit]
+    }
+
+
+def start_cprofile():
+    profile = cProfile.Profile()
+    profile.enable()
+    return profile
+
+
+def stop_cprofile(profile):
+    profile.disable()
+    return summarize_cprofile(profile)
+
+
+class ProfileStore:
+    def __init__(self, folder, keep=50):
+        self.folder = folder
+        self.keep = keep
+
+    def save(self, profile):
+        os.makedirs(self.folder, exist_ok=True)
+        profile_id = f"{time.time_ns()}-{os.getpid()}"
+        profile['id'] = profile_id
+        fd, temp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(profile, f, ensure_ascii=False)
+        os.replace(temp_path, os.path.join(self.folder, f"{profile_id}.json"))
+        self._prune()
+        return profile_id
+
+    def _names(self):
+        try:
+            return sorted((n for n in os.listdir(self.folder) if n.endswith('.json')), reverse=True)
+        except OSError:
+            return []
+
+    def _prune(self):
+        for name in self._names()[self.keep:]:
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError:
+                pass
+
+    def list(self):
+        # Newest first, without the bulky stack data
+        profiles = []
+        for name in self._names():
+            profile = self.get(name[:-5])
+            if profile:
+                profile.pop('stacks', None)
+                profile.pop('summary', None)
+                profiles.append(profile)
+        return profiles
+
+    def get(self, profile_id):
+        if not profile_id or '/' in profile_id or profile_id.startswith('.'):
+            return None
+        try:
+            with open(os.path.join(self.folder, f"{profile_id}.json"), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
@@ -0,0 +1,192 @@
+import bisect
+import heapq
+import math
+import re
+import threading
+import unicodedata
+
+# Thai is written without spaces, so words are split only on whitespace/punctuation
+# and then indexed as overlapping character n-grams.
+NGRAM_SIZE = 3
+WORD_SPLIT = re.compile(r"[\s.,;:!?()\[\]{}\"'/\\\-–—_|+*&#@%=<>]+")
+MIN_GRAM_MATCH = 0.6  # Share of query n-grams a document must contain
+PREFIX_EXPANSION_LIMIT = 64  # Vocabulary words a prefix may expand to
+EXACT_WORD_BONUS = 4.0  # Whole-word match, relative to a prefix match
+
+REQUEST_FIELDS = {'id': 3.0, 'applicant_name': 2.0, 'department': 1.0, 'faculty': 1.0, 'status': 1.0}
+WORK_FIELDS = {'title': 3.0, 'journal_name': 1.5, 'applicant_name': 1.0}
+
+
+def normalize(text):
+    return unicodedata.normalize('NFC', str(text or '')).lower()
+
+
+def split_words(text):
+    return [w for w in WORD_SPLIT.split(normalize(text)) if w]
+
+
+def word_grams(word):
+    if len(word) <= NGRAM_SIZE:
+        return [word]
+    return [word[i:i + NGRAM_SIZE] for i in range(len(word) - NGRAM_SIZE + 1)]
+
+
+def request_documents(r):
+    # One document for the request itself and one per work
+    info = r.get('applicant_info', {})
+    draft = r.get('status') == 'แบบร่าง'  # Only the owner may find a draft
+    docs = {r['id']: {
+        "type": "request", "req_id": r['id'], "work_index": None,
+        "label": r.get('applicant_name', ''), "status": r.get('status', ''), "applicant": r.get('applicant'), "draft": draft,
+        "fields": {
+            'id': r['id'], 'applicant_name': r.get('applicant_name', ''),
+            'department': info.get('department', ''), 'faculty': info.get('faculty', ''), 'status': r.get('status', '')
+        }
+    }}
+    for idx, w in enumerate(r.get('works', [])):
+        details = w.get('details', {})
+        docs[f"{r['id']}#{idx}"] = {
+            "type": "work", "req_id": r['id'], "work_index": idx,
+            "label": details.get('title', ''), "status": w.get('status', r.get('status', '')), "applicant": r.get('applicant'), "draft": draft,
+            "fields": {
+                'title': details.get('title', ''), 'journal_name': details.get('journal_name', ''),
+                'applicant_name': r.get('applicant_name', '')
+            }
+        }
+    return docs
+
+
+class SearchIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def __len__(self):
+        return len(self.req_docs)
+
+    def clear(self):
+        self.postings = {}       # gram -> {doc_key: weight}
+        self.word_docs = {}      # word -> {doc_key: weight}, for prefix matching
+        self.vocabulary = []     # sorted words
+        self.doc_terms = {}      # doc_key -> (grams, words), so a document can be removed
+        self.docs = {}           # doc_key -> result metadata
+        self.req_docs = {}       # req_id -> [doc_key]
+
+    def _add_doc(self, key, doc):
+        weights = WORK_FIELDS if doc['type'] == 'work' else REQUEST_FIELDS
+        grams = {}
+        words = {}
+        for field, weight in weights.items():
+            # A term counts once per document, at the weight of the best field it appears in
+            for word in split_words(doc['fields'].get(field)):
+                words[word] = max(words.get(word, 0), weight)
+                for g in word_grams(word):
+                    grams[g] = max(grams.get(g, 0), weight)
+        for g, wt in grams.items():
+            self.postings.setdefault(g, {})[key] = wt
+        for word, wt in words.items():
+            if word not in self.word_docs:
+                self.word_docs[word] = {}
+                bisect.insort(self.vocabulary, word)
+            self.word_docs[word][key] = wt
+        self.doc_terms[key] = (list(grams), list(words))
+        self.docs[key] = {k: v for k, v in doc.items() if k != 'fields'}
+
+    def _remove_doc(self, key):
+        grams, words = self.doc_terms.pop(key, ([], []))
+        for g in grams:
+            posting = self.postings.get(g)
+            if posting is not None:
+                posting.pop(key, None)
+                if not posting: del self.postings[g]
+        for word in words:
+            posting = self.word_docs.get(word)
+            if posting is not None:
+                posting.pop(key, None)
+                if not posting:
+                    del self.word_docs[word]
+                    i = bisect.bisect_left(self.vocabulary, word)
+                    if i < len(self.vocabulary) and self.vocabulary[i] == word:
+                        self.vocabulary.pop(i)
+        self.docs.pop(key, None)
+
+    def update_request(self, r):
+        with self.lock:
+            for key in self.req_docs.pop(r['id'], []):
+                self._remove_doc(key)
+            docs = request_documents(r)
+            for key, doc in docs.items():
+                self._add_doc(key, doc)
+            self.req_docs[r['id']] = list(docs)
+
+    def remove_request(self, req_id):
+        with self.lock:
+            for key in self.req_docs.pop(req_id, []):
+                self._remove_doc(key)
+
+    def rebuild(self, all_reqs):
+        with self.lock:
+            self.clear()
+            for r in all_reqs:
+                self.update_request(r)
+
+    def _score_word(self, word, n_docs, candidates=None):
+        # Documents matching one query word, with their score for it. With `candidates`
+        # (the documents that matched the previous words) only those are considered.
+        grams = sorted(set(word_grams(word)), key=lambda g: len(self.postings.get(g, ())))
+        needed = max(1, math.ceil(len(grams) * MIN_GRAM_MATCH))
+        scores = {}
+        matched = {}
+
+        # 1. N-gram matches, rarest grams first. Once too few grams remain for an unseen
+        #    document to reach the threshold, the common grams only rescore existing ones.
+        for i, g in enumerate(grams):
+            posting = self.postings.get(g)
+            if not posting: continue
+            idf = math.log(1 + n_docs / len(posting))
+            if candidates is None and len(grams) - i >= needed:
+                items = posting.items()
+            else:
+                pool = matched if candidates is None else candidates
+                items = ((key, posting[key]) for key in pool if key in posting)
+            for key, wt in list(items):
+                scores[key] = scores.get(key, 0) + idf * wt
+                matched[key] = matched.get(key, 0) + 1
+        scores = {k: v for k, v in scores.items() if matched[k] >= needed}
+
+        # 2. Prefix matches on whole words (covers short and partially typed words)
+        i = bisect.bisect_left(self.vocabulary, word)
+        end = min(i + PREFIX_EXPANSION_LIMIT, len(self.vocabulary))
+        while i < end and self.vocabulary[i].startswith(word):
+            vocab_word = self.vocabulary[i]
+            bonus = EXACT_WORD_BONUS if vocab_word == word else 1.0
+            for key, wt in self.word_docs[vocab_word].items():
+                if candidates is None or key in candidates:
+                    scores[key] = scores.get(key, 0) + bonus * wt
+            i += 1
+        return scores
+
+    def _selectivity(self, word):
+        return min(len(self.postings.get(g, ())) for g in word_grams(word))
+
+    def search(self, query, limit=20, applicant=None):
+        words = split_words(query)
+        if not words:
+            return []
+        with self.lock:
+            n_docs = max(len(self.docs), 1)
+            # Every query word has to match; the rarest word picks the candidates
+            scores = None
+            for word in sorted(set(words), key=self._selectivity):
+                word_scores = self._score_word(word, n_docs, scores)
+                scores = word_scores if scores is None else {k: scores[k] + v for k, v in word_scores.items()}
+                if not scores:
+                    return []
+
+            # With `applicant` only that user's documents (drafts included); without, no drafts
+            if applicant is None:
+                visible = ((key, score) for key, score in scores.items() if not self.docs[key]['draft'])
+            else:
+                visible = ((key, score) for key, score in scores.items() if self.docs[key]['applicant'] == applicant)
+            ranked = heapq.nlargest(limit, visible, key=lambda x: x[1])
+            return [dict(self.docs[key], score=round(score, 3)) for key, score in ranked]
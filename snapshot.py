@@ -0,0 +1,240 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import numpy as np
+from compact_records import decode_hook, json_default
+
+# Read-only snapshot of requests.json shared by all worker processes through mmap.
+# A generation is a base file plus an append-only log of the saves made since:
+#   base: header | uint64 offsets[count + 1] | compact JSON of each record, back to back
+#         | JSON list of record ids (only read when something is looked up by id)
+#   log:  "<position>\t<id>\t<record JSON>\n" per changed or added record, each save closed
+#         by "#\t<source mtime_ns>\t<count>\n"; readers apply a save only once its commit
+#         line is there, so they never see half of one.
+# A save appends only the records it changed. Once the log has replaced a large share of
+# the base, or records were removed, the next save writes a new base generation instead.
+# Nothing is fsynced: a snapshot is a cache of requests.json and is republished from it
+# whenever its source mtime does not match the file.
+#
+# Readers get a Snapshot: an immutable, lazily decoded sequence of the records as of one
+# save. The offsets table is read in place with numpy, so mapping costs no parsing and
+# a record is only decoded when it is read. CURRENT names the latest generation and is
+# swapped atomically.
+MAGIC = b'REQSNAP1'
+HEADER = struct.Struct('<8sQqQ')  # magic, record count, source mtime_ns, ids offset
+CURRENT_FILE = 'CURRENT'
+LOG_SUFFIX = '.log'
+KEEP_GENERATIONS = 2
+MAX_LOG_SHARE = 0.25  # New base once the log holds this share of the base's records
+MIN_LOG_RECORDS = 1000
+
+
+def encode_record(r):
+    return json.dumps(r, ensure_ascii=False, separators=(',', ':'), default=json_default).encode('utf-8')
+
+
+class BaseFile:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.source_mtime, self.ids_offset = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a requests snapshot")
+        self.offsets = np.frombuffer(self.buf, dtype='<u8', count=self.count + 1, offset=HEADER.size)
+        self.ids = None
+
+    def raw(self, i):
+        return self.buf[int(self.offsets[i]):int(self.offsets[i + 1])]
+
+    def position_of(self, req_id):
+        # id -> record position, built on first use
+        if self.ids is None:
+            self.ids = {req_id: i for i, req_id in enumerate(json.loads(self.buf[self.ids_offset:]))}
+        return self.ids.get(req_id)
+
+
+class Snapshot:
+    def __init__(self, base, log=None, patches=None, added=None, count=None, source_mtime=None, log_offset=0):
+        self.base = base
+        self.log = log                  # mmap of the log, or None while it is empty
+        self.patches = patches or {}    # position -> (start, end) of its record in the log
+        self.added = added or {}        # id -> position, for records added after the base
+        self.count = base.count if count is None else count
+        self.source_mtime = base.source_mtime if source_mtime is None else source_mtime
+        self.log_offset = log_offset    # Bytes of the log applied to this version
+
+    def __len__(self):
+        return self.count
+
+    def raw(self, i):
+        patch = self.patches.get(i)
+        if patch is not None:
+            return self.log[patch[0]:patch[1]]
+        return self.base.raw(i)
+
+    def __getitem__(self, i):
+        if i < 0: i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return json.loads(self.raw(i), object_hook=decode_hook)
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield json.loads(self.raw(i), object_hook=decode_hook)
+
+    def position_of(self, req_id):
+        position = self.added.get(req_id)
+        return position if position is not None else self.base.position_of(req_id)
+
+    def get(self, req_id):
+        """The record with this id, decoding only that record; None when there is none."""
+        position = self.position_of(req_id)
+        return self[position] if position is not None else None
+
+    def applied(self, log_path):
+        # This version with the saves appended to the log since it was made
+        try:
+            size = os.path.getsize(log_path)
+        except OSError:
+            return self
+        if size <= self.log_offset:
+            return self
+        with open(log_path, 'rb') as f:
+            log = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        patches, added = dict(self.patches), dict(self.added)
+        count, source_mtime, offset = self.count, self.source_mtime, self.log_offset
+        pending = []
+        pos = offset
+        while True:
+            end = log.find(b'\n', pos, size)
+            if end < 0:
+                break  # A save still being appended
+            if log[pos:pos + 2] == b'#\t':
+                _, mtime, total = log[pos:end].split(b'\t')
+                for position, req_id, start, stop in pending:
+                    patches[position] = (start, stop)
+                    if position >= self.base.count:
+                        added[req_id] = position
+                pending = []
+                count, source_mtime, offset = int(total), int(mtime), end + 1
+            else:
+                first = log.find(b'\t', pos, end)
+                second = log.find(b'\t', first + 1, end)
+                pending.append((int(log[pos:first]), log[first + 1:second].decode('utf-8'), second + 1, end))
+            pos = end + 1
+        if offset == self.log_offset:
+            return self
+        return Snapshot(self.base, log, patches, added, count, source_mtime, offset)
+
+
+def write_snapshot(path, all_reqs, source_mtime, previous=None, changed_ids=()):
+    # Records that did not change are copied byte-for-byte from the previous generation
+    reuse = {}
+    if previous is not None:
+        changed_ids = set(changed_ids)
+        reuse = {r['id']: previous.position_of(r['id']) for r in all_reqs if r['id'] not in changed_ids}
+    offsets = np.zeros(len(all_reqs) + 1, dtype='<u8')
+    data_start = HEADER.size + offsets.nbytes
+    with open(path, 'wb') as f:
+        f.seek(data_start)
+        pos = data_start
+        for i, r in enumerate(all_reqs):
+            old = reuse.get(r['id'])
+            chunk = previous.raw(old) if old is not None else encode_record(r)
+            f.write(chunk)
+            offsets[i] = pos
+            pos += len(chunk)
+        offsets[len(all_reqs)] = pos
+        f.write(json.dumps([r['id'] for r in all_reqs], ensure_ascii=False).encode('utf-8'))
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, len(all_reqs), source_mtime or 0, pos))
+        f.write(offsets.tobytes())
+
+
+class SnapshotStore:
+    def __init__(self, folder):
+        self.folder = folder
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.generation = None
+
+    def _current_generation(self):
+        try:
+            with open(os.path.join(self.folder, CURRENT_FILE), encoding='utf-8') as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def current(self):
+        # Remap when another process has published a newer generation, then apply its log
+        generation = self._current_generation()
+        with self.lock:
+            if generation and generation != self.generation:
+                try:
+                    self.snapshot = Snapshot(BaseFile(os.path.join(self.folder, generation)))
+                    self.generation = generation
+                except (OSError, ValueError):
+                    pass  # Deleted under us by a newer publish; keep the mapping we have
+            if self.snapshot is not None:
+                self.snapshot = self.snapshot.applied(os.path.join(self.folder, self.generation + LOG_SUFFIX))
+            return self.snapshot
+
+    def publish(self, all_reqs, source_mtime, changed_reqs=None):
+        """Makes all_reqs the current snapshot. With changed_reqs (the only records that
+        differ from the current snapshot) the save is appended to the generation's log.
+        Callers serialize publishes (the app holds its store lock)."""
+        previous = self.current() if changed_reqs is not None else None
+        if previous is not None and self._append(previous, all_reqs, source_mtime, changed_reqs):
+            return self.current()
+        os.makedirs(self.folder, exist_ok=True)
+        generation = f"requests-{time.time_ns()}-{os.getpid()}.snap"
+        path = os.path.join(self.folder, generation)
+        changed_ids = [r['id'] for r in changed_reqs or ()]
+        write_snapshot(path + '.tmp', all_reqs, source_mtime, previous, changed_ids)
+        os.replace(path + '.tmp', path)
+        pointer = os.path.join(self.folder, CURRENT_FILE)
+        with open(pointer + f'.{os.getpid()}', 'w', encoding='utf-8') as f:
+            f.write(generation)
+        os.replace(pointer + f'.{os.getpid()}', pointer)
+        self._prune(generation)
+        return self.current()
+
+    def _append(self, previous, all_reqs, source_mtime, changed_reqs):
+        # False when the save cannot be expressed as replaced and appended records
+        if len(previous.patches) + len(changed_reqs) > max(MIN_LOG_RECORDS, previous.base.count * MAX_LOG_SHARE):
+            return False
+        lines = []
+        count = previous.count
+        for r in changed_reqs:
+            position = previous.position_of(r['id'])
+            if position is None:
+                position = count
+                count += 1
+            if position >= len(all_reqs) or all_reqs[position]['id'] != r['id']:
+                return False  # Records were removed or reordered
+            lines.append(f"{position}\t{r['id']}\t".encode('utf-8') + encode_record(r) + b'\n')
+        if count != len(all_reqs):
+            return False
+        lines.append(f"#\t{source_mtime or 0}\t{count}\n".encode('utf-8'))
+        log_path = os.path.join(self.folder, self.generation + LOG_SUFFIX)
+        fd = os.open(log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, b''.join(lines))
+        finally:
+            os.close(fd)
+        return True
+
+    def _prune(self, current):
+        # Unlinking a file other workers still map is safe; they keep it until they remap
+        generations = sorted(n for n in os.listdir(self.folder) if n.startswith('requests-') and n.endswith('.snap'))
+        for name in generations[:-KEEP_GENERATIONS]:
+            if name != current:
+                for path in (name, name + LOG_SUFFIX):
+                    try:
+                        os.remove(os.path.join(self.folder, path))
+                    except OSError:
+                        pass
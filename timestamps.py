@@ -0,0 +1,159 @@
+import bisect
+import threading
+from datetime import datetime
+
+# Canonical timestamps. Every display date field (Thai "dd/mm/BBBB[ HH:MM]") gets an ISO
+# sibling "<field>_iso" ("YYYY-MM-DDTHH:MM", or "YYYY-MM-DD" for date-only fields) written
+# next to it. ISO strings sort and compare correctly as plain strings, so filtering and
+# ordering never parse Thai dates; Thai formatting happens in templates (thai_date filter).
+REQUEST_DATE_FIELDS = ('date', 'return_date', 'rejection_date', 'cancel_date', 'appeal_date')
+NOTIFICATION_DATE_FIELDS = ('timestamp',)
+BATCH_DATE_FIELDS = ('created_date',)
+ISO_SUFFIX = '_iso'
+
+
+def parse_display_date(value):
+    """Thai display date ("18/02/2569 09:53", "10/10/2555", "1/10/68") or ISO -> (datetime, has_time)."""
+    if not value or not isinstance(value, str):
+        return None, False
+    value = value.strip()
+    try:
+        if '-' in value:
+            dt = datetime.fromisoformat(value)
+            return dt, 'T' in value or ' ' in value
+        date_part, _, time_part = value.partition(' ')
+        d, m, y = (int(p) for p in date_part.split('/'))
+        if y < 100: y += 2500  # Abbreviated BE year
+        if y > 2400: y -= 543
+        hour, minute = (int(p) for p in time_part.split(':')[:2]) if time_part else (0, 0)
+        return datetime(y, m, d, hour, minute), bool(time_part)
+    except (ValueError, TypeError):
+        return None, False
+
+
+def to_iso(dt, include_time=True):
+    return dt.strftime('%Y-%m-%dT%H:%M') if include_time else dt.strftime('%Y-%m-%d')
+
+
+def stamp(record, fields):
+    """Sets <field>_iso from each display field; returns True when anything changed."""
+    changed = False
+    for field in fields:
+        iso_key = field + ISO_SUFFIX
+        dt, has_time = parse_display_date(record.get(field))
+        iso = to_iso(dt, has_time) if dt else None
+        if record.get(iso_key) != iso:
+            if iso is None:
+                record.pop(iso_key, None)
+            else:
+                record[iso_key] = iso
+            changed = True
+    return changed
+
+
+def thai_date(value, fallback=''):
+    """Jinja filter: ISO -> "dd/mm/BBBB HH:MM" (or "dd/mm/BBBB" for date-only values)."""
+    dt, has_time = parse_display_date(value) if value and '-' in str(value) else (None, False)
+    if dt is None:
+        return fallback or value or ''
+    y = dt.year + 543
+    return dt.strftime(f"%d/%m/{y} %H:%M") if has_time else dt.strftime(f"%d/%m/{y}")
+
+
+class DateIndex:
+    # Sorted (iso, req_id) pairs per request date field; range queries are two bisections
+    def __init__(self, fields=REQUEST_DATE_FIELDS):
+        self.lock = threading.RLock()
+        self.fields = fields
+        self.sorted = {f: [] for f in fields}
+        self.values = {}  # req_id -> {field: iso}
+        self.meta = {}    # req_id -> what a listing needs, so range queries never load requests
+        self.submitted = {}  # (applicant, fiscal year) -> ids of its requests that are not drafts
+
+    def __len__(self):
+        return len(self.values)
+
+    def _iso_values(self, r):
+        # Records saved before the migration only have the display string
+        values = {}
+        for field in self.fields:
+            iso = r.get(field + ISO_SUFFIX)
+            if iso is None and r.get(field):
+                dt, has_time = parse_display_date(r.get(field))
+                iso = to_iso(dt, has_time) if dt else None
+            if iso:
+                values[field] = iso
+        return values
+
+    @staticmethod
+    def _meta(r):
+        return {"applicant": r.get('applicant'), "applicant_name": r.get('applicant_name'),
+                "status": r.get('status'), "fiscal_year": r.get('fiscal_year')}
+
+    def _set_meta(self, req_id, meta):
+        self.meta[req_id] = meta
+        if meta['status'] != 'แบบร่าง':
+            self.submitted.setdefault((meta['applicant'], str(meta['fiscal_year'])), set()).add(req_id)
+
+    def update_request(self, r):
+        with self.lock:
+            self.remove_request(r['id'])
+            self._set_meta(r['id'], self._meta(r))
+            values = self.values[r['id']] = self._iso_values(r)
+            for field, iso in values.items():
+                bisect.insort(self.sorted[field], (iso, r['id']))
+
+    def remove_request(self, req_id):
+        with self.lock:
+            meta = self.meta.pop(req_id, None)
+            if meta is not None:
+                key = (meta['applicant'], str(meta['fiscal_year']))
+                ids = self.submitted.get(key)
+                if ids is not None:
+                    ids.discard(req_id)
+                    if not ids:
+                        del self.submitted[key]
+            for field, iso in self.values.pop(req_id, {}).items():
+                entries = self.sorted[field]
+                i = bisect.bisect_left(entries, (iso, req_id))
+                if i < len(entries) and entries[i] == (iso, req_id):
+                    entries.pop(i)
+
+    def rebuild(self, all_reqs):
+        with self.lock:
+            self.sorted = {f: [] for f in self.fields}
+            self.values = {}
+            self.meta = {}
+            self.submitted = {}
+            for r in all_reqs:
+                self._set_meta(r['id'], self._meta(r))
+                values = self.values[r['id']] = self._iso_values(r)
+                for field, iso in values.items():
+                    self.sorted[field].append((iso, r['id']))
+            for entries in self.sorted.values():
+                entries.sort()
+
+    def has_submitted(self, applicant, fiscal_year):
+        """Whether the applicant has a request other than a draft in that fiscal year."""
+        with self.lock:
+            return bool(self.submitted.get((applicant, str(fiscal_year))))
+
+    def range(self, field, start=None, end=None, applicant=None, limit=None, newest_first=True):
+        """Requests whose field falls in [start, end] (ISO dates or datetimes), with their listing fields."""
+        with self.lock:
+            entries = self.sorted[field]
+            lo = bisect.bisect_left(entries, (start,)) if start else 0
+            # A date-only end bound includes the whole day
+            hi = bisect.bisect_right(entries, (end + '\uffff',)) if end else len(entries)
+            window = entries[lo:hi]
+            if newest_first:
+                window.reverse()
+            results = []
+            for iso, req_id in window:
+                meta = self.meta[req_id]
+                if applicant and meta['applicant'] != applicant:
+                    continue
+                results.append({"req_id": req_id, field + ISO_SUFFIX: iso, **meta})
+                if limit and len(results) >= limit:
+                    break
+        return results
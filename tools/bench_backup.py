@@ -0,0 +1,171 @@
+"""Benchmark online backup and point-in-time restore on a generated data set.
+
+Usage: python tools/bench_backup.py [--requests 100000] [--uploads 200] [--max-restore-seconds 60]
+
+Generates the data set (plus evidence uploads and a change log with one entry per
+request), then: takes a full backup while a writer thread keeps rewriting files under
+the shared data lock, changes a little data, takes an incremental backup, and restores
+both backups into empty folders, checking the restored files byte for byte. Exits 1
+when a restore takes longer than --max-restore-seconds.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+from generate_data import generate  # noqa: E402
+from backup import BackupStore, data_files, shared_data_lock  # noqa: E402
+from changes import ChangeFeed, request_state  # noqa: E402
+
+
+def file_hashes(folder):
+    hashes = {}
+    for rel, _ in data_files(folder):
+        with open(os.path.join(folder, rel), 'rb') as f:
+            hashes[rel] = hashlib.sha256(f.read()).hexdigest()
+    return hashes
+
+
+def add_uploads(folder, count, size, seed):
+    rng = random.Random(seed)
+    for i in range(count):
+        path = os.path.join(folder, 'uploads', f'REQ-BENCH{i // 4:05d}', str(1700000000000 + i), f'evidence{i}.pdf')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(rng.randbytes(size))
+
+
+def rewrite_json(path, change):
+    # The same temp file + os.replace the app's save_data uses
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    change(data)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+    os.replace(temp_path, path)
+
+
+WRITER_FILES = ('notifications.json', 'batches.json')
+
+
+class Writer(threading.Thread):
+    # Stamps the same counter into both files as one write, like a request touching two stores;
+    # a consistent backup always holds equal counters
+    def __init__(self, folder):
+        super().__init__(daemon=True)
+        self.folder = folder
+        self.stop = threading.Event()
+        self.waits = []
+
+    def run(self):
+        while not self.stop.is_set():
+            started = time.perf_counter()
+            with shared_data_lock(self.folder):
+                self.waits.append((time.perf_counter() - started) * 1000)
+                for name in WRITER_FILES:
+                    rewrite_json(os.path.join(self.folder, name), lambda data: data[0].update(bench_write=len(self.waits)))
+            time.sleep(0.005)
+
+
+def writer_counters(folder):
+    counters = []
+    for name in WRITER_FILES:
+        with open(os.path.join(folder, name), encoding='utf-8') as f:
+            counters.append(json.load(f)[0].get('bench_write'))
+    return counters
+
+
+def timed_restore(store, manifest, expected, max_seconds):
+    target = tempfile.mkdtemp(prefix='bench-restore-')
+    try:
+        result = store.restore(manifest, target)
+        restored = file_hashes(target)
+    finally:
+        shutil.rmtree(target, ignore_errors=True)
+    mismatched = sorted(rel for rel in set(expected) | set(restored) if expected.get(rel) != restored.get(rel))
+    print(f"restore {manifest['id']}: {result['seconds']} s for {result['files']} files, "
+          f"{result['bytes'] / 2**20:.1f} MB; {len(mismatched)} mismatched files")
+    for rel in mismatched[:5]:
+        print(f"  mismatch: {rel}")
+    return not mismatched and result['seconds'] <= max_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=100000)
+    parser.add_argument('--uploads', type=int, default=200)
+    parser.add_argument('--upload-size', type=int, default=256 * 1024)
+    parser.add_argument('--max-restore-seconds', type=float, default=60)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix='bench-backup-')
+    dest = tempfile.mkdtemp(prefix='bench-backups-')
+    try:
+        started = time.perf_counter()
+        generate(folder, args.requests, args.seed)
+        add_uploads(folder, args.uploads, args.upload_size, args.seed)
+        with open(os.path.join(folder, 'requests.json'), encoding='utf-8') as f:
+            reqs = json.load(f)
+        feed = ChangeFeed(os.path.join(folder, 'changes.log'), lambda: [])
+        feed.record([{"type": "request.created", "id": r['id'], "record": request_state(r)} for r in reqs])
+        print(f"generated {len(reqs)} requests, {args.uploads} uploads in {time.perf_counter() - started:.1f}s")
+
+        store = BackupStore(dest)
+        writer = Writer(folder)
+        writer.start()
+        time.sleep(0.2)
+        started = time.perf_counter()
+        full = store.backup(folder)
+        full_seconds = time.perf_counter() - started
+        writer.stop.set()
+        writer.join()
+        print(f"full backup: {full_seconds:.2f} s, {full['bytes'] / 2**20:.1f} MB, "
+              f"{full['stored_bytes'] / 2**20:.1f} MB stored, writers held {full['lock_ms']} ms; "
+              f"writer lock waits max {max(writer.waits):.1f} ms over {len(writer.waits)} writes")
+        time.sleep(1.1)  # Keep the two backups apart at second resolution
+        state_after_full = file_hashes(folder)
+        rewrite_json(os.path.join(folder, 'requests.json'), lambda data: data[0].update(status='อนุมัติ'))
+        reqs[0]['status'] = 'อนุมัติ'
+        feed.record([{"type": "request.status_changed", "id": reqs[0]['id'], "record": request_state(reqs[0])}])
+        add_uploads(folder, 1, args.upload_size, args.seed + 1)
+        started = time.perf_counter()
+        incremental = store.backup(folder)
+        print(f"incremental backup: {time.perf_counter() - started:.2f} s, "
+              f"{incremental['stored_bytes'] / 2**20:.2f} MB stored, writers held {incremental['lock_ms']} ms")
+
+        ok = timed_restore(store, incremental, file_hashes(folder), args.max_restore_seconds)
+
+        # Point in time: the full backup, with the writer's two files from the same write
+        first = store.latest(full['created'])
+        target = tempfile.mkdtemp(prefix='bench-restore-')
+        try:
+            result = store.restore(first, target)
+            restored = file_hashes(target)
+            counters = writer_counters(target)
+        finally:
+            shutil.rmtree(target, ignore_errors=True)
+        expected = {rel: h for rel, h in state_after_full.items() if rel not in WRITER_FILES}
+        pit_ok = (first['id'] == full['id'] and counters[0] == counters[1]
+                  and {rel: h for rel, h in restored.items() if rel not in WRITER_FILES} == expected)
+        print(f"restore to {full['created']}: {result['seconds']} s, writer counters {counters}, "
+              f"{'matches' if pit_ok else 'DOES NOT match'} the full backup")
+        ok = ok and pit_ok and result['seconds'] <= args.max_restore_seconds
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+        shutil.rmtree(dest, ignore_errors=True)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Compare resident memory of plain-dict requests against compact records.
+
+Usage: python tools/bench_memory.py [--count 100000]
+
+Generates COUNT synthetic requests (cloned from requests.json with varied ids,
+names and titles), then loads them in a fresh subprocess per mode and reports the
+RSS growth, the load time and the time to read every work's details afterwards (what a
+page listing works does).
+"""
+import argparse
+import copy
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATUSES = ['ส่งแล้ว', 'รอตรวจประวัติการยื่นขอ', 'ผลงานผ่าน', 'อยู่ในรอบพิจารณา', 'อนุมัติ', 'ไม่อนุมัติ']
+
+
+def rss_kb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def generate(path, count):
+    with open(os.path.join(ROOT, 'requests.json'), encoding='utf-8') as f:
+        template = json.load(f)[0]
+    reqs = []
+    for i in range(count):
+        r = copy.deepcopy(template)
+        r['id'] = f"REQ-{i:08d}"
+        r['applicant'] = f"user{i % 2000:04d}"
+        r['applicant_name'] = f"อาจารย์ ทดสอบ {i % 2000}"
+        r['status'] = STATUSES[i % len(STATUSES)]
+        for j, w in enumerate(r['works']):
+            w['status'] = r['status']
+            w['details']['title'] = f"ผลงานวิจัยเรื่องที่ {i}-{j}"
+        reqs.append(r)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(reqs, f, ensure_ascii=False)
+
+
+def measure(mode, path):
+    sys.path.insert(0, ROOT)
+    from compact_records import load_compact_requests
+    before = rss_kb()
+    started = time.perf_counter()
+    if mode == 'dict':
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    else:
+        data = load_compact_requests(path)
+    elapsed = time.perf_counter() - started
+    rss_mb = round((rss_kb() - before) / 1024, 1)
+    started = time.perf_counter()
+    sum(len(w['details'].get('title', '')) for r in data for w in r['works'])
+    print(json.dumps({"mode": mode, "count": len(data), "rss_mb": rss_mb, "load_s": round(elapsed, 2),
+                      "read_s": round(time.perf_counter() - started, 2)}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--measure', choices=['dict', 'compact'])
+    parser.add_argument('--file')
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure, args.file)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'requests.json')
+        generate(path, args.count)
+        print(f"{args.count} requests, file size {os.path.getsize(path) / 1024 / 1024:.1f} MB")
+        results = {}
+        for mode in ('dict', 'compact'):
+            out = subprocess.run([sys.executable, __file__, '--measure', mode, '--file', path],
+                                 capture_output=True, text=True, check=True).stdout
+            results[mode] = json.loads(out)
+            print(f"{mode:8} RSS +{results[mode]['rss_mb']:7.1f} MB   load {results[mode]['load_s']:.2f}s"
+                  f"   read details {results[mode]['read_s']:.2f}s")
+        saved = 1 - results['compact']['rss_mb'] / results['dict']['rss_mb']
+        print(f"reduction {saved:.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""Benchmark the key routes at several data scales through the Flask test client.
+
+Usage: python tools/bench_routes.py [--scales 1000,10000,100000] [--iterations 30] [--output results.json]
+
+For each scale point a data set is generated with tools/generate_data.py into a
+temporary folder and the routes are driven in a fresh subprocess, so every scale
+starts from a cold process. Each route gets one untimed warm-up call (reported as
+"cold_ms"), then ITERATIONS timed calls for the latency percentiles. Peak Python
+allocation per route is measured with tracemalloc on one extra call; peak RSS is
+the process high-water mark after the route has run.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+from generate_data import generate  # noqa: E402
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def scenarios(appmod, rng):
+    """(name, role, username, call) tuples; call(client, i) issues one request."""
+    with open('requests.json', encoding='utf-8') as f:
+        reqs = json.load(f)
+    with open('batches.json', encoding='utf-8') as f:
+        batches = json.load(f)
+    with open('users.json', encoding='utf-8') as f:
+        applicants = [u['username'] for u in json.load(f) if u['role'] == 'applicant']
+    current_fy = str(appmod.get_current_fiscal_year())
+    req_ids = [r['id'] for r in reqs]
+    open_rounds = [b['id'] for b in batches if b['status'] != 'ประกาศผลแล้ว'] or [b['id'] for b in batches]
+    titles = [w['details']['title'] for r in reqs for w in r['works']]
+    # Applicants that have not filed this fiscal year yet, one per submit
+    fresh = sorted(set(applicants) - {r['applicant'] for r in reqs if r['fiscal_year'] == current_fy})
+    busy = rng.choice([r['applicant'] for r in reqs if r['fiscal_year'] == current_fy])
+    work = {"type": "research", "details": {"title": "", "journal_name": "วารสารทดสอบ", "database": "national",
+                                            "contribution": "first", "date_publish": "2025-06-01", "year_pub": "2568",
+                                            "evidence_type": "link", "evidence_url": "https://doi.org/10.1/bench"}}
+
+    def submit(c, i):
+        applicant = fresh.pop()
+        with c.session_transaction() as s:
+            s['username'] = applicant
+        w = json.loads(json.dumps(work))
+        w['details']['title'] = f"ผลงานทดสอบประสิทธิภาพ {applicant}"
+        return c.post('/new_request', data={"action": "submit", "works_data": json.dumps([w]), "certify": "on",
+                                            "academic_position": "ผู้ช่วยศาสตราจารย์", "fiscal_year_req": current_fy})
+
+    return [
+        ('dashboard[administration]', 'administration', 'staff01', lambda c, i: c.get('/dashboard')),
+        ('dashboard[research]', 'research', 'research01', lambda c, i: c.get('/dashboard')),
+        ('dashboard[committee]', 'committee', 'committee01', lambda c, i: c.get('/dashboard')),
+        ('dashboard[applicant]', 'applicant', busy, lambda c, i: c.get('/dashboard')),
+        ('view_request', 'administration', 'staff01', lambda c, i: c.get(f'/view_request/{rng.choice(req_ids)}')),
+        ('view_round', 'committee', 'committee01', lambda c, i: c.get(f'/view_round/{rng.choice(open_rounds)}')),
+        ('check_work_duplicate', 'research', 'research01',
+         lambda c, i: c.post('/api/check_work_duplicate', json={"title": rng.choice(titles), "req_id": rng.choice(req_ids)})),
+        ('new_request submit', 'applicant', None, submit),
+        ('notifications poll', 'applicant', busy, lambda c, i: c.get('/api/notifications')),
+    ], len(fresh)
+
+
+def run_scale(folder, iterations, seed):
+    os.chdir(folder)
+    sys.path.insert(0, ROOT)
+    import app as appmod
+    appmod.app.config['TESTING'] = True
+    rng = random.Random(seed)
+    routes, fresh_count = scenarios(appmod, rng)
+    results = []
+    for name, role, username, call in routes:
+        runs = iterations if name != 'new_request submit' else min(iterations, max(0, fresh_count - 2))
+        if runs <= 0:
+            continue
+        c = appmod.app.test_client()
+        with c.session_transaction() as s:
+            s['username'], s['role'], s['name'], s['position'] = username, role, 'ทดสอบ', ''
+        started = time.perf_counter()
+        status = call(c, -1).status_code
+        cold = (time.perf_counter() - started) * 1000
+        timings = []
+        for i in range(runs):
+            started = time.perf_counter()
+            response = call(c, i)
+            timings.append((time.perf_counter() - started) * 1000)
+            status = max(status, response.status_code)
+        tracemalloc.start()
+        call(c, runs)
+        peak_alloc = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results.append({
+            "route": name, "runs": runs, "status": status, "cold_ms": round(cold, 1),
+            "p50_ms": round(percentile(timings, 50), 1), "p95_ms": round(percentile(timings, 95), 1),
+            "p99_ms": round(percentile(timings, 99), 1), "max_ms": round(max(timings), 1),
+            "peak_alloc_mb": round(peak_alloc / 2**20, 1),
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        })
+    print(json.dumps(results))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scales', default='1000,10000,100000')
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output')
+    parser.add_argument('--run', help=argparse.SUPPRESS)  # Internal: bench an already generated folder
+    args = parser.parse_args()
+    if args.run:
+        run_scale(args.run, args.iterations, args.seed)
+        return
+
+    report = {}
+    for scale in [int(s) for s in args.scales.split(',')]:
+        folder = tempfile.mkdtemp(prefix=f'bench-{scale}-')
+        try:
+            started = time.perf_counter()
+            counts = generate(folder, scale, args.seed)
+            print(f"\n== {scale} requests ({counts['users']} users, {counts['batches']} rounds, "
+                  f"{counts['notifications']} notifications; generated in {time.perf_counter() - started:.1f}s)")
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), '--run', folder,
+                                  '--iterations', str(args.iterations), '--seed', str(args.seed)],
+                                 capture_output=True, text=True, check=True)
+            rows = json.loads(out.stdout.strip().splitlines()[-1])
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+        report[scale] = rows
+        print(f"{'route':<28}{'status':>7}{'cold':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'alloc MB':>10}{'RSS MB':>9}")
+        for r in rows:
+            print(f"{r['route']:<28}{r['status']:>7}{r['cold_ms']:>9}{r['p50_ms']:>9}{r['p95_ms']:>9}"
+                  f"{r['p99_ms']:>9}{r['peak_alloc_mb']:>10}{r['peak_rss_mb']:>9}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
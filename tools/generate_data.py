@@ -0,0 +1,252 @@
+"""Generate a realistic synthetic data set for load and scale testing.
+
+Usage: python tools/generate_data.py --requests 10000 --out /tmp/data [--seed 1]
+
+Writes requests.json, users.json, batches.json, notifications.json and a
+timeline.json whose current submission window is open, plus copies of
+criteria.json and work_types.json, into the output folder. Requests spread over
+ten fiscal years with one request per applicant per year. Past years are closed
+(announced, rejected or cancelled) and the current year covers every status.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import sys
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from timestamps import stamp, REQUEST_DATE_FIELDS, NOTIFICATION_DATE_FIELDS, BATCH_DATE_FIELDS  # noqa: E402
+YEARS = 10
+
+FIRST_NAMES = ['สมชาย', 'สมหญิง', 'สมศักดิ์', 'วิชัย', 'สุภาพร', 'กมล', 'ณัฐพล', 'ปิยะ', 'อรุณี', 'ธนพล', 'ศิริพร',
+               'จักรพันธ์', 'พิมพ์ชนก', 'วรวุฒิ', 'กิตติ', 'นันทนา', 'ประเสริฐ', 'อัญชลี', 'ชัยวัฒน์', 'มาลี']
+LAST_NAMES = ['ใจดี', 'รักเรียน', 'ศรีสุข', 'วงศ์ไทย', 'ทองดี', 'แก้วมณี', 'บุญมา', 'สุขสวัสดิ์', 'พรหมมา', 'จันทร์เพ็ญ',
+              'ประเสริฐวงศ์', 'ชัยมงคล', 'อินทร์แก้ว', 'เพชรรัตน์', 'มั่นคง']
+TITLES = ['นาย', 'นาง', 'นางสาว']
+POSITIONS = ['อาจารย์', 'ผู้ช่วยศาสตราจารย์', 'รองศาสตราจารย์', 'ศาสตราจารย์']
+FACULTIES = {
+    'วิทยาศาสตร์': ['วิทยาการคอมพิวเตอร์', 'คณิตศาสตร์', 'ฟิสิกส์', 'เคมี', 'ชีววิทยา'],
+    'วิศวกรรมศาสตร์': ['วิศวกรรมไฟฟ้า', 'วิศวกรรมโยธา', 'วิศวกรรมเครื่องกล'],
+    'ครุศาสตร์': ['การศึกษาปฐมวัย', 'หลักสูตรและการสอน'],
+    'มนุษยศาสตร์และสังคมศาสตร์': ['ภาษาไทย', 'ภาษาอังกฤษ', 'รัฐประศาสนศาสตร์']
+}
+TOPICS = ['การพัฒนา', 'การวิเคราะห์', 'การศึกษา', 'การออกแบบ', 'การประยุกต์ใช้', 'ผลของ', 'แนวทางการส่งเสริม']
+SUBJECTS = ['ระบบสารสนเทศ', 'การเรียนรู้เชิงลึก', 'พลังงานทดแทน', 'ชุมชนท้องถิ่น', 'ภาษาไทย', 'เกษตรอัจฉริยะ', 'น้ำบาดาล',
+            'การท่องเที่ยวเชิงวัฒนธรรม', 'สมุนไพรไทย', 'คณิตศาสตร์ประยุกต์', 'วัสดุนาโน', 'Machine Learning', 'IoT']
+CONTEXTS = ['ในจังหวัดภาคเหนือ', 'สำหรับผู้สูงอายุ', 'ในโรงเรียนขนาดเล็ก', 'ของวิสาหกิจชุมชน', 'ด้วยข้อมูลขนาดใหญ่', '']
+JOURNALS = ['วารสารวิทยาศาสตร์และเทคโนโลยี', 'วารสารวิจัยและพัฒนา', 'Journal of Applied Science',
+            'International Journal of Education', 'วารสารมนุษยศาสตร์', 'Energy Reports', 'IEEE Access']
+WORK_TYPES = ['research'] * 5 + ['textbook', 'creative', 'social', 'industry', 'teaching', 'policy', 'innovation']
+LEVEL_TYPES = ['social', 'industry', 'teaching', 'policy', 'innovation']
+
+# Current-year statuses and how often they occur; past years only keep the final ones
+CURRENT_STATUSES = [('แบบร่าง', 4), ('ส่งแล้ว', 12), ('แก้ไข', 5), ('ยกเลิก', 2), ('รอตรวจประวัติการยื่นขอ', 10),
+                    ('ผลงานผ่าน', 6), ('ผลงานซ้ำซ้อน', 2), ('ซ้ำซ้อนบางส่วน', 2), ('รอเสนอพิจารณา', 8),
+                    ('อยู่ในรอบพิจารณา', 10), ('รอการพิจารณา', 4), ('อนุมัติ', 15), ('อนุมัติบางส่วน', 6),
+                    ('ไม่อนุมัติ', 6), ('รอการอุทธรณ์', 4)]
+CLOSED_STATUSES = [('อนุมัติ', 60), ('อนุมัติบางส่วน', 15), ('ไม่อนุมัติ', 15), ('ยกเลิก', 10)]
+IN_ROUND = {'อยู่ในรอบพิจารณา', 'รอการพิจารณา'}
+ANNOUNCED = {'อนุมัติ', 'อนุมัติบางส่วน', 'ไม่อนุมัติ', 'รอการอุทธรณ์'}
+ROUND_SIZE = 60
+
+
+def thai_date(dt, include_time=False):
+    y = dt.year + 543
+    return dt.strftime(f"%d/%m/{y} %H:%M") if include_time else dt.strftime(f"%d/%m/{y}")
+
+
+def current_fiscal_year(now):
+    return now.year + 543 + (1 if now.month >= 10 else 0)
+
+
+def fiscal_year_start(fy):
+    return datetime(fy - 543 - 1, 10, 1)
+
+
+def make_users(rng, applicant_count):
+    users = [
+        {"username": "admin", "password": "123", "role": "admin", "name": "ผู้ดูแลระบบ"},
+        {"username": "staff01", "password": "123", "role": "administration", "name": "เจ้าหน้าที่ งานบุคคล"},
+        {"username": "research01", "password": "123", "role": "research", "name": "เจ้าหน้าที่ งานวิจัย"},
+        {"username": "committee01", "password": "123", "role": "committee", "name": "กรรมการ ประจำคณะ"}
+    ]
+    for i in range(applicant_count):
+        faculty = rng.choice(list(FACULTIES))
+        users.append({
+            "username": f"user{i + 1:06d}",
+            "password": "123",
+            "role": "applicant",
+            "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "title_name": rng.choice(TITLES),
+            "academic_position": rng.choices(POSITIONS, weights=[2, 5, 3, 1])[0],
+            "position_date": thai_date(datetime(2010, 1, 1) + timedelta(days=rng.randrange(4000))),
+            "position_number": str(rng.randrange(10000, 99999)),
+            "department": rng.choice(FACULTIES[faculty]),
+            "faculty": faculty
+        })
+    return users
+
+
+def make_work(rng, fy, work_id, status):
+    w_type = rng.choice(WORK_TYPES)
+    pub = fiscal_year_start(fy) - timedelta(days=rng.randrange(30, 400))
+    title = f"{rng.choice(TOPICS)}{rng.choice(SUBJECTS)}{rng.choice(CONTEXTS)} ({work_id % 100000})"
+    details = {"id": work_id, "title": title, "evidence_type": "link",
+               "evidence_url": f"https://doi.org/10.{rng.randrange(1000, 9999)}/{work_id}",
+               "date_publish": pub.strftime("%Y-%m-%d"), "year_pub": str(pub.year + 543)}
+    base = 1.0
+    if w_type == 'research':
+        details.update(journal_name=rng.choice(JOURNALS), vol=str(rng.randrange(1, 40)), issue=str(rng.randrange(1, 12)),
+                       month=str(pub.month), date_accept=(pub - timedelta(days=60)).strftime("%Y-%m-%d"),
+                       database=rng.choice(['scopus_q1_q2', 'scopus_other', 'national', 'national']))
+        base = {'scopus_q1_q2': 1.25, 'scopus_other': 1.0, 'national': 0.75}[details['database']]
+    elif w_type in LEVEL_TYPES:
+        details['level'] = rng.choice(['level_a_plus', 'level_a', 'level_b'])
+        base = {'level_a_plus': 1.25, 'level_a': 1.0, 'level_b': 0.75}[details['level']]
+    elif w_type == 'textbook':
+        details['publish_type'] = rng.choice(['inter', 'local'])
+        base = 1.25 if details['publish_type'] == 'inter' else 1.0
+    else:
+        details['publish_type'] = rng.choice(['inter', 'coop', 'national'])
+        base = {'inter': 1.25, 'coop': 1.0, 'national': 0.75}[details['publish_type']]
+    details['contribution'] = rng.choice(['first', 'corresponding', 'co'])
+    weight = 0.5 if details['contribution'] == 'co' else 1.0
+
+    if status in ('อนุมัติบางส่วน', 'ซ้ำซ้อนบางส่วน'):
+        work_status = rng.choice(['อนุมัติ', 'ไม่อนุมัติ'] if status == 'อนุมัติบางส่วน' else ['ผลงานผ่าน', 'ผลงานซ้ำซ้อน'])
+    elif status in ('แบบร่าง', 'ส่งแล้ว', 'แก้ไข', 'ยกเลิก', 'รอตรวจประวัติการยื่นขอ'):
+        work_status = 'รอตรวจสอบ'
+    elif status in ('รอเสนอพิจารณา', 'อยู่ในรอบพิจารณา', 'รอการพิจารณา'):
+        work_status = 'ผลงานผ่าน'
+    else:
+        work_status = status
+    rejected = work_status in ('ไม่อนุมัติ', 'ผลงานซ้ำซ้อน')
+    return {
+        "type": w_type, "details": details,
+        "base_score": base, "weight": weight, "score_calc": 0 if rejected else base * weight,
+        "score_breakdown": f"ฐาน {base} x น้ำหนัก {weight}", "payment_calc": 0, "status": work_status
+    }
+
+
+def compensation(criteria, position, score):
+    key = {'ผู้ช่วยศาสตราจารย์': 'asst_prof', 'รองศาสตราจารย์': 'assoc_prof', 'ศาสตราจารย์': 'prof'}.get(position)
+    tiers = criteria.get('payment_rules', {}).get(key, []) if key else []
+    fits = [t for t in tiers if score >= float(t.get('min_score', 0))]
+    return max((float(t.get('amount', 0)) for t in fits), default=0.0)
+
+
+def generate(out, count, seed=1):
+    rng = random.Random(seed)
+    now = datetime.now()
+    current_fy = current_fiscal_year(now)
+    years = list(range(current_fy - YEARS + 1, current_fy + 1))
+    per_year = math.ceil(count / YEARS)
+    applicant_count = max(20, math.ceil(per_year * 1.1))  # Some applicants have no current-year request yet
+    users = make_users(rng, applicant_count)
+    applicants = [u for u in users if u['role'] == 'applicant']
+    with open(os.path.join(ROOT, 'criteria.json'), encoding='utf-8') as f:
+        criteria = (json.load(f) or [{}])[0]
+
+    reqs, notifications, batches = [], [], []
+    work_id = 1700000000000
+    for fy in years:
+        n = min(per_year, count - len(reqs))
+        if n <= 0: break
+        start = fiscal_year_start(fy)
+        span = max(1, int(((min(now, start + timedelta(days=364)) - start).total_seconds())))
+        statuses = CURRENT_STATUSES if fy == current_fy else CLOSED_STATUSES
+        for i, user in enumerate(rng.sample(applicants, n)):
+            status = rng.choices([s for s, _ in statuses], weights=[w for _, w in statuses])[0]
+            submitted = start + timedelta(seconds=int(span * (i + rng.random()) / n))
+            works = []
+            for _ in range(rng.choices([1, 2, 3, 4], weights=[5, 3, 1, 1])[0]):
+                work_id += 1
+                works.append(make_work(rng, fy, work_id, status))
+            score = sum(w['score_calc'] for w in works)
+            amount = compensation(criteria, user['academic_position'], score)
+            r = {
+                "id": f"REQ-{submitted.year + 543}{submitted.strftime('%m%d%H%M%S')}{i % 100:02d}",
+                "applicant": user['username'],
+                "applicant_name": f"{user['title_name']} {user['name']}",
+                "applicant_info": {k: user[k] for k in ('title_name', 'academic_position', 'position_date',
+                                                        'position_number', 'department', 'faculty')},
+                "fiscal_year": str(fy), "works": works, "date": thai_date(submitted, True),
+                "status": status, "score": score, "suggested_compensation": amount, "comment": "",
+                "timeline_status": "ontime", "certify": True
+            }
+            if status in ANNOUNCED:
+                r['approved_amount'] = 0.0 if status == 'ไม่อนุมัติ' else amount
+                r['total_score'], r['total_compensation'] = score, r['approved_amount']
+            if status == 'แก้ไข':
+                r['return_date'] = thai_date(now - timedelta(days=rng.randrange(0, 10)))
+                r['comment'] = "กรุณาแนบหลักฐานการตีพิมพ์ให้ครบถ้วน"
+            if status == 'ไม่อนุมัติ':
+                r['rejection_date'] = thai_date(submitted + timedelta(days=60))
+                if fy != current_fy: r['appeal_closed'] = True
+            if status == 'ยกเลิก':
+                r['cancel_date'] = thai_date(submitted + timedelta(days=3), True)
+            if status == 'รอการอุทธรณ์':
+                r['appeal'] = {"reason": "ขอให้พิจารณาหลักฐานเพิ่มเติม", "date": thai_date(now, True), "status": "รอการพิจารณา"}
+            reqs.append(r)
+
+            notifications.append({"id": f"NOTIF-{r['id'][4:]}-{len(notifications):08x}",
+                                  "message": f"มีคำขอใหม่ {r['id']} จาก {r['applicant_name']}",
+                                  "recipient_role": "administration", "recipient_username": None, "req_id": r['id'],
+                                  "is_read": fy != current_fy or rng.random() < 0.5, "timestamp": r['date']})
+            if status not in ('แบบร่าง', 'ส่งแล้ว'):
+                notifications.append({"id": f"NOTIF-{r['id'][4:]}-{len(notifications):08x}",
+                                      "message": f"คำขอ {r['id']} มีการปรับสถานะเป็น {status}",
+                                      "recipient_role": None, "recipient_username": r['applicant'], "req_id": r['id'],
+                                      "is_read": rng.random() < 0.7, "timestamp": r['date']})
+
+        # Rounds: announced requests in closed rounds, in-round requests in open ones
+        for members, batch_status in (([r for r in reqs if r['fiscal_year'] == str(fy) and r['status'] in ANNOUNCED], 'ประกาศผลแล้ว'),
+                                      ([r for r in reqs if r['fiscal_year'] == str(fy) and r['status'] in IN_ROUND], 'รอการพิจารณา')):
+            for k in range(0, len(members), ROUND_SIZE):
+                chunk = members[k:k + ROUND_SIZE]
+                created = start + timedelta(days=30 + len(batches) % 300)
+                batch = {"id": f"ROUND-{created.strftime('%Y%m%d%H%M%S')}-{len(batches):05d}",
+                         "name": f"รายงานคำขอ รอบปีงบประมาณ {fy} ชุดที่ {k // ROUND_SIZE + 1}",
+                         "meeting_date": None, "fiscal_year": str(fy), "created_date": thai_date(created, True),
+                         "status": batch_status, "req_ids": [r['id'] for r in chunk]}
+                for r in chunk: r['batch_id'] = batch['id']
+                batches.append(batch)
+
+    timeline = [{"fiscal_year": str(fy),
+                 "start_date": thai_date(fiscal_year_start(fy)),
+                 "end_date": thai_date(fiscal_year_start(fy + 1) - timedelta(days=1)),
+                 "rounds": [{"name": "รอบยื่น", "type": "submission",
+                             "start_date": thai_date(fiscal_year_start(fy)),
+                             "end_date": thai_date(fiscal_year_start(fy + 1) - timedelta(days=1))}]}
+                for fy in years]
+
+    # Canonical ISO values next to the display dates, as the app writes them
+    for records, fields in ((reqs, REQUEST_DATE_FIELDS), (notifications, NOTIFICATION_DATE_FIELDS), (batches, BATCH_DATE_FIELDS)):
+        for record in records:
+            stamp(record, fields)
+
+    os.makedirs(out, exist_ok=True)
+    for name, data in (('requests.json', reqs), ('users.json', users), ('batches.json', batches),
+                       ('notifications.json', notifications), ('timeline.json', timeline)):
+        with open(os.path.join(out, name), 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+    for name in ('criteria.json', 'work_types.json'):
+        shutil.copy(os.path.join(ROOT, name), os.path.join(out, name))
+    return {"requests": len(reqs), "users": len(users), "batches": len(batches), "notifications": len(notifications)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--out', required=True)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    print(generate(args.out, args.requests, args.seed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,378 @@
+"""Multi-process load test with lost-update checks.
+
+Usage: python tools/load_test.py [--workers 4] [--clients 8] [--ops 20] [--requests 3000]
+                                [--backup-every SECONDS] [--keep]
+
+Generates a scratch data folder (tools/generate_data.py), sets aside a distinct set of
+target requests, rounds and notifications for every operation, starts gunicorn with
+WORKERS processes on it, and has CLIENTS client processes fire submit, pass, return,
+appeal, announce and notification-read operations concurrently over HTTP. After the
+server is stopped it checks the files on disk:
+
+  - every data file is still valid JSON
+  - every acknowledged operation left its state behind (no lost status transitions)
+  - every acknowledged operation's notification exists (no lost notifications)
+  - request ids are unique and every acknowledged submit produced exactly one request
+
+With --backup-every, online backups (backup.py) run against the data folder every
+SECONDS while the clients are busy; the report adds how long each backup waited for the
+data lock and held it, and a backup that times out waiting counts as a failure.
+
+The exit status is 1 when any invariant fails, so the script can gate worker-count changes.
+"""
+import argparse
+import base64
+import http.cookiejar
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import zlib
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+from generate_data import generate, current_fiscal_year, thai_date  # noqa: E402
+
+ROOT = os.path.dirname(ROOT)
+sys.path.insert(0, ROOT)
+from backup import BackupStore  # noqa: E402
+OPERATIONS = ['submit', 'pass', 'return', 'appeal', 'announce', 'read']
+# Flash message each operation shows when the app accepted it
+SUCCESS = {
+    'submit': 'บันทึกข้อมูลเรียบร้อยแล้ว',
+    'pass': 'ส่งต่อให้งานวิจัยเรียบร้อยแล้ว',
+    'return': 'ส่งคืนคำขอให้ผู้ยื่นแก้ไขแล้ว',
+    'appeal': 'ส่งคำอุทธรณ์เรียบร้อยแล้ว',
+    'announce': 'ประกาศผลการพิจารณาเรียบร้อยแล้ว'
+}
+ROUND_SIZE = 3
+
+
+def load(folder, name):
+    with open(os.path.join(folder, name), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def dump(folder, name, data):
+    with open(os.path.join(folder, name), 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+
+
+def prepare(folder, ops, seed):
+    """Reshape current-year requests into disjoint targets; returns the operation list."""
+    rng = random.Random(seed)
+    reqs, users = load(folder, 'requests.json'), load(folder, 'users.json')
+    batches, notifs = load(folder, 'batches.json'), load(folder, 'notifications.json')
+    fy = str(current_fiscal_year(datetime.now()))
+    # Only requests that are not in any round, so announcing a round cannot touch another target
+    in_rounds = {req_id for b in batches for req_id in b['req_ids']}
+    pool = [r for r in reqs if r['fiscal_year'] == fy and r['id'] not in in_rounds]
+    rng.shuffle(pool)
+    needed = ops * 3 + ops * ROUND_SIZE
+    if len(pool) < needed:
+        raise SystemExit(f"Only {len(pool)} current-year requests outside rounds, need {needed}: raise --requests")
+
+    plan = []
+    for kind in ('pass', 'return'):
+        for r in [pool.pop() for _ in range(ops)]:
+            r['status'] = 'ส่งแล้ว'
+            for w in r['works']: w['status'] = 'รอตรวจสอบ'
+            plan.append({"op": kind, "user": "staff01", "req_id": r['id']})
+    for r in [pool.pop() for _ in range(ops)]:
+        r['status'] = 'ไม่อนุมัติ'
+        r['rejection_date'] = thai_date(datetime.now())
+        r.pop('appeal_closed', None)
+        r.pop('batch_id', None)
+        for w in r['works']: w['status'] = 'ไม่อนุมัติ'
+        plan.append({"op": "appeal", "user": r['applicant'], "req_id": r['id']})
+    for i in range(ops):
+        members = [pool.pop() for _ in range(ROUND_SIZE)]
+        batch_id = f"ROUND-LOADTEST-{i:04d}"
+        for r in members:
+            r['status'] = 'อยู่ในรอบพิจารณา'
+            r['batch_id'] = batch_id
+            for w in r['works']: w['status'] = 'ผลงานผ่าน'
+        batches.insert(0, {"id": batch_id, "name": f"รอบทดสอบโหลด {i + 1}", "meeting_date": None, "fiscal_year": fy,
+                           "created_date": thai_date(datetime.now(), True), "status": "รอการพิจารณา",
+                           "req_ids": [r['id'] for r in members]})
+        plan.append({"op": "announce", "user": "committee01", "batch_id": batch_id})
+    # New applicants, so every submit is their first request this fiscal year
+    for i in range(ops):
+        username = f"load{i:05d}"
+        users.append({"username": username, "password": "123", "role": "applicant", "name": f"ทดสอบ โหลด{i}",
+                      "title_name": "นาย", "academic_position": "ผู้ช่วยศาสตราจารย์", "position_date": "01/01/2560",
+                      "position_number": str(90000 + i), "department": "วิทยาการคอมพิวเตอร์", "faculty": "วิทยาศาสตร์"})
+        plan.append({"op": "submit", "user": username, "title": f"ผลงานทดสอบโหลด {username}"})
+    unread = [n for n in notifs if n.get('recipient_username') and not n.get('is_read')]
+    for n in rng.sample(unread, min(ops, len(unread))):
+        plan.append({"op": "read", "user": n['recipient_username'], "notif_id": n['id']})
+
+    dump(folder, 'requests.json', reqs)
+    dump(folder, 'users.json', users)
+    dump(folder, 'batches.json', batches)
+    rng.shuffle(plan)
+    return plan
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def session_flashes(jar):
+    # Flask's session cookie is base64 JSON (zlib-compressed when prefixed with '.'), then signature
+    for cookie in jar:
+        if cookie.name != 'session': continue
+        value = cookie.value
+        compressed = value.startswith('.')
+        payload = value.lstrip('.').split('.')[0]
+        data = base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4))
+        session = json.loads(zlib.decompress(data) if compressed else data)
+        return json.dumps(session.get('_flashes', []), ensure_ascii=False)
+    return ''
+
+
+def call(opener, base, path, data=None, json_body=None):
+    headers = {}
+    if json_body is not None:
+        body, headers['Content-Type'] = json.dumps(json_body).encode(), 'application/json'
+    else:
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+    req = urllib.request.Request(base + path, data=body, headers=headers)
+    try:
+        with opener.open(req, timeout=120) as resp:
+            return resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def run_op(base, item, fy):
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar), _NoRedirect)
+    call(opener, base, '/login', {"username": item['user'], "password": "123"})
+    op = item['op']
+    started = time.perf_counter()
+    if op == 'submit':
+        work = {"type": "research", "details": {"title": item['title'], "journal_name": "วารสารทดสอบ", "database": "national",
+                                                "contribution": "first", "date_publish": "2025-06-01", "year_pub": "2568",
+                                                "evidence_type": "link", "evidence_url": "https://doi.org/10.1/load"}}
+        status, body = call(opener, base, '/new_request', {"action": "submit", "works_data": json.dumps([work]), "certify": "on",
+                                                            "academic_position": "ผู้ช่วยศาสตราจารย์", "fiscal_year_req": fy})
+    elif op in ('pass', 'return'):
+        status, body = call(opener, base, f"/view_request/{item['req_id']}", {"action": op, "comment": "ทดสอบโหลด"})
+    elif op == 'appeal':
+        status, body = call(opener, base, f"/view_request/{item['req_id']}",
+                            {"action": "submit_appeal", "appeal_reason": "ทดสอบโหลด", "appeal_evidence": ""})
+    elif op == 'announce':
+        status, body = call(opener, base, f"/view_round/{item['batch_id']}", {"action": "announce_results"})
+    else:
+        status, body = call(opener, base, f"/api/notifications/read/{item['notif_id']}", {})
+    elapsed = time.perf_counter() - started
+    if op == 'read':
+        acknowledged = status == 200 and json.loads(body or b'{}').get('success') is True
+    else:
+        acknowledged = status == 302 and SUCCESS[op] in session_flashes(jar)
+    return dict(item, status=status, acknowledged=acknowledged, seconds=elapsed)
+
+
+def client(args):
+    base, items, fy = args
+    results = []
+    for item in items:
+        try:
+            results.append(run_op(base, item, fy))
+        except Exception as e:  # Connection reset, timeout: counted as a failed operation
+            results.append(dict(item, status=0, acknowledged=False, seconds=0.0, error=str(e)))
+    return results
+
+
+def check_invariants(folder, results, initial_count):
+    violations = []
+    files = {}
+    for name in sorted(os.listdir(folder)):
+        if not name.endswith('.json'): continue
+        try:
+            files[name] = load(folder, name)
+        except ValueError as e:
+            violations.append(f"{name}: invalid JSON ({e})")
+    reqs = {}
+    for r in files.get('requests.json', []):
+        if r['id'] in reqs:
+            violations.append(f"duplicate request id {r['id']}")
+        reqs[r['id']] = r
+    notifs = files.get('notifications.json', [])
+    messages_by_req = {}
+    for n in notifs:
+        messages_by_req.setdefault(n.get('req_id'), []).append(n.get('message', ''))
+    read_state = {n['id']: n.get('is_read') for n in notifs}
+    batches = {b['id']: b for b in files.get('batches.json', [])}
+
+    def expect_notification(req_id, fragment, op):
+        if not any(fragment in m for m in messages_by_req.get(req_id, [])):
+            violations.append(f"{op} {req_id}: notification '{fragment}' lost")
+
+    submitted = 0
+    for res in results:
+        if not res['acknowledged']: continue
+        op = res['op']
+        if op == 'submit':
+            matches = [r for r in reqs.values() if any(w['details'].get('title') == res['title'] for w in r['works'])]
+            if len(matches) != 1:
+                violations.append(f"submit {res['user']}: {len(matches)} requests on disk, expected 1")
+            else:
+                submitted += 1
+                expect_notification(matches[0]['id'], 'มีคำขอใหม่', op)
+        elif op in ('pass', 'return', 'appeal'):
+            expected = {'pass': 'รอตรวจประวัติการยื่นขอ', 'return': 'แก้ไข', 'appeal': 'รอการอุทธรณ์'}[op]
+            actual = reqs.get(res['req_id'], {}).get('status')
+            if actual != expected:
+                violations.append(f"{op} {res['req_id']}: status {actual}, expected {expected} (lost update)")
+            fragment = {'pass': 'รอตรวจประวัติการยื่นขอ', 'return': 'ถูกส่งคืนแก้ไข', 'appeal': 'มีการยื่นอุทธรณ์'}[op]
+            expect_notification(res['req_id'], fragment, op)
+        elif op == 'announce':
+            batch = batches.get(res['batch_id'], {})
+            if batch.get('status') != 'ประกาศผลแล้ว':
+                violations.append(f"announce {res['batch_id']}: round status {batch.get('status')} (lost update)")
+            for req_id in batch.get('req_ids', []):
+                if reqs.get(req_id, {}).get('status') not in ('อนุมัติ', 'อนุมัติบางส่วน', 'ไม่อนุมัติ'):
+                    violations.append(f"announce {res['batch_id']}: {req_id} status {reqs.get(req_id, {}).get('status')} (lost update)")
+        elif op == 'read' and read_state.get(res['notif_id']) is not True:
+            violations.append(f"read {res['notif_id']}: is_read lost")
+    if len(reqs) != initial_count + submitted:
+        violations.append(f"{len(reqs)} requests on disk, expected {initial_count} + {submitted} submitted")
+    return violations
+
+
+def backup_loop(folder, every, stop, results):
+    # Backs the data folder up every `every` seconds until stop is set
+    store = BackupStore(tempfile.mkdtemp(prefix='loadtest-backups-'))
+    try:
+        while not stop.wait(every):
+            try:
+                m = store.backup(folder, lock_timeout=30)
+                results.append({"wait_ms": m['wait_ms'], "lock_ms": m['lock_ms']})
+            except TimeoutError as e:
+                results.append({"error": str(e)})
+    finally:
+        shutil.rmtree(store.folder, ignore_errors=True)
+
+
+def wait_until_up(base, server, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"gunicorn exited with {server.returncode}")
+        try:
+            with urllib.request.urlopen(base + '/login', timeout=5):
+                return
+        except OSError:
+            time.sleep(0.5)
+    raise SystemExit("gunicorn did not come up")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    if not ordered: return 0.0
+    k = (len(ordered) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--ops', type=int, default=20, help='operations of each kind')
+    parser.add_argument('--requests', type=int, default=3000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--backup-every', type=float, default=0, help='seconds between online backups (0: none)')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch folder')
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix='loadtest-')
+    generate(folder, args.requests, args.seed)
+    plan = prepare(folder, args.ops, args.seed)
+    initial_count = len(load(folder, 'requests.json'))
+    fy = str(current_fiscal_year(datetime.now()))
+
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, PYTHONPATH=ROOT, BIND=f"127.0.0.1:{port}", WEB_CONCURRENCY=str(args.workers),
+               PROFILE_SLOW_MS='0')
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+                               '--log-level', 'warning'], cwd=folder, env=env,
+                              stdout=subprocess.DEVNULL, stderr=open(os.path.join(folder, 'server.log'), 'w'))
+    backups, stop, backup_thread = [], threading.Event(), None
+    try:
+        wait_until_up(base, server)
+        shards = [(base, plan[i::args.clients], fy) for i in range(args.clients)]
+        if args.backup_every:
+            backup_thread = threading.Thread(target=backup_loop, args=(folder, args.backup_every, stop, backups))
+            backup_thread.start()
+        started = time.perf_counter()
+        with multiprocessing.Pool(args.clients) as pool:
+            results = [r for shard in pool.map(client, shards) for r in shard]
+        wall = time.perf_counter() - started
+    finally:
+        stop.set()
+        if backup_thread:
+            backup_thread.join()
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+
+    print(f"{len(results)} operations from {args.clients} clients against {args.workers} workers "
+          f"in {wall:.1f}s ({len(results) / wall:.1f} ops/s)")
+    print(f"{'operation':<12}{'ops':>6}{'acked':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for op in OPERATIONS:
+        rows = [r for r in results if r['op'] == op]
+        if not rows: continue
+        ms = [r['seconds'] * 1000 for r in rows]
+        print(f"{op:<12}{len(rows):>6}{sum(r['acknowledged'] for r in rows):>7}{percentile(ms, 50):>9.1f}"
+              f"{percentile(ms, 95):>9.1f}{percentile(ms, 99):>9.1f}{max(ms):>9.1f}")
+    errors = [r for r in results if not r['acknowledged']]
+    for r in errors[:10]:
+        print(f"  not acknowledged: {r['op']} {r.get('req_id') or r.get('batch_id') or r.get('notif_id') or r['user']}"
+              f" (HTTP {r['status']}{', ' + r['error'] if r.get('error') else ''})")
+
+    if args.backup_every:
+        done = [b for b in backups if 'error' not in b]
+        wait_ms, lock_ms = [b['wait_ms'] for b in done], [b['lock_ms'] for b in done]
+        print(f"\n{len(backups)} backups, {len(backups) - len(done)} timed out; "
+              f"lock wait p50 {percentile(wait_ms, 50):.1f} / max {max(wait_ms, default=0):.1f} ms, "
+              f"lock held p50 {percentile(lock_ms, 50):.1f} / max {max(lock_ms, default=0):.1f} ms")
+
+    violations = check_invariants(folder, results, initial_count)
+    violations += [f"backup: {b['error']}" for b in backups if 'error' in b]
+    if violations:
+        print(f"\nFAILED: {len(violations)} invariant violations")
+        for v in violations[:50]:
+            print(f"  {v}")
+    else:
+        print("\nOK: all invariants hold")
+    if args.keep:
+        print(f"Scratch data kept in {folder}")
+    else:
+        shutil.rmtree(folder, ignore_errors=True)
+    sys.exit(1 if violations else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Backfill canonical ISO timestamps next to the Thai display dates.
+
+Usage: python tools/migrate_dates.py [--data .] [--dry-run]
+
+Adds <field>_iso to every request date (date, return_date, rejection_date,
+cancel_date, appeal_date), notification timestamp and round created_date, in
+requests.json, notifications.json, batches.json and the archived fiscal years.
+Safe to run again: records that already carry matching ISO values are left alone.
+Run it while the app is stopped; the app keeps the values current from then on.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from timestamps import stamp, REQUEST_DATE_FIELDS, NOTIFICATION_DATE_FIELDS, BATCH_DATE_FIELDS  # noqa: E402
+from archive import ColdArchive  # noqa: E402
+
+FILES = [('requests.json', REQUEST_DATE_FIELDS), ('notifications.json', NOTIFICATION_DATE_FIELDS),
+         ('batches.json', BATCH_DATE_FIELDS)]
+
+
+def migrate_file(path, fields, dry_run):
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return 0, 0
+    with open(path, encoding='utf-8') as f:
+        records = json.load(f)
+    changed = sum(stamp(r, fields) for r in records)
+    if changed and not dry_run:
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), text=True)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(records, f, ensure_ascii=False, indent=4)
+        os.replace(temp_path, path)
+    return changed, len(records)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', default='.')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    for name, fields in FILES:
+        changed, total = migrate_file(os.path.join(args.data, name), fields, args.dry_run)
+        print(f"{name}: {changed} of {total} records updated")
+
+    archive = ColdArchive(os.path.join(args.data, 'archive'))
+    for fy in sorted(archive.years()):
+        records = archive.read_year(fy)
+        changed = sum(stamp(r, REQUEST_DATE_FIELDS) for r in records)
+        if changed and not args.dry_run:
+            archive.archive_year(fy, records)  # Replaces the archived copies in place
+        print(f"archive {fy}: {changed} of {len(records)} records updated")
+    if args.dry_run:
+        print("Dry run: nothing written")
+
+
+if __name__ == '__main__':
+    main()
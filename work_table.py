@@ -0,0 +1,171 @@
+import threading
+import numpy as np
+
+# Flattened, column-oriented copy of every work for cross-request analytics.
+# Categorical columns hold int32 codes into a per-column vocabulary; removed rows are
+# only masked out and the arrays are compacted once enough of them pile up.
+CATEGORICAL_COLUMNS = {
+    # column: function(request, work) -> value
+    'type': lambda r, w: w.get('type'),
+    'database': lambda r, w: w.get('details', {}).get('database'),
+    'level': lambda r, w: w.get('details', {}).get('level'),
+    'contribution': lambda r, w: w.get('details', {}).get('contribution'),
+    'status': lambda r, w: w.get('status'),
+    'request_status': lambda r, w: r.get('status'),
+    'fiscal_year': lambda r, w: str(r.get('fiscal_year', '')),
+    'year_pub': lambda r, w: str(w.get('details', {}).get('year_pub', '')),
+    'faculty': lambda r, w: r.get('applicant_info', {}).get('faculty'),
+    'department': lambda r, w: r.get('applicant_info', {}).get('department'),
+    'position': lambda r, w: r.get('applicant_info', {}).get('academic_position')
+}
+NUMERIC_COLUMNS = {
+    'score': lambda r, w: w.get('score_calc'),
+    'payment': lambda r, w: w.get('payment_calc')
+}
+INITIAL_CAPACITY = 1024
+COMPACT_RATIO = 0.5  # Compact when more than half of the used rows are dead
+
+
+def to_float(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class WorkTable:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self, capacity=INITIAL_CAPACITY):
+        self.size = 0
+        self.capacity = capacity
+        self.codes = {c: np.zeros(capacity, dtype=np.int32) for c in CATEGORICAL_COLUMNS}
+        self.values = {c: np.zeros(capacity, dtype=np.float64) for c in NUMERIC_COLUMNS}
+        self.work_index = np.zeros(capacity, dtype=np.int32)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.row_req = []        # row -> request id
+        self.req_rows = {}       # request id -> [row]
+        # Code 0 is reserved for missing values
+        self.vocab = {c: [None] for c in CATEGORICAL_COLUMNS}
+        self.vocab_index = {c: {None: 0} for c in CATEGORICAL_COLUMNS}
+
+    def __len__(self):
+        return len(self.req_rows)
+
+    def intern(self, column, value):
+        if value == '': value = None
+        index = self.vocab_index[column]
+        code = index.get(value)
+        if code is None:
+            code = index[value] = len(self.vocab[column])
+            self.vocab[column].append(value)
+        return code
+
+    def _grow(self, needed):
+        if needed <= self.capacity:
+            return
+        capacity = max(needed, self.capacity * 2)
+        for store in (self.codes, self.values):
+            for c, arr in store.items():
+                grown = np.zeros(capacity, dtype=arr.dtype)
+                grown[:self.size] = arr[:self.size]
+                store[c] = grown
+        for name in ('work_index', 'alive'):
+            arr = getattr(self, name)
+            grown = np.zeros(capacity, dtype=arr.dtype)
+            grown[:self.size] = arr[:self.size]
+            setattr(self, name, grown)
+        self.capacity = capacity
+
+    def _append_request(self, r):
+        works = r.get('works', [])
+        self._grow(self.size + len(works))
+        rows = []
+        for idx, w in enumerate(works):
+            row = self.size
+            for c, getter in CATEGORICAL_COLUMNS.items():
+                self.codes[c][row] = self.intern(c, getter(r, w))
+            for c, getter in NUMERIC_COLUMNS.items():
+                self.values[c][row] = to_float(getter(r, w))
+            self.work_index[row] = idx
+            self.alive[row] = True
+            self.row_req.append(r['id'])
+            rows.append(row)
+            self.size += 1
+        self.req_rows[r['id']] = rows
+
+    def remove_request(self, req_id):
+        with self.lock:
+            rows = self.req_rows.pop(req_id, [])
+            self.alive[rows] = False
+
+    def update_request(self, r):
+        with self.lock:
+            self.remove_request(r['id'])
+            self._append_request(r)
+            dead = self.size - int(self.alive[:self.size].sum())
+            if self.size and dead / self.size > COMPACT_RATIO:
+                self.compact()
+
+    def compact(self):
+        with self.lock:
+            keep = np.flatnonzero(self.alive[:self.size])
+            for store in (self.codes, self.values):
+                for c, arr in store.items():
+                    arr[:len(keep)] = arr[keep]
+            self.work_index[:len(keep)] = self.work_index[keep]
+            self.alive[:len(keep)] = True
+            self.alive[len(keep):] = False
+            self.row_req = [self.row_req[i] for i in keep]
+            # Requests without works have no rows but stay known, so len() keeps counting them
+            self.req_rows = {req_id: [] for req_id in self.req_rows}
+            for row, req_id in enumerate(self.row_req):
+                self.req_rows[req_id].append(row)
+            self.size = len(keep)
+
+    def rebuild(self, all_reqs):
+        with self.lock:
+            self.clear(max(INITIAL_CAPACITY, sum(len(r.get('works', [])) for r in all_reqs)))
+            for r in all_reqs:
+                self._append_request(r)
+
+    def mask(self, filters=None, score_range=None):
+        # filters: {column: [values]}; a value absent from the vocabulary matches nothing
+        m = self.alive[:self.size].copy()
+        for c, wanted in (filters or {}).items():
+            codes = [self.vocab_index[c][v] for v in wanted if v in self.vocab_index[c]]
+            m &= np.isin(self.codes[c][:self.size], codes)
+        if score_range:
+            low, high = score_range
+            score = self.values['score'][:self.size]
+            if low is not None: m &= score >= low
+            if high is not None: m &= score <= high
+        return m
+
+    def query(self, filters=None, group_by=None, score_range=None, limit=0):
+        with self.lock:
+            m = self.mask(filters, score_range)
+            score = self.values['score'][:self.size][m]
+            payment = self.values['payment'][:self.size][m]
+            result = {
+                "count": int(m.sum()),
+                "score_sum": round(float(score.sum()), 4),
+                "payment_sum": round(float(payment.sum()), 2)
+            }
+            if group_by:
+                codes = self.codes[group_by][:self.size][m]
+                n = len(self.vocab[group_by])
+                counts = np.bincount(codes, minlength=n)
+                scores = np.bincount(codes, weights=score, minlength=n)
+                payments = np.bincount(codes, weights=payment, minlength=n)
+                result['groups'] = [
+                    {"value": self.vocab[group_by][code], "count": int(counts[code]),
+                     "score_sum": round(float(scores[code]), 4), "payment_sum": round(float(payments[code]), 2)}
+                    for code in np.flatnonzero(counts)
+                ]
+            if limit:
+                rows = np.flatnonzero(m)[:limit]
+                result['works'] = [{"req_id": self.row_req[row], "work_index": int(self.work_index[row])} for row in rows]
+            return result